@@ -1,6 +1,27 @@
+import threading
+import copy
+import time
 import yaml
 import os
 
+# Parsed configuration files, keyed by file path, each as ((modification time, size), config dictionary).
+_config_files = {}
+_config_files_lock = threading.Lock()
+
+# Merged configuration contexts, keyed by (config file path, secrets file path), each as (time the files were last
+# checked for changes, context dictionary).
+_contexts = {}
+
+# Seconds a merged context is used before the files are checked for changes again.
+CHECK_INTERVAL = 1
+
+# Default for the typed accessors meaning the key must be set.
+_REQUIRED = object()
+
+# Strings accepted as booleans by 'get_bool', besides actual booleans.
+BOOLEAN_STRINGS = {"true": True, "yes": True, "on": True, "1": True,
+                   "false": False, "no": False, "off": False, "0": False}
+
 
 def load_yaml_config(config_filename):
     """Load a configuration Object from the config file.
@@ -16,25 +37,154 @@ def load_yaml_config(config_filename):
     return config
 
 
-def get_config_context():
-    """Load Configuration Context Object.
-
-    This loads the config.yml file to provide the configuration context, then it appends the secrets.yml configuration.
+def load_cached_yaml_config(config_filename):
+    """Load a configuration Object from the config file, only parsing the file again if its modification time or size
+    has changed since it was last loaded.  The returned dictionary is shared by every caller, so it must not be
+    modified.
 
     Returns
     -------
     config: dict
         Configuration Dictionary of Key Value Pairs
     """
+    stat = os.stat(config_filename)
+    version = (stat.st_mtime, stat.st_size)
+
+    with _config_files_lock:
+        cached = _config_files.get(config_filename)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    config = load_yaml_config(config_filename)
+    with _config_files_lock:
+        _config_files[config_filename] = (version, config)
+    return config
+
+
+def reload_config():
+    """Discard every cached configuration file, so that the next read parses them from disk again.  Edited files are
+    picked up without this, it is only needed when a file is replaced without changing its modification time or size.
+    """
+    with _config_files_lock:
+        _config_files.clear()
+        _contexts.clear()
+
+
+def _get_shared_config_context():
+    """Returns the configuration context from the cached files, without copying it.  The files are checked for changes
+    at most once every 'CHECK_INTERVAL' seconds, so most reads are dictionary lookups."""
     base_path = os.getenv("DATA_STORE_PATH")
     config_filename = os.getenv("ALT_CONFIG")
     if not config_filename:
         config_filename = base_path + "config.yml"
     secrets_filename = base_path + "secrets.yml"
 
+    key = (config_filename, secrets_filename)
+    now = time.time()
+    with _config_files_lock:
+        cached = _contexts.get(key)
+    if cached is not None and now - cached[0] < CHECK_INTERVAL:
+        return cached[1]
+
     # First we load the standard config yaml file.
-    config = load_yaml_config(config_filename)
+    config = dict(load_cached_yaml_config(config_filename))
     # And then append anything from the secrets yaml file.
-    config.update(load_yaml_config(secrets_filename))
+    config.update(load_cached_yaml_config(secrets_filename))
 
+    with _config_files_lock:
+        _contexts[key] = (now, config)
     return config
+
+
+def get_config_context():
+    """Load Configuration Context Object.
+
+    This loads the config.yml file to provide the configuration context, then it appends the secrets.yml configuration.
+    The files are only parsed again once they change (see 'load_cached_yaml_config'), and each caller gets its own copy
+    of the context, so it can be modified freely.  Code reading a few values on every call, such as a request handler,
+    should use 'get_value' or the typed accessors instead, which do not copy the context.
+
+    Returns
+    -------
+    config: dict
+        Configuration Dictionary of Key Value Pairs
+    """
+    return copy.deepcopy(_get_shared_config_context())
+
+
+def get_value(key_path, default=_REQUIRED):
+    """Get a single value from the configuration context, without copying the rest of it.
+
+    Parameters
+    ----------
+    key_path: string
+        Keys leading to the value, separated by dots, such as "database.DB_HOST".
+
+    default: object, optional
+        Returned if any of the keys is not set.  By default a missing key raises a KeyError.
+
+    Returns
+    -------
+    value: object
+        The configured value.  Lists and dictionaries are shared by every caller, so they must not be modified.
+    """
+    value = _get_shared_config_context()
+    for key in key_path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            if default is _REQUIRED:
+                raise KeyError("Configuration has no value for '%s'" % key_path)
+            return default
+        value = value[key]
+    return value
+
+
+def get_int(key_path, default=_REQUIRED):
+    """Get a configuration value as an integer, see 'get_value'.  Raises a ValueError if it is not a whole number."""
+    value = get_value(key_path, default)
+    if value is default and default is not _REQUIRED:
+        return value
+    try:
+        if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+            raise ValueError()
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError("Configuration value '%s' for '%s' is not an integer" % (value, key_path))
+
+
+def get_float(key_path, default=_REQUIRED):
+    """Get a configuration value as a float, see 'get_value'.  Raises a ValueError if it is not a number."""
+    value = get_value(key_path, default)
+    if value is default and default is not _REQUIRED:
+        return value
+    try:
+        if isinstance(value, bool):
+            raise ValueError()
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError("Configuration value '%s' for '%s' is not a number" % (value, key_path))
+
+
+def get_bool(key_path, default=_REQUIRED):
+    """Get a configuration value as a boolean, see 'get_value'.  Strings such as "true" and "no" are accepted (see
+    'BOOLEAN_STRINGS').  Raises a ValueError for anything else."""
+    value = get_value(key_path, default)
+    if value is default and default is not _REQUIRED:
+        return value
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (basestring, int)) and str(value).lower() in BOOLEAN_STRINGS:
+        return BOOLEAN_STRINGS[str(value).lower()]
+    raise ValueError("Configuration value '%s' for '%s' is not a boolean" % (value, key_path))
+
+
+def get_string(key_path, default=_REQUIRED):
+    """Get a configuration value as a string, see 'get_value'.  Numbers are converted, anything else raises a
+    ValueError."""
+    value = get_value(key_path, default)
+    if value is default and default is not _REQUIRED:
+        return value
+    if isinstance(value, basestring):
+        return value
+    if isinstance(value, (int, long, float)) and not isinstance(value, bool):
+        return str(value)
+    raise ValueError("Configuration value '%s' for '%s' is not a string" % (value, key_path))
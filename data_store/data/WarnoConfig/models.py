@@ -102,6 +102,7 @@ class Instrument(db.Model):
 
 class InstrumentLog(db.Model):
     __tablename__ = "instrument_logs"
+    __table_args__ = (db.Index("ix_instrument_logs_instrument_id_time", "instrument_id", "time"),)
 
     id = db.Column("log_number", db.Integer, primary_key=True)
     time = db.Column(db.DateTime, nullable=False)
@@ -143,6 +144,7 @@ class InstrumentDataReference(db.Model):
 
 class PulseCapture(db.Model):
     __tablename__ = "pulse_captures"
+    __table_args__ = (db.Index("ix_pulse_captures_instrument_id_time", "instrument_id", "time"),)
 
     id = db.Column(db.Integer, primary_key=True)
     instrument_id = db.Column(db.Integer, db.ForeignKey('instruments.instrument_id'), nullable=False)
@@ -174,6 +176,7 @@ class Alias(db.Model):
 
 class EventWithText(db.Model):
     __tablename__ = "events_with_text"
+    __table_args__ = (db.Index("ix_events_with_text_instrument_id_time", "instrument_id", "time"),)
 
     id = db.Column(db.Integer, primary_key=True)
     instrument_id = db.Column(db.Integer, db.ForeignKey('instruments.instrument_id'), nullable=False)
@@ -186,6 +189,9 @@ class EventWithText(db.Model):
 
 class EventWithValue(db.Model):
     __tablename__ = "events_with_value"
+    __table_args__ = (db.Index("ix_events_with_value_instrument_id_time", "instrument_id", "time"),
+                      db.Index("ix_events_with_value_instrument_id_event_code_time", "instrument_id", "event_code",
+                               "time"))
 
     id = db.Column(db.Integer, primary_key=True)
     instrument_id = db.Column(db.Integer, db.ForeignKey('instruments.instrument_id'), nullable=False)
@@ -196,8 +202,37 @@ class EventWithValue(db.Model):
     event_code = db.relationship(EventCode)
 
 
+class AttributeRollup(db.Model):
+    __tablename__ = "attribute_rollups"
+    __table_args__ = (db.Index("ix_attribute_rollups_lookup", "instrument_id", "table_name", "attribute", "granularity",
+                               "bucket_start", unique=True),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    instrument_id = db.Column(db.Integer, db.ForeignKey('instruments.instrument_id'), nullable=False)
+    table_name = db.Column(db.String, nullable=False)
+    attribute = db.Column(db.String, nullable=False)
+    granularity = db.Column(db.String, nullable=False)
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    count = db.Column(db.BigInteger, nullable=False)
+    sum = db.Column(db.Float)
+    # Sum of the squared differences of the bucket's values from their average
+    sum_of_squared_deviations = db.Column(db.Float)
+    minimum = db.Column(db.Float)
+    maximum = db.Column(db.Float)
+    instrument = db.relationship(Instrument)
+
+
+class RollupProgress(db.Model):
+    __tablename__ = "rollup_progress"
+
+    instrument_id = db.Column(db.Integer, db.ForeignKey('instruments.instrument_id'), primary_key=True)
+    rolled_up_until = db.Column(db.DateTime, nullable=False)
+    instrument = db.relationship(Instrument)
+
+
 class ProsensingPAF(db.Model):
     __tablename__ = "prosensing_paf"
+    __table_args__ = (db.Index("ix_prosensing_paf_instrument_id_time", "instrument_id", "time"),)
     id = db.Column("packet_id", db.Integer, primary_key=True)
     time = db.Column(db.DateTime, nullable=False)
     site_id = db.Column(db.Integer, db.ForeignKey('sites.site_id'), nullable=False)
@@ -571,6 +606,7 @@ class ProsensingPAF(db.Model):
 
 class IrisBite(db.Model):
     __tablename__ = "iris_bite"
+    __table_args__ = (db.Index("ix_iris_bite_instrument_id_time", "instrument_id", "time"),)
     id = db.Column("packet_id", db.Integer, primary_key=True)
     time = db.Column(db.DateTime, nullable=False)
     site_id = db.Column(db.Integer, db.ForeignKey('sites.site_id'), nullable=False)
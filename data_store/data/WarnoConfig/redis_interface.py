@@ -1,17 +1,81 @@
-from __future__ import print_function
-
+import os
+import copy
+import logging
+import calendar
 import ciso8601
 import datetime
 import redis
 import pytz
 
+logger = logging.getLogger(__name__)
+
+# Connection pools created by 'get_process_connection_pool', keyed by the id of the process that created them.
+_process_connection_pools = {}
+
+
+def get_process_connection_pool(host='localhost', port=6379, max_connections=10, timeout=5, socket_timeout=5,
+                                socket_connect_timeout=5, health_check_interval=30):
+    """Returns the Redis connection pool for the current process, creating it the first time it is asked for.  Each
+    process gets its own pool, as connections can not be shared with processes forked from the one that opened them,
+    such as the workers of a web server.  Every RedisInterface created with the pool reuses its connections, rather
+    than opening a new connection for each interface.
+
+    The pool holds at most 'max_connections' connections.  If all of them are in use, a request for another connection
+    waits up to 'timeout' seconds for one to be returned, then raises a redis.ConnectionError.  The settings only take
+    effect when the pool is created.
+
+    Parameters
+    ----------
+
+    host: string, optional
+        The hostname of the Redis server to connect to. Default is 'localhost'.
+
+    port: integer, optional
+        The port of the Redis server to connect to. Default Redis port is 6379.
+
+    max_connections: integer, optional
+        Maximum number of connections the pool opens. Default is 10.
+
+    timeout: integer, optional
+        Seconds to wait for a free connection when every connection is in use. Default is 5.
+
+    socket_timeout: integer, optional
+        Seconds to wait for a response from Redis before giving up on a command. Default is 5.
+
+    socket_connect_timeout: integer, optional
+        Seconds to wait when opening a new connection. Default is 5.
+
+    health_check_interval: integer, optional
+        A connection that has been idle for this many seconds is checked with a PING before it is used again, so that
+        connections dropped by the server are replaced rather than failing a request. Default is 30.
+
+    Returns
+    -------
+
+    pool: redis.BlockingConnectionPool
+        The current process's connection pool.
+
+    """
+    pool = _process_connection_pools.get(os.getpid())
+    if pool is None:
+        pool = redis.BlockingConnectionPool(host=host, port=port, max_connections=max_connections, timeout=timeout,
+                                            socket_timeout=socket_timeout,
+                                            socket_connect_timeout=socket_connect_timeout,
+                                            health_check_interval=health_check_interval)
+        _process_connection_pools[os.getpid()] = pool
+    return pool
+
 
 class RedisInterface:
     MAX_ENTRIES = 21600  # 15 days at 1 entry per minute
     MAX_INDEX = MAX_ENTRIES - 1
+    # 'list' keeps parallel lists of times and values, 'sorted_set' keeps one sorted set of entries scored by time.
+    STORAGE_MODES = ["list", "sorted_set"]
+    # Separates the time from the value in each sorted set member, '<time>|<value>'.
+    MEMBER_SEPARATOR = "|"
     _r = None
 
-    def __init__(self, host='localhost', port=6379):
+    def __init__(self, host='localhost', port=6379, storage="list", connection_pool=None):
         """Initialize RedisInterface by connecting to a Redis server before any other actions.
 
         Parameters
@@ -23,8 +87,69 @@ class RedisInterface:
         port: integer, optional
             The port of the Redis server to connect to. Default Redis port is 6379.
 
+        storage: string, optional
+            How attribute values are stored, one of STORAGE_MODES. Default is 'list'.  With 'list', the times and values
+            for an attribute are kept in two Redis lists, 'instruments:<instrument_id>:<attribute>:time' and
+            'instruments:<instrument_id>:<attribute>:value'.  With 'sorted_set', they are kept together in one sorted
+            set, 'instruments:<instrument_id>:<attribute>:series', with each member of the form '<time>|<value>' scored
+            by its time in seconds since the epoch, so that the entries between two times can be fetched directly.
+            Table organized times are kept in 'instruments:<instrument_id>:<table_name>:series' in the same way.
+
+        connection_pool: redis.ConnectionPool, optional
+            Pool to take connections from, such as one from 'get_process_connection_pool'.  If given, 'host' and 'port'
+            are ignored.  By default the interface gets its own pool.
+
+        """
+        if storage not in self.STORAGE_MODES:
+            raise ValueError("Redis storage mode must be one of %s, not '%s'"
+                             % (", ".join(self.STORAGE_MODES), storage))
+        self.storage = storage
+        if connection_pool is not None:
+            self._r = redis.Redis(connection_pool=connection_pool)
+        else:
+            self._r = redis.Redis(host, port)
+
+    def pipeline(self):
+        """Return a copy of this interface whose commands are buffered in a single, non-transactional Redis pipeline
+        instead of being sent to the server one at a time.  Nothing is written until 'execute' is called on the returned
+        interface, so it should only be used for writes; any reads made through it return the pipeline rather than a
+        value.
+
+        Returns
+        -------
+
+        buffered_interface: RedisInterface
+            Interface sharing this interface's connection pool, with all commands queued on one pipeline.
+
+        """
+        buffered_interface = copy.copy(self)
+        buffered_interface._r = self._r.pipeline(transaction=False)
+        return buffered_interface
+
+    def execute(self):
+        """Send every command buffered by an interface returned from 'pipeline' to Redis in one round trip.
+
+        Returns
+        -------
+
+        results: list
+            The result of each buffered command, in the order the commands were queued.
+
         """
-        self._r = redis.Redis(host, port)
+        return self._r.execute()
+
+    def extend(self, buffered_interface):
+        """Move every command buffered by another interface returned from 'pipeline' onto the end of this interface's
+        pipeline, in the order they were queued, so they are sent by this interface's 'execute' instead.
+
+        Parameters
+        ----------
+        buffered_interface: RedisInterface
+            Interface returned by 'pipeline', whose buffered commands are moved.  Left with nothing buffered.
+
+        """
+        self._r.command_stack.extend(buffered_interface._r.command_stack)
+        buffered_interface._r.reset()
 
     def get_most_recent_value_for_attribute(self, instrument_id, attribute, table_name=None):
         """Return the most recent value for each of the given 'attribute' for the specified 'instrument_id'. If
@@ -53,7 +178,7 @@ class RedisInterface:
         """
 
         if not isinstance(attribute, str) and not isinstance(attribute, unicode):
-            print("Attribute must be a string.")
+            logger.warning("Attribute must be a string, not %r.", attribute)
             return {}
 
         clean_instrument_id = self._create_clean_integer(instrument_id,
@@ -63,26 +188,7 @@ class RedisInterface:
 
         # If the instrument id or an attribute does not match the Redis database entries, the return for that
         # id/attribute combination will be invalid and will return an empty entry.
-
-        result = {}
-        # If the attribute is part of a table organization, slight modification to the access keys.
-        # Either way, get the list of times and list of values for the attribute, returning the most recent pair.
-        if table_name:
-            db_time_key = self._build_table_time_key(clean_instrument_id, table_name)
-
-            db_base_key = self._build_base_attribute_key(clean_instrument_id, attribute, table_name=table_name)
-            db_value = self._r.lindex(db_base_key + ":value", 0)
-            db_time = self._r.lindex(db_time_key, 0)
-        else:
-            db_base_key = self._build_base_attribute_key(clean_instrument_id, attribute)
-            db_value = self._r.lindex(db_base_key + ":value", 0)
-            db_time = self._r.lindex(db_base_key + ":time", 0)
-
-        if db_value and db_time:
-            if (len(db_value) > 0) and (len(db_time) > 0):
-                result = dict(time=db_time, value=db_value)
-
-        return result
+        return self.get_most_recent_values([(clean_instrument_id, attribute, table_name)])[0]
 
     def get_values_for_attribute_between_times(self, instrument_id, attribute, start_time, end_time, table_name=None):
         """Return the list of all values for the specified 'attribute' for the specified 'instrument_id' with times
@@ -118,7 +224,7 @@ class RedisInterface:
         """
         if end_time < start_time:
             # The times are input incorrectly.  An end time before a start time is a mistake
-            print("Start time must be before or the same as the end time.")
+            logger.warning("Start time %s must be before or the same as the end time %s.", start_time, end_time)
             return []
 
         clean_instrument_id = self._create_clean_integer(instrument_id,
@@ -127,25 +233,137 @@ class RedisInterface:
         if not clean_instrument_id:
             return []
 
-        if table_name:
-            db_time_key = self._build_table_time_key(instrument_id, table_name)
-            db_base_key = self._build_base_attribute_key(instrument_id, attribute, table_name=table_name)
-            db_times = self._r.lrange(db_time_key, 0, self.MAX_INDEX)
-            db_values = self._r.lrange(db_base_key + ":value", 0, self.MAX_INDEX)
-        else:
-            db_base_key = self._build_base_attribute_key(clean_instrument_id, attribute)
-            db_times = self._r.lrange(db_base_key + ":time", 0, self.MAX_INDEX)
-            db_values = self._r.lrange(db_base_key + ":value", 0, self.MAX_INDEX)
-        db_time_value_pairs = zip(db_times, db_values)
+        return self.get_values_between_times([(clean_instrument_id, attribute, table_name)], start_time, end_time)[0]
 
-        start_time_unaware = start_time.replace(tzinfo=None)
-        end_time_unaware = end_time .replace(tzinfo=None)
+    def get_most_recent_values(self, attribute_requests):
+        """Return the most recent value for each of many attributes, of one or more instruments, fetching every one of
+        them from Redis in a single round trip.
 
-        result = [(entry_time, entry_value) for entry_time, entry_value in db_time_value_pairs
-                  if (ciso8601.parse_datetime(entry_time) >= start_time_unaware)
-                  and (ciso8601.parse_datetime(entry_time) <= end_time_unaware)]
+        Parameters
+        ----------
 
-        return result
+        attribute_requests: list of tuples
+            One (instrument_id, attribute, table_name) tuple for each attribute, where 'table_name' is the name of the
+            table the attribute is grouped under, or None if it is not grouped under a table.
+
+        Returns
+        -------
+
+        results: list of dictionaries
+            One entry for each of 'attribute_requests', in the same order.  Each is of the form
+            '{ "time": <time of value>, "value": <the value itself> }', or empty if the attribute has no values.
+
+        """
+        pipe = self._r.pipeline(transaction=False)
+        # Number of commands queued for each request, so the responses can be matched back to their requests.
+        queued_commands = []
+        for instrument_id, attribute, table_name in attribute_requests:
+            clean_instrument_id = self._create_clean_integer(instrument_id,
+                                                             "Could not convert instrument ID to valid integer.")
+            if not clean_instrument_id:
+                queued_commands.append(0)
+                continue
+
+            db_base_key = self._build_base_attribute_key(clean_instrument_id, attribute, table_name=table_name)
+            if self.storage == "sorted_set":
+                pipe.zrevrange(db_base_key + ":series", 0, 0)
+                queued_commands.append(1)
+            else:
+                # If the attribute is part of a table organization, its times are kept under the table.
+                if table_name:
+                    db_time_key = self._build_table_time_key(clean_instrument_id, table_name)
+                else:
+                    db_time_key = db_base_key + ":time"
+                pipe.lindex(db_time_key, 0)
+                pipe.lindex(db_base_key + ":value", 0)
+                queued_commands.append(2)
+
+        responses = iter(pipe.execute())
+        results = []
+        for command_count in queued_commands:
+            db_time, db_value = None, None
+            if command_count == 1:
+                db_entries = next(responses)
+                if db_entries:
+                    db_time, db_value = self._split_series_member(db_entries[0])
+            elif command_count == 2:
+                db_time, db_value = next(responses), next(responses)
+
+            if db_time and db_value:
+                results.append(dict(time=db_time, value=db_value))
+            else:
+                results.append({})
+
+        return results
+
+    def get_values_between_times(self, attribute_requests, start_time, end_time):
+        """Return the values between 'start_time' and 'end_time' for each of many attributes, of one or more
+        instruments, fetching every one of them from Redis in a single round trip.
+
+        Parameters
+        ----------
+
+        attribute_requests: list of tuples
+            One (instrument_id, attribute, table_name) tuple for each attribute, where 'table_name' is the name of the
+            table the attribute is grouped under, or None if it is not grouped under a table.
+
+        start_time: datetime.datetime
+            The start time (UTC) to compare against.  Expected to be already translated into UTC
+
+        end_time: datetime.datetime
+            The end time (UTC) to compare against.  Expected to be already translated into UTC
+
+        Returns
+        -------
+
+        results: list of lists
+            One list for each of 'attribute_requests', in the same order, holding the attribute's (time, value) entries
+            between 'start_time' and 'end_time', newest first.
+
+        """
+        if end_time < start_time:
+            # The times are input incorrectly.  An end time before a start time is a mistake
+            logger.warning("Start time %s must be before or the same as the end time %s.", start_time, end_time)
+            return [[] for _ in attribute_requests]
+
+        pipe = self._r.pipeline(transaction=False)
+        queued_requests = []
+        for instrument_id, attribute, table_name in attribute_requests:
+            clean_instrument_id = self._create_clean_integer(instrument_id,
+                                                             "Could not convert instrument ID to valid integer.")
+            queued_requests.append(bool(clean_instrument_id))
+            if not clean_instrument_id:
+                continue
+
+            db_base_key = self._build_base_attribute_key(clean_instrument_id, attribute, table_name=table_name)
+            if self.storage == "sorted_set":
+                # Entries are scored by time, so only the entries in the time range are fetched, newest first to match
+                # the order of the lists.
+                pipe.zrevrangebyscore(db_base_key + ":series", self._time_score(end_time), self._time_score(start_time))
+            else:
+                if table_name:
+                    db_time_key = self._build_table_time_key(clean_instrument_id, table_name)
+                else:
+                    db_time_key = db_base_key + ":time"
+                pipe.lrange(db_time_key, 0, self.MAX_INDEX)
+                pipe.lrange(db_base_key + ":value", 0, self.MAX_INDEX)
+
+        start_time_unaware = start_time.replace(tzinfo=None)
+        end_time_unaware = end_time.replace(tzinfo=None)
+
+        responses = iter(pipe.execute())
+        results = []
+        for queued in queued_requests:
+            if not queued:
+                results.append([])
+            elif self.storage == "sorted_set":
+                results.append([self._split_series_member(entry) for entry in next(responses)])
+            else:
+                db_time_value_pairs = zip(next(responses), next(responses))
+                results.append([(entry_time, entry_value) for entry_time, entry_value in db_time_value_pairs
+                                if start_time_unaware <= ciso8601.parse_datetime(entry_time) <= end_time_unaware])
+
+        return results
 
     def add_values_for_attribute(self, instrument_id, attribute, given_times, values):
         """ Adds values to the Redis database for an attribute of an instrument. Values and their times are expected to
@@ -206,6 +424,11 @@ class RedisInterface:
         iso_format_times = [given_time.isoformat() for given_time in given_time_list]
 
         base_key = self._build_base_attribute_key(clean_instrument_id, attribute)
+
+        if self.storage == "sorted_set":
+            self._add_series_entries(self._r, "".join([base_key, ":series"]), given_time_list, value_list)
+            return
+
         time_key = "".join([base_key, ":time"])
         value_key = "".join([base_key, ":value"])
 
@@ -281,22 +504,34 @@ class RedisInterface:
         if not isinstance(given_time, datetime.datetime):
             return
 
-        # Entries are much faster to parse back out if they are stored in ISO 8601 format.
-        iso_format_time = given_time.isoformat()
+        # Every write for the set of values is queued on one pipeline and sent in a single round trip, rather than
+        # sending a push and a trim for each attribute separately.
+        pipe = self._buffered_client()
 
-        time_key = self._build_table_time_key(instrument_id, table_name)
-        self._r.lpush(time_key, iso_format_time)
-        self._r.ltrim(time_key, 0, self.MAX_INDEX)
+        if self.storage == "sorted_set":
+            self._add_series_entries(pipe, self._build_table_series_key(clean_instrument_id, table_name), [given_time])
+            for index in xrange(0, len(attribute_list)):
+                base_key = self._build_base_attribute_key(clean_instrument_id, attribute_list[index],
+                                                          table_name=table_name)
+                self._add_series_entries(pipe, "".join([base_key, ":series"]), [given_time], [value_list[index]])
+        else:
+            # Entries are much faster to parse back out if they are stored in ISO 8601 format.
+            iso_format_time = given_time.isoformat()
 
-        keys = []
-        for index in xrange(0, len(attribute_list)):
-            base_key = self._build_base_attribute_key(clean_instrument_id, attribute_list[index], table_name=table_name)
-            value_key = "".join([base_key, ":value"])
-            keys.append(value_key)
+            time_key = self._build_table_time_key(clean_instrument_id, table_name)
+            pipe.lpush(time_key, iso_format_time)
+            pipe.ltrim(time_key, 0, self.MAX_INDEX)
 
-            # Add the entries to Redis, but assure that the length of each list never exceeds MAX_INDEX.
-            self._r.lpush(value_key, value_list[index])
-            self._r.ltrim(value_key, 0, self.MAX_INDEX)
+            for index in xrange(0, len(attribute_list)):
+                base_key = self._build_base_attribute_key(clean_instrument_id, attribute_list[index],
+                                                          table_name=table_name)
+                value_key = "".join([base_key, ":value"])
+
+                # Add the entries to Redis, but assure that the length of each list never exceeds MAX_INDEX.
+                pipe.lpush(value_key, value_list[index])
+                pipe.ltrim(value_key, 0, self.MAX_INDEX)
+
+        self._send_buffered(pipe)
 
     def bulk_insert_values_for_table_attributes(self, instrument_id, attributes, given_times, values, table_name=None):
         """Adds values to the Redis database for an attribute of an instrument, organized by a given table_name.
@@ -394,6 +629,12 @@ class RedisInterface:
         # By executing commands in chunks using piping, the overall transactions/second is much greater.
         pipe = self._r.pipeline()
 
+        if self.storage == "sorted_set":
+            self._bulk_insert_series_entries(pipe, clean_instrument_id, attributes, given_time_list, value_list,
+                                             table_name)
+            pipe.execute()
+            return
+
         # If the table name is specified, will group attributes and values as if each row was a column in a table.
         # This allows the program to assume that one list of times represents all entries.  If it is not organized this
         # way, it instead makes a copy of the time lis for each attribute.
@@ -447,6 +688,114 @@ class RedisInterface:
         # Force the pipe to execute at the very end to assure no transactions are missed.
         pipe.execute()
 
+    def backfill_values(self, instrument_id, attributes, fetch_entries, table_name=None, max_attempts=5):
+        """Adds the entries for one or more attributes of an instrument that are newer than the newest entry Redis
+        already holds for them, leaving the entries it holds in place.  Used to bring Redis up to date with the main
+        database without clearing it first.  Redis only ever trims its oldest entries, so the entries it is missing are
+        the ones after the newest it holds.  If 'table_name' is given, the attributes are organized under the table and
+        share its times, otherwise 'attributes' holds a single attribute.
+
+        With 'list' storage, the entries are pushed in one MULTI/EXEC transaction, while the attribute's keys are
+        WATCHed.  If other clients write to the keys before the transaction runs, such as the Event Manager saving new
+        events, the entries they pushed that are newer than the newest entry held at the start are removed in the retry
+        and fetched again along with the missing entries, so the lists stay ordered by time.  With 'sorted_set' storage,
+        entries are kept in time order however they are added, so the entries are added in one pipeline.
+
+        Parameters
+        ----------
+        instrument_id: integer
+            The database id for the particular instrument.
+
+        attributes: list of strings
+            The attribute names.
+
+        fetch_entries: function
+            Called with the time (UTC, without timezone) of the newest entry held, or None if none are held.  Returns
+            a (given_times, values) pair, where 'given_times' are the times of the entries after that time, ordered from
+            oldest to newest and at most MAX_ENTRIES of them, and 'values' holds a list of values matching the times for
+            each of 'attributes'.
+
+        table_name: string, optional
+            Default None. The name of a table the attributes are grouped under.
+
+        max_attempts: integer, optional
+            Default 5.  Number of times the 'list' transaction is tried before giving up.
+
+        Returns
+        -------
+
+        added: integer
+            Number of entries fetched and written.
+
+        Raises
+        ------
+        redis.WatchError
+            If the keys were written by another client during every attempt.
+
+        """
+        clean_instrument_id = self._create_clean_integer(instrument_id,
+                                                         "Could not convert instrument ID to valid integer.")
+        if not clean_instrument_id:
+            return 0
+
+        base_keys = [self._build_base_attribute_key(clean_instrument_id, attribute, table_name=table_name)
+                     for attribute in attributes]
+
+        if self.storage == "sorted_set":
+            if table_name:
+                time_key = self._build_table_series_key(clean_instrument_id, table_name)
+            else:
+                time_key = base_keys[0] + ":series"
+            db_entries = self._r.zrevrange(time_key, 0, 0)
+            newest_time = self._parse_stored_time(self._split_series_member(db_entries[0])[0]) if db_entries else None
+
+            given_times, values = fetch_entries(newest_time)
+            if given_times:
+                pipe = self._r.pipeline(transaction=False)
+                if table_name:
+                    self._add_series_entries(pipe, time_key, given_times)
+                for base_key, attribute_values in zip(base_keys, values):
+                    self._add_series_entries(pipe, base_key + ":series", given_times, attribute_values)
+                pipe.execute()
+            return len(given_times)
+
+        if table_name:
+            time_key = self._build_table_time_key(clean_instrument_id, table_name)
+        else:
+            time_key = base_keys[0] + ":time"
+        value_keys = [base_key + ":value" for base_key in base_keys]
+
+        newest_time = None
+        with self._r.pipeline() as pipe:
+            for attempt in xrange(max_attempts):
+                try:
+                    # Until 'multi' is called, commands on a watching pipeline are sent immediately
+                    pipe.watch(time_key, *value_keys)
+                    if attempt == 0:
+                        db_newest = pipe.lindex(time_key, 0)
+                        newest_time = self._parse_stored_time(db_newest) if db_newest else None
+                        newer_count = 0
+                    else:
+                        newer_count = self._count_entries_after(pipe, time_key, newest_time)
+
+                    given_times, values = fetch_entries(newest_time)
+
+                    pipe.multi()
+                    if newer_count:
+                        for key in [time_key] + value_keys:
+                            pipe.ltrim(key, newer_count, -1)
+                    if given_times:
+                        pipe.lpush(time_key, *[given_time.isoformat() for given_time in given_times])
+                        pipe.ltrim(time_key, 0, self.MAX_INDEX)
+                        for value_key, attribute_values in zip(value_keys, values):
+                            pipe.lpush(value_key, *attribute_values)
+                            pipe.ltrim(value_key, 0, self.MAX_INDEX)
+                    pipe.execute()
+                    return len(given_times)
+                except redis.WatchError:
+                    if attempt == max_attempts - 1:
+                        raise
+
     def is_time_before_last_time_for_attribute(self, instrument_id, attribute, given_time, table_name=None):
         """Checks whether the time supplied is more recent than the last time for a particular attribute of an
         instrument.  Allows the caller to determine whether the Redis database is likely to hold the entire
@@ -483,14 +832,21 @@ class RedisInterface:
         result = 0
 
         # Key construction varies depending on whether the attribute is organized under a table.
-        if table_name:
+        if self.storage == "sorted_set":
+            if table_name:
+                db_key = self._build_table_series_key(clean_instrument_id, table_name)
+            else:
+                db_key = self._build_base_attribute_key(clean_instrument_id, attribute) + ":series"
+            db_entries = self._r.zrange(db_key, 0, 0)
+            db_result = self._split_series_member(db_entries[0])[0] if db_entries else ""
+        elif table_name:
             db_time_key = self._build_table_time_key(clean_instrument_id, table_name)
             db_result = self._r.lindex(db_time_key, -1)
         else:
             db_key = self._build_base_attribute_key(clean_instrument_id, attribute)
             db_result = self._r.lindex(db_key + ":time", -1)
 
-        if len(db_result) > 0:
+        if db_result and len(db_result) > 0:
             last_time = ciso8601.parse_datetime(db_result).replace(tzinfo=pytz.utc)
             if given_time.replace(tzinfo=pytz.utc) > last_time:
                 result = 1
@@ -535,6 +891,60 @@ class RedisInterface:
         db_key = "".join(["event_code:", str(event_code_id)])
         self._r.set(db_key, attribute_name)
 
+    def convert_lists_to_sorted_sets(self, delete_lists=False):
+        """Copies every attribute stored as parallel time and value lists into the sorted set the 'sorted_set' storage
+        mode reads, so that an existing Redis database can be switched from 'list' storage without losing its values.
+        Both plain attributes ('instruments:<instrument_id>:<attribute>:time' and ':value') and table organized
+        attributes ('instruments:<instrument_id>:<table_name>:time' and 'instruments:<instrument_id>:<table_name>:
+        <attribute>:value') are converted, pairing each value with the time at the same position, as the 'list' reads
+        do.  Safe to run more than once, as entries already in a sorted set are not duplicated.
+
+        Parameters
+        ----------
+
+        delete_lists: boolean, optional
+            Default False.  If True, the lists are deleted once they have been converted.
+
+        Returns
+        -------
+
+        converted_keys: list of strings
+            The sorted set keys that were written.
+
+        """
+        converted_keys = []
+        for time_key in self._r.scan_iter(match="instruments:*:time"):
+            base_key = time_key[:-len(":time")]
+            db_times = self._r.lrange(time_key, 0, self.MAX_INDEX)
+            scores = [self._time_score(ciso8601.parse_datetime(db_time)) for db_time in db_times]
+
+            pipe = self._r.pipeline(transaction=False)
+            # A plain attribute has its own value list.  Otherwise the times belong to a table, and every value list
+            # under the table shares them.
+            if self._r.exists(base_key + ":value"):
+                value_keys = [base_key + ":value"]
+            else:
+                value_keys = list(self._r.scan_iter(match=base_key + ":*:value"))
+                if db_times:
+                    pipe.zadd(base_key + ":series", dict(zip(db_times, scores)))
+                    converted_keys.append(base_key + ":series")
+
+            for value_key in value_keys:
+                series_key = value_key[:-len(":value")] + ":series"
+                db_values = self._r.lrange(value_key, 0, self.MAX_INDEX)
+                members = [self.MEMBER_SEPARATOR.join([db_time, db_value])
+                           for db_time, db_value in zip(db_times, db_values)]
+                if members:
+                    pipe.zadd(series_key, dict(zip(members, scores)))
+                    converted_keys.append(series_key)
+                if delete_lists:
+                    pipe.delete(value_key)
+            if delete_lists:
+                pipe.delete(time_key)
+            pipe.execute()
+
+        return converted_keys
+
     def clear_database(self):
         """Clears the entire Redis database.  Will wipe any other information on the same server."""
         self._r.flushdb()
@@ -567,6 +977,201 @@ class RedisInterface:
         image_list = self._r.lrange("instruments:" + str(instrument_id) + ":images", 0, 15)
         return image_list
 
+    def _count_entries_after(self, client, time_key, after_time, chunk_size=100):
+        """Counts the entries at the front of the time list 'time_key' that are newer than 'after_time', reading the
+        list a chunk at a time, as only a few entries are expected.  Every entry is newer if 'after_time' is None."""
+        if after_time is None:
+            return client.llen(time_key)
+
+        count = 0
+        while True:
+            db_times = client.lrange(time_key, count, count + chunk_size - 1)
+            for db_time in db_times:
+                if self._parse_stored_time(db_time) <= after_time:
+                    return count
+                count += 1
+            if len(db_times) < chunk_size:
+                return count
+
+    @staticmethod
+    def _parse_stored_time(db_time):
+        """Converts a time stored in Redis in ISO 8601 format to a datetime (UTC) without timezone information."""
+        parsed_time = ciso8601.parse_datetime(db_time)
+        if parsed_time.tzinfo is not None:
+            parsed_time = parsed_time.astimezone(pytz.utc).replace(tzinfo=None)
+        return parsed_time
+
+    def _buffered_client(self):
+        """Returns a pipeline to queue a group of writes on.  If this interface was returned by 'pipeline', its own
+        pipeline is returned, so the writes stay buffered until its 'execute' is called.
+
+        Returns
+        -------
+
+        pipe: redis.client.Pipeline
+            Non-transactional pipeline the writes should be queued on, then passed to '_send_buffered'.
+
+        """
+        if isinstance(self._r, redis.client.Pipeline):
+            return self._r
+        return self._r.pipeline(transaction=False)
+
+    def _send_buffered(self, pipe):
+        """Sends the writes queued on a pipeline from '_buffered_client' in one round trip, unless the pipeline belongs
+        to an interface returned by 'pipeline', which sends them when its 'execute' is called."""
+        if pipe is not self._r:
+            pipe.execute()
+
+    def _bulk_insert_series_entries(self, pipe, instrument_id, attributes, given_times, values, table_name=None):
+        """Queues the sorted set writes for 'bulk_insert_values_for_table_attributes' on 'pipe'.  As with lists, an
+        attribute whose values are all "NULL" is skipped when organized under a table, and the table's times are kept
+        in their own sorted set.
+
+        Parameters
+        ----------
+        pipe: redis.client.Pipeline
+            Pipeline the writes are queued on.  Not executed here.
+
+        instrument_id: integer
+            The database id for the particular instrument.
+
+        attributes: list of strings
+            The attribute names, each matching a list of 'values'.
+
+        given_times: list of datetime.datetimes
+            Times (UTC) matching each attribute's list of values.
+
+        values: list of lists
+            The values for each attribute, one list per attribute.
+
+        table_name: string, optional
+            Default None. The name of a table the attributes are grouped under.
+
+        """
+        if table_name:
+            self._add_series_entries(pipe, self._build_table_series_key(instrument_id, table_name), given_times)
+
+        for index in xrange(0, len(attributes)):
+            if table_name and values[index] and all(value == "NULL" for value in values[index]):
+                continue
+
+            base_key = self._build_base_attribute_key(instrument_id, attributes[index], table_name=table_name)
+            self._add_series_entries(pipe, "".join([base_key, ":series"]), given_times, values[index])
+
+            # Have the pipe execute commands in chunks, rather than every time or all at once at the end.
+            if (index % 50) == 0:
+                pipe.execute()
+
+    def _add_series_entries(self, client, series_key, given_times, values=None):
+        """Adds time/value entries to the sorted set 'series_key', each scored by its time, then trims the set down to
+        the newest MAX_ENTRIES entries.
+
+        Parameters
+        ----------
+        client: redis.Redis or redis.client.Pipeline
+            Connection or pipeline the commands are sent through.
+
+        series_key: string
+            Redis key of the sorted set.
+
+        given_times: list of datetime.datetimes
+            Times (UTC) of the entries.
+
+        values: list, optional
+            Values matching each of 'given_times'.  If not given, only the times are saved, as for a table's times.
+
+        """
+        if values is None:
+            members = [given_time.isoformat() for given_time in given_times]
+        else:
+            members = [self._build_series_member(given_time, value) for given_time, value in zip(given_times, values)]
+
+        client.zadd(series_key, dict(zip(members, [self._time_score(given_time) for given_time in given_times])))
+        client.zremrangebyrank(series_key, 0, -(self.MAX_ENTRIES + 1))
+
+    @classmethod
+    def _build_series_member(cls, given_time, value):
+        """Builds a sorted set member of the form '<time>|<value>', with the value written the same way Redis writes
+        it to a list.
+
+        Parameters
+        ----------
+        given_time: datetime.datetime
+            Time (UTC) of the entry.
+
+        value: integer, float, or string
+            The value of the entry.
+
+        Returns
+        -------
+
+        member: string
+            Sorted set member, for example '2017-01-01T00:00:00|12.5'.
+
+        """
+        if isinstance(value, float):
+            value = repr(value)
+        elif isinstance(value, unicode):
+            value = value.encode("utf-8")
+        return "".join([given_time.isoformat(), cls.MEMBER_SEPARATOR, str(value)])
+
+    @classmethod
+    def _split_series_member(cls, member):
+        """Splits a sorted set member of the form '<time>|<value>' into its time and value.
+
+        Returns
+        -------
+
+        entry: tuple of strings
+            The (time, value) pair of the member, with the time in ISO 8601 format.  The value is empty if the member
+            only holds a time.
+
+        """
+        entry_time, _, entry_value = member.partition(cls.MEMBER_SEPARATOR)
+        return entry_time, entry_value
+
+    @staticmethod
+    def _time_score(given_time):
+        """Converts a time (UTC) to the score its entries are sorted by, the number of seconds since the epoch.
+
+        Parameters
+        ----------
+        given_time: datetime.datetime
+            The time (UTC) to convert.  Any timezone information is ignored.
+
+        Returns
+        -------
+
+        score: float
+            Seconds since the epoch, including fractions of a second.
+
+        """
+        given_time = given_time.replace(tzinfo=None)
+        return calendar.timegm(given_time.timetuple()) + given_time.microsecond / 1000000.0
+
+    @staticmethod
+    def _build_table_series_key(instrument_id, table_name):
+        """Builds a Redis key for the sorted set of times associated with the 'instrument_id' and the 'table_name',
+        used by the 'sorted_set' storage mode in place of the list from '_build_table_time_key'.
+
+        Parameters
+        ----------
+        instrument_id: integer
+            The database id for the particular instrument.
+
+        table_name: string
+            The name of the table of attributes the times are for.
+
+        Returns
+        -------
+
+        series_key: string
+            Redis key of the form 'instruments:<instrument_id>:<table_name>:series'.  For example,
+            'instruments:1:prosensing_paf:series'.
+
+        """
+        return "".join(["instruments:", str(instrument_id), ":", table_name, ":series"])
+
 
     @staticmethod
     def _build_table_time_key(instrument_id, table_name):
@@ -639,8 +1244,7 @@ class RedisInterface:
             Input that is converted into a valid integer.
 
         error_message: string, optional
-            Defaults to None.  If specified, the error message will be printed to the screen if the conversion to
-            integer fails.
+            Defaults to None.  If specified, the error message will be logged if the conversion to integer fails.
 
         Returns
         -------
@@ -655,6 +1259,6 @@ class RedisInterface:
             clean_integer = int(dirty_input)
         except ValueError:
             if error_message:
-                print(error_message)
+                logger.warning(error_message)
 
         return clean_integer
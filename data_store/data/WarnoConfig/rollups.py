@@ -0,0 +1,446 @@
+import math
+import datetime
+
+from dateutil import tz
+
+import schema_cache
+from WarnoConfig.models import db
+from table_inserter import NUMERIC_TYPES
+
+HOUR = "hour"
+DAY = "day"
+
+# Length of each granularity's buckets.  Daily rollups are built from the hourly rollups, so every day bucket is made of
+# whole hour buckets.
+BUCKET_LENGTHS = {HOUR: datetime.timedelta(hours=1), DAY: datetime.timedelta(days=1)}
+
+# Earliest time used when a range has no start, so every bucket is included.
+EARLIEST_TIME = datetime.datetime(1970, 1, 1)
+
+# Table that holds the values of every non special attribute, each identified by its event code.
+EVENTS_TABLE = "events_with_value"
+
+# Rolls up (attribute, bucket_start, value) rows into one hourly rollup per attribute and hour.  The squared deviations
+# are summed from each bucket's own average, rather than found from the sum of squares, so they do not lose precision
+# to cancellation for large values that vary little.
+HOURLY_ROLLUP_SQL = ("SELECT :id, '%s', attribute, :granularity, bucket_start, count(value), sum(value), "
+                     "sum((value - bucket_average) * (value - bucket_average)), min(value), max(value) "
+                     "FROM (SELECT attribute, bucket_start, value, avg(value) OVER (PARTITION BY attribute, "
+                     "bucket_start) AS bucket_average FROM (%s) AS bucket_rows) AS bucket_values "
+                     "GROUP BY attribute, bucket_start")
+
+# Merges the rollup buckets matching 'conditions' into (count, sum, sum of squared deviations, minimum, maximum) for
+# each group of 'group_columns'.  Each bucket's squared deviations are moved from its own average to its group's
+# average with the parallel variance formula, M2 = sum(M2_i) + sum(n_i * (mean_i - mean)^2).
+MERGE_ROLLUPS_SQL = ("SELECT %(select)s sum(count), sum(sum), sum(sum_of_squared_deviations + count * (sum / count - "
+                     "group_average) * (sum / count - group_average)), min(minimum), max(maximum) "
+                     "FROM (SELECT %(group_columns)s count, sum, sum_of_squared_deviations, minimum, maximum, "
+                     "sum(sum) OVER bucket_group / CAST(sum(count) OVER bucket_group AS double precision) "
+                     "AS group_average FROM attribute_rollups WHERE %(conditions)s "
+                     "WINDOW bucket_group AS (%(partition)s)) AS buckets %(group_by)s")
+
+
+def floor_time(given_time, granularity):
+    """Returns the start of the bucket of the given granularity holding 'given_time'.
+
+    Parameters
+    ----------
+    given_time: datetime
+        Time to round down.
+
+    granularity: string
+        Either HOUR or DAY.
+
+    Returns
+    -------
+    bucket_start: datetime
+        'given_time' rounded down to the hour or day.
+
+    """
+    if granularity == DAY:
+        return given_time.replace(hour=0, minute=0, second=0, microsecond=0)
+    return given_time.replace(minute=0, second=0, microsecond=0)
+
+
+def ceil_time(given_time, granularity):
+    """Returns the start of the first bucket of the given granularity starting at or after 'given_time'.
+
+    Parameters
+    ----------
+    given_time: datetime
+        Time to round up.
+
+    granularity: string
+        Either HOUR or DAY.
+
+    Returns
+    -------
+    bucket_start: datetime
+        'given_time' rounded up to the hour or day.
+
+    """
+    bucket_start = floor_time(given_time, granularity)
+    if bucket_start < given_time:
+        bucket_start += BUCKET_LENGTHS[granularity]
+    return bucket_start
+
+
+def to_utc(given_time):
+    """Returns a time as a naive datetime in UTC, the way times are saved in the database.
+
+    Parameters
+    ----------
+    given_time: datetime
+        Either a naive datetime, assumed to already be in UTC, or a timezone aware datetime.
+
+    Returns
+    -------
+    utc_time: datetime
+        Naive datetime in UTC.
+
+    """
+    if given_time.tzinfo is not None:
+        return given_time.astimezone(tz.tzutc()).replace(tzinfo=None)
+    return given_time
+
+
+def get_rollup_columns(session, table_name):
+    """Returns the names of a special table's numeric attribute columns, which are the columns that are rolled up.  Key
+    columns, such as the table's primary key and 'instrument_id', are not attributes and are left out.
+
+    Parameters
+    ----------
+    session: sqlalchemy session
+        Database session used to query 'information_schema'.
+
+    table_name: string
+        Name of the special table, which must be defined in WarnoConfig.models.
+
+    Returns
+    -------
+    columns: list of strings
+        Names of the numeric attribute columns.
+
+    """
+    table = db.metadata.tables[table_name]
+    key_columns = [column.name for column in table.columns if column.primary_key or column.foreign_keys]
+    return [column_name for column_name, data_type in schema_cache.get_columns(session, table_name)
+            if data_type in NUMERIC_TYPES and column_name not in key_columns]
+
+
+def get_special_tables(session, instrument_id):
+    """Returns the names of the special tables an instrument saves data to that have columns to roll up.
+
+    Parameters
+    ----------
+    session: sqlalchemy session
+        Database session used to query the instrument's data references.
+
+    instrument_id: integer
+        Id of the instrument.
+
+    Returns
+    -------
+    table_names: list of strings
+        Names of the special tables.
+
+    """
+    rows = session.execute("SELECT description FROM instrument_data_references WHERE instrument_id = :id "
+                           "AND special = true", dict(id=instrument_id)).fetchall()
+    return [row[0] for row in rows if row[0] in db.metadata.tables and 'time' in db.metadata.tables[row[0]].columns]
+
+
+def refresh_rollups(session, instrument_id, start_time, end_time):
+    """Recomputes an instrument's hourly and daily rollups for every bucket overlapping the time range, from the
+    instrument's rows in 'events_with_value' and its special tables.  The buckets are deleted and rebuilt, so refreshing
+    the same range any number of times gives the same rollups, and late arriving rows are included the next time their
+    bucket is refreshed.  The changes are not committed.
+
+    Parameters
+    ----------
+    session: sqlalchemy session
+        Database session the rollups are read and written through.
+
+    instrument_id: integer
+        Id of the instrument to refresh the rollups for.
+
+    start_time: datetime
+        Start of the time range, rounded down to the start of its hour and day.
+
+    end_time: datetime
+        End of the time range, rounded up to the end of its hour and day.
+
+    """
+    hour_start = floor_time(start_time, HOUR)
+    hour_end = ceil_time(end_time, HOUR)
+    parameters = dict(id=instrument_id, start=hour_start, end=hour_end, granularity=HOUR)
+
+    session.execute("DELETE FROM attribute_rollups WHERE instrument_id = :id AND granularity = :granularity "
+                    "AND bucket_start >= :start AND bucket_start < :end", parameters)
+
+    insert_sql = ("INSERT INTO attribute_rollups (instrument_id, table_name, attribute, granularity, bucket_start, "
+                  "count, sum, sum_of_squared_deviations, minimum, maximum) ")
+    session.execute(insert_sql + HOURLY_ROLLUP_SQL %
+                    (EVENTS_TABLE, "SELECT event_codes.description AS attribute, date_trunc('hour', events.time) AS "
+                     "bucket_start, events.value AS value FROM %s events JOIN event_codes ON event_codes.event_code = "
+                     "events.event_code WHERE events.instrument_id = :id AND events.time >= :start AND events.time < "
+                     ":end AND events.value IS NOT NULL" % (EVENTS_TABLE,)), parameters)
+
+    for table_name in get_special_tables(session, instrument_id):
+        columns = get_rollup_columns(session, table_name)
+        if not columns:
+            continue
+        # Each row is turned into one (attribute, value) row for each column, so the table is only scanned once.
+        column_values = ", ".join("('%s', special.%s::double precision)" % (column, column) for column in columns)
+        session.execute(insert_sql + HOURLY_ROLLUP_SQL %
+                        (table_name, "SELECT attribute_values.attribute AS attribute, date_trunc('hour', special.time) "
+                         "AS bucket_start, attribute_values.value AS value FROM %s special, LATERAL (VALUES %s) AS "
+                         "attribute_values(attribute, value) WHERE special.instrument_id = :id AND special.time >= "
+                         ":start AND special.time < :end AND attribute_values.value IS NOT NULL"
+                         % (table_name, column_values)), parameters)
+
+    # Daily rollups are merged from the hourly rollups rather than read from the data tables again.
+    parameters.update(start=floor_time(start_time, DAY), end=ceil_time(end_time, DAY), granularity=DAY)
+    session.execute("DELETE FROM attribute_rollups WHERE instrument_id = :id AND granularity = :granularity "
+                    "AND bucket_start >= :start AND bucket_start < :end", parameters)
+    session.execute(insert_sql + MERGE_ROLLUPS_SQL % dict(
+        select=":id, table_name, attribute, :granularity, day_start,",
+        group_columns="table_name, attribute, date_trunc('day', bucket_start) AS day_start,",
+        conditions="instrument_id = :id AND granularity = '%s' AND bucket_start >= :start AND bucket_start < :end"
+                   % (HOUR,),
+        partition="PARTITION BY table_name, attribute, date_trunc('day', bucket_start)",
+        group_by="GROUP BY table_name, attribute, day_start"), parameters)
+
+
+def update_rollups(session, instrument_id, rolled_up_until, lookback):
+    """Brings an instrument's rollups up to date, refreshing every bucket from 'lookback' before the last time the
+    rollups were updated to 'rolled_up_until', then records 'rolled_up_until' as the time the instrument's rollups are
+    complete to.  The first update for an instrument builds all of its rollups.  The changes are not committed.
+
+    Parameters
+    ----------
+    session: sqlalchemy session
+        Database session the rollups are read and written through.
+
+    instrument_id: integer
+        Id of the instrument to update the rollups for.
+
+    rolled_up_until: datetime
+        Time the rollups are updated to, which should be the start of an hour that all data before has arrived by.
+
+    lookback: timedelta
+        How long before the last update to refresh again, so rows that arrived late are included.
+
+    """
+    row = session.execute("SELECT rolled_up_until FROM rollup_progress WHERE instrument_id = :id",
+                          dict(id=instrument_id)).fetchone()
+    start_time = EARLIEST_TIME if row is None else row[0] - lookback
+
+    refresh_rollups(session, instrument_id, start_time, rolled_up_until)
+
+    parameters = dict(id=instrument_id, until=rolled_up_until)
+    if row is None:
+        session.execute("INSERT INTO rollup_progress (instrument_id, rolled_up_until) VALUES (:id, :until)", parameters)
+    else:
+        session.execute("UPDATE rollup_progress SET rolled_up_until = :until WHERE instrument_id = :id", parameters)
+
+
+def remove_rollups_before(session, instrument_id, cutoff_time):
+    """Removes an instrument's rollups for the data deleted from before the cutoff time, such as when it is archived.
+    Buckets entirely before the cutoff are deleted, and the buckets holding the cutoff are refreshed from the rows that
+    are left.  The changes are not committed.
+
+    Parameters
+    ----------
+    session: sqlalchemy session
+        Database session the rollups are read and written through.
+
+    instrument_id: integer
+        Id of the instrument the data was deleted for.
+
+    cutoff_time: datetime
+        Time the data was deleted before.
+
+    """
+    for granularity in (HOUR, DAY):
+        session.execute("DELETE FROM attribute_rollups WHERE instrument_id = :id AND granularity = :granularity "
+                        "AND bucket_start < :start", dict(id=instrument_id, granularity=granularity,
+                                                          start=floor_time(cutoff_time, granularity)))
+    refresh_rollups(session, instrument_id, cutoff_time, cutoff_time)
+
+
+def split_time_range(start_time, end_time, rolled_up_until):
+    """Splits a time range into the parts that can be read from the daily rollups, the parts that can be read from the
+    hourly rollups, and the parts at the edges of the range, or after 'rolled_up_until', that have to be read from the
+    data rows.  Whole days are taken from the daily rollups, and whole hours left at either side from the hourly.
+
+    Parameters
+    ----------
+    start_time: datetime
+        Start of the time range, inclusive.
+
+    end_time: datetime or None
+        End of the time range, exclusive.  None for no end.
+
+    rolled_up_until: datetime or None
+        Time the instrument's rollups are complete to, or None if there are no rollups yet.
+
+    Returns
+    -------
+    ranges: dictionary
+        Maps DAY, HOUR and None (for the data rows) to a list of (start, end) pairs.  An end of None has no end.
+
+    """
+    ranges = {DAY: [], HOUR: [], None: []}
+
+    if rolled_up_until is None or rolled_up_until <= start_time:
+        ranges[None].append((start_time, end_time))
+        return ranges
+
+    rollup_end = rolled_up_until
+    if end_time is None or end_time > rolled_up_until:
+        ranges[None].append((rolled_up_until, end_time))
+    else:
+        rollup_end = end_time
+
+    day_start = ceil_time(start_time, DAY)
+    day_end = floor_time(rollup_end, DAY)
+    if day_start < day_end:
+        ranges[DAY].append((day_start, day_end))
+        edges = [(start_time, day_start), (day_end, rollup_end)]
+    else:
+        edges = [(start_time, rollup_end)]
+
+    for edge_start, edge_end in edges:
+        hour_start = ceil_time(edge_start, HOUR)
+        hour_end = floor_time(edge_end, HOUR)
+        if hour_start < hour_end:
+            ranges[HOUR].append((hour_start, hour_end))
+            ranges[None].extend([(edge_start, hour_start), (hour_end, edge_end)])
+        else:
+            ranges[None].append((edge_start, edge_end))
+
+    ranges[None] = [(range_start, range_end) for range_start, range_end in ranges[None]
+                    if range_end is None or range_start < range_end]
+    return ranges
+
+
+def get_attribute_aggregates(session, instrument_id, table_name, attribute, start_time=None, end_time=None):
+    """Returns the minimum, maximum, average and standard deviation of an instrument's values for an attribute.  Whole
+    days and hours are read from the rollups, and only the partial hours at the edges of the time range, and any time
+    since the rollups were last updated, are read from the data rows.
+
+    Parameters
+    ----------
+    session: sqlalchemy session
+        Database session the rollups and data rows are read through.
+
+    instrument_id: integer
+        Id of the instrument.
+
+    table_name: string
+        Name of the table the attribute's values are in, either 'events_with_value' or a special table.
+
+    attribute: string
+        The attribute's event code description for 'events_with_value', otherwise its column name.
+
+    start_time: datetime, optional
+        Start of the time range, inclusive.  If not given, the range starts with the earliest value.
+
+    end_time: datetime, optional
+        End of the time range, inclusive.  If not given, the range ends with the latest value.
+
+    Returns
+    -------
+    aggregates: tuple
+        (minimum, maximum, average, standard deviation, count) of the values, where each statistic is None if there
+        are no values.
+
+    """
+    start_time = EARLIEST_TIME if start_time is None else to_utc(start_time)
+    end_time = None if end_time is None else to_utc(end_time)
+
+    row = session.execute("SELECT rolled_up_until FROM rollup_progress WHERE instrument_id = :id",
+                          dict(id=instrument_id)).fetchone()
+    ranges = split_time_range(start_time, end_time, None if row is None else row[0])
+
+    parts = []
+    rollup_conditions = []
+    parameters = dict(id=instrument_id, table_name=table_name, attribute=attribute)
+    for granularity in (DAY, HOUR):
+        for index, (range_start, range_end) in enumerate(ranges[granularity]):
+            rollup_conditions.append("(granularity = '%s' AND bucket_start >= :%s_start_%s AND bucket_start < "
+                                     ":%s_end_%s)" % (granularity, granularity, index, granularity, index))
+            parameters["%s_start_%s" % (granularity, index)] = range_start
+            parameters["%s_end_%s" % (granularity, index)] = range_end
+    if rollup_conditions:
+        parts.append(session.execute(MERGE_ROLLUPS_SQL % dict(
+            select="", group_columns="", partition="", group_by="",
+            conditions="instrument_id = :id AND table_name = :table_name AND attribute = :attribute AND (%s)"
+                       % (" OR ".join(rollup_conditions),)), parameters).fetchone())
+
+    row_conditions = []
+    for index, (range_start, range_end) in enumerate(ranges[None]):
+        condition = "(time >= :start_%s" % (index,)
+        parameters["start_%s" % (index,)] = range_start
+        if range_end is not None:
+            condition += " AND time < :end_%s" % (index,)
+            parameters["end_%s" % (index,)] = range_end
+        row_conditions.append(condition + ")")
+    # The range includes its end, which no rollup bucket or edge does.
+    if end_time is not None:
+        row_conditions.append("(time = :end)")
+        parameters["end"] = end_time
+    if row_conditions:
+        if table_name == EVENTS_TABLE:
+            value_column = "value"
+            source = ("events_with_value WHERE event_code = (SELECT event_code FROM event_codes WHERE description = "
+                      ":attribute)")
+        else:
+            value_column = attribute
+            source = "%s WHERE %s IS NOT NULL" % (table_name, attribute)
+        parts.append(session.execute("SELECT count(value), sum(value), sum((value - average) * (value - average)), "
+                                     "min(value), max(value) FROM (SELECT %s AS value, avg(%s) OVER () AS average "
+                                     "FROM %s AND instrument_id = :id AND (%s)) AS row_values"
+                                     % (value_column, value_column, source, " OR ".join(row_conditions)),
+                                     parameters).fetchone())
+
+    return combine_aggregates(parts)
+
+
+def combine_aggregates(parts):
+    """Combines (count, sum, sum of squared deviations, minimum, maximum) rows for separate parts of a set of values
+    into the statistics of the whole set.  The parts' squared deviations are merged with the parallel variance formula,
+    so the standard deviation keeps its precision for large values that vary little.
+
+    Parameters
+    ----------
+    parts: list of tuples
+        (count, sum, sum of squared deviations from the part's average, minimum, maximum) of each part.  Parts with no
+        values have a count of 0 or None.
+
+    Returns
+    -------
+    aggregates: tuple
+        (minimum, maximum, average, population standard deviation, count) of the whole set, where each statistic is
+        None if there are no values.
+
+    """
+    parts = [part for part in parts if part[0]]
+    count = 0
+    total = 0.0
+    squared_deviations = 0.0
+    for part in parts:
+        part_count = int(part[0])
+        part_total = float(part[1])
+        if count:
+            delta = part_total / part_count - total / count
+            squared_deviations += delta * delta * count * part_count / (count + part_count)
+        squared_deviations += float(part[2])
+        count += part_count
+        total += part_total
+    if count == 0:
+        return None, None, None, None, 0
+
+    return (min(float(part[3]) for part in parts), max(float(part[4]) for part in parts), total / count,
+            math.sqrt(squared_deviations / count), count)
@@ -0,0 +1,129 @@
+import time
+import threading
+
+# Seconds a process trusts its cached columns before checking whether the database has been migrated since.
+VERSION_CHECK_INTERVAL = 60
+
+# (column_name, data_type) pairs of each table looked up, keyed by table name.  Tables that do not exist are cached as
+# having no columns, as the Event Manager checks whether an attribute has its own table for every new attribute.
+_table_columns = {}
+# Migration the database was at when the columns were cached, and when that was last checked.
+_schema_version = None
+_checked_time = None
+_lock = threading.Lock()
+
+
+def get_columns(session, table, refresh=False):
+    """Returns the columns of a table and their data types, reading them from 'information_schema' the first time the
+    table is asked for and from a cache shared by the whole process afterwards.  The cache is cleared when the database
+    is found to have been migrated, which is checked at most every VERSION_CHECK_INTERVAL seconds, or when
+    'invalidate' is called.
+
+    Parameters
+    ----------
+    session: sqlalchemy session or connection
+        Database session used to query 'information_schema' and 'alembic_version'.
+
+    table: string
+        Name of the database table.
+
+    refresh: boolean, optional
+        Default False.  If True, the table's columns are read from the database even if they are cached.
+
+    Returns
+    -------
+    columns: list of tuples
+        (column_name, data_type) pair for each column of the table, in the order the columns are defined in the table.
+        Empty if the table does not exist.
+
+    """
+    _check_schema_version(session)
+
+    columns = _table_columns.get(table)
+    if columns is None or refresh:
+        rows = session.execute("SELECT column_name, data_type FROM information_schema.columns "
+                               "WHERE table_name = :table ORDER BY ordinal_position", dict(table=table)).fetchall()
+        columns = [(row[0], row[1]) for row in rows]
+        _table_columns[table] = columns
+    return list(columns)
+
+
+def get_column_names(session, table):
+    """Returns the names of a table's columns, in the order the columns are defined in the table, or an empty list if
+    the table does not exist.  See 'get_columns'.
+
+    Parameters
+    ----------
+    session: sqlalchemy session or connection
+        Database session used to query 'information_schema'.
+
+    table: string
+        Name of the database table.
+
+    Returns
+    -------
+    column_names: list of strings
+        Names of the table's columns.
+
+    """
+    return [column_name for column_name, _ in get_columns(session, table)]
+
+
+def table_exists(session, table):
+    """Returns whether a table exists, using the cached columns from 'get_columns'.
+
+    Parameters
+    ----------
+    session: sqlalchemy session or connection
+        Database session used to query 'information_schema'.
+
+    table: string
+        Name of the database table.
+
+    Returns
+    -------
+    exists: boolean
+        True if the table has any columns.
+
+    """
+    return len(get_columns(session, table)) > 0
+
+
+def invalidate():
+    """Clears the cached columns of every table, so each is read from the database the next time it is asked for.
+    Called after running migrations in this process.  Other processes find the migration when they next check the
+    database's migration version.
+
+    """
+    global _schema_version, _checked_time
+    with _lock:
+        _table_columns.clear()
+        _schema_version = None
+        _checked_time = None
+
+
+def _check_schema_version(session):
+    """Clears the cache if the database is at a different migration than when the columns were cached.  Only checks
+    the database if VERSION_CHECK_INTERVAL seconds have passed since the last check."""
+    global _schema_version, _checked_time
+    with _lock:
+        now = time.time()
+        if _checked_time is not None and now - _checked_time < VERSION_CHECK_INTERVAL:
+            return
+
+        version = _get_schema_version(session)
+        if version != _schema_version:
+            _table_columns.clear()
+            _schema_version = version
+        _checked_time = now
+
+
+def _get_schema_version(session):
+    """Returns the migration the database is at, or None if its tables were not created by migrations."""
+    # Reading a table that does not exist would abort the session's transaction, so its existence is checked first
+    table_exists = session.execute("SELECT 1 FROM information_schema.tables "
+                                   "WHERE table_name = 'alembic_version'").fetchone() is not None
+    if not table_exists:
+        return None
+    row = session.execute("SELECT version_num FROM alembic_version").fetchone()
+    return row[0] if row is not None else None
@@ -0,0 +1,307 @@
+import os
+import glob
+import struct
+import threading
+
+# Every record in a segment is prefixed by its length as a 4 byte big-endian unsigned integer.
+RECORD_HEADER = struct.Struct(">I")
+SEGMENT_EXTENSION = ".seg"
+CURSOR_FILENAME = "cursor"
+# What 'append' drops when the spool is over its quota: the oldest uncommitted records, or the records being appended.
+DROP_POLICIES = ("oldest", "newest")
+
+
+class Spool(object):
+    """Durable first-in first-out queue of records, kept on disk as a series of append-only segment files.
+
+    Records are appended to the newest segment, and a new segment is started once the newest grows past
+    'segment_bytes'.  Readers take records from the oldest segment onwards without removing them, and 'commit' the
+    position they reached once the records have been handled.  The committed position is saved in a small cursor file,
+    so that after a restart reading resumes at the first record that was not committed, and segments are deleted once
+    every record in them has been committed.  A record that was only partially written when the process stopped is
+    ignored.
+
+    If 'max_bytes' is given, the segment files are kept within that many bytes on disk.  When appending would go over
+    the quota, the "oldest" drop policy deletes the oldest segments, uncommitted records and all, to make room, while
+    the "newest" policy keeps every spooled record and drops the records being appended that do not fit.  The number of
+    records dropped is counted by 'dropped'.
+
+    Parameters
+    ----------
+    directory: string
+        Directory the segment and cursor files are kept in.  Created if it does not exist.
+
+    segment_bytes: integer, optional
+        Size in bytes a segment may grow to before a new segment is started. Default is 4 MB.
+
+    max_bytes: integer, optional
+        Maximum total size in bytes of the segment files.  By default the spool may grow without limit.
+
+    drop_policy: string, optional
+        Which records are dropped when the spool is full, "oldest" or "newest". Default is "oldest".
+
+    """
+
+    def __init__(self, directory, segment_bytes=4 * 1024 * 1024, max_bytes=None, drop_policy="oldest"):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError("Spool drop policy must be one of %s, not '%s'" % (", ".join(DROP_POLICIES), drop_policy))
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.drop_policy = drop_policy
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._dropped = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._segments = sorted(self._segment_number(path)
+                                for path in glob.glob(os.path.join(directory, "*" + SEGMENT_EXTENSION)))
+        if not self._segments:
+            self._segments = [0]
+
+        self._read_segment, self._read_offset = self._load_cursor()
+        # Segments older than the cursor have been fully committed, but may not have been deleted before a restart.
+        for segment in [segment for segment in self._segments if segment < self._read_segment]:
+            self._remove_segment(segment)
+        if self._read_segment not in self._segments:
+            self._read_segment, self._read_offset = self._segments[0], 0
+
+        self._depth = 0
+        for segment in self._segments:
+            count, end_offset = self._count_records(segment, self._read_offset if segment == self._read_segment else 0)
+            self._depth += count
+
+        # Drop any partially written record from the end of the newest segment, so new records are appended after the
+        # last complete record rather than after the fragment.
+        newest_path = self._segment_path(self._segments[-1])
+        if os.path.exists(newest_path) and os.path.getsize(newest_path) > end_offset:
+            with open(newest_path, "r+b") as segment_file:
+                segment_file.truncate(end_offset)
+
+        self._bytes = sum(os.path.getsize(self._segment_path(segment)) for segment in self._segments
+                          if os.path.exists(self._segment_path(segment)))
+
+    def append(self, records):
+        """Append records to the end of the spool, flushing them to disk before returning.  If the spool is over its
+        quota, records are dropped according to the drop policy.
+
+        Parameters
+        ----------
+        records: list of strings
+            Records to be appended, in order.  Each record may contain any bytes.
+
+        """
+        if not records:
+            return
+
+        with self._lock:
+            encoded = [RECORD_HEADER.pack(len(record)) + record for record in records]
+            if self.max_bytes is not None:
+                encoded = self._make_room(encoded)
+                if not encoded:
+                    return
+
+            path = self._segment_path(self._segments[-1])
+            if os.path.exists(path) and os.path.getsize(path) >= self.segment_bytes:
+                self._segments.append(self._segments[-1] + 1)
+                path = self._segment_path(self._segments[-1])
+
+            data = "".join(encoded)
+            with open(path, "ab") as segment_file:
+                segment_file.write(data)
+                segment_file.flush()
+                os.fsync(segment_file.fileno())
+            self._depth += len(encoded)
+            self._bytes += len(data)
+
+    def read(self, max_records):
+        """Read up to 'max_records' of the oldest uncommitted records, without removing them from the spool.  Records
+        are only read from one segment at a time, so fewer than 'max_records' may be returned even if more are
+        spooled.
+
+        Parameters
+        ----------
+        max_records: integer
+            Maximum number of records to return.
+
+        Returns
+        -------
+        records: list of strings
+            Oldest uncommitted records, in the order they were appended.  Empty if the spool is empty.
+
+        position: tuple
+            Position just past the last returned record, to be passed to 'commit' once the records have been handled.
+
+        """
+        with self._lock:
+            segment, offset = self._read_segment, self._read_offset
+            while True:
+                records, end_offset = self._read_records(segment, offset, max_records)
+                # Move on to the next segment once the current one is exhausted, but never past the newest segment.
+                if records or segment == self._segments[-1]:
+                    return records, (segment, end_offset, len(records))
+                segment, offset = self._segments[self._segments.index(segment) + 1], 0
+
+    def commit(self, position):
+        """Mark every record up to 'position' as handled, deleting any segments that are no longer needed.
+
+        Parameters
+        ----------
+        position: tuple
+            Position returned by 'read'.
+
+        """
+        segment, offset, count = position
+        with self._lock:
+            # The records were dropped to make room while they were being handled, and are already gone.
+            if (segment, offset) <= (self._read_segment, self._read_offset):
+                return
+            for old_segment in [old for old in self._segments if old < segment]:
+                self._remove_segment(old_segment)
+            self._read_segment, self._read_offset = segment, offset
+            self._depth = max(self._depth - count, 0)
+            self._save_cursor()
+
+    def depth(self):
+        """Returns the number of records that have been appended but not yet committed."""
+        return self._depth
+
+    def size_bytes(self):
+        """Returns the total size in bytes of the segment files."""
+        return self._bytes
+
+    def dropped(self):
+        """Returns the number of records dropped to keep the spool within its quota since it was opened."""
+        return self._dropped
+
+    def _make_room(self, encoded):
+        """Apply the drop policy so that the encoded records fit within the quota, returning the records to append."""
+        needed = sum(len(record) for record in encoded)
+        if self.drop_policy == "oldest" and self._bytes + needed > self.max_bytes:
+            while self._bytes + needed > self.max_bytes and len(self._segments) > 1:
+                self._drop_oldest_segment()
+            # The newest segment can only be dropped once a new segment has been started after it.
+            if self._bytes + needed > self.max_bytes and self._bytes > 0:
+                self._segments.append(self._segments[-1] + 1)
+                self._drop_oldest_segment()
+
+        kept = []
+        kept_bytes = 0
+        for record in encoded:
+            if self._bytes + kept_bytes + len(record) > self.max_bytes:
+                break
+            kept.append(record)
+            kept_bytes += len(record)
+        self._dropped += len(encoded) - len(kept)
+        return kept
+
+    def _drop_oldest_segment(self):
+        """Delete the oldest segment along with any records in it that have not been committed."""
+        segment = self._segments[0]
+        count, end_offset = self._count_records(segment, self._read_offset if segment == self._read_segment else 0)
+        self._depth = max(self._depth - count, 0)
+        self._dropped += count
+        self._remove_segment(segment)
+        if segment == self._read_segment:
+            self._read_segment, self._read_offset = self._segments[0], 0
+            self._save_cursor()
+
+    def _read_records(self, segment, offset, max_records=None):
+        """Read complete records from a segment, starting at byte 'offset'.
+
+        Returns
+        -------
+        records: list of strings
+            The records read, stopping at 'max_records', the end of the segment, or a partially written record.
+
+        end_offset: integer
+            Byte offset just past the last record returned.
+
+        """
+        records = []
+        path = self._segment_path(segment)
+        if not os.path.exists(path):
+            return records, offset
+
+        with open(path, "rb") as segment_file:
+            segment_file.seek(offset)
+            while max_records is None or len(records) < max_records:
+                header = segment_file.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                length = RECORD_HEADER.unpack(header)[0]
+                record = segment_file.read(length)
+                if len(record) < length:
+                    break
+                records.append(record)
+                offset += RECORD_HEADER.size + length
+        return records, offset
+
+    def _count_records(self, segment, offset):
+        """Counts the complete records in a segment after byte 'offset', without reading their contents.
+
+        Returns
+        -------
+        count: integer
+            Number of complete records.
+
+        end_offset: integer
+            Byte offset just past the last complete record.
+
+        """
+        count = 0
+        path = self._segment_path(segment)
+        if not os.path.exists(path):
+            return count, offset
+
+        size = os.path.getsize(path)
+        with open(path, "rb") as segment_file:
+            segment_file.seek(offset)
+            while True:
+                header = segment_file.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                next_offset = offset + RECORD_HEADER.size + RECORD_HEADER.unpack(header)[0]
+                if next_offset > size:
+                    break
+                offset = next_offset
+                segment_file.seek(offset)
+                count += 1
+        return count, offset
+
+    def _remove_segment(self, segment):
+        """Delete a fully committed segment, unless it is the newest segment still being appended to."""
+        if segment == self._segments[-1]:
+            return
+        path = self._segment_path(segment)
+        if os.path.exists(path):
+            self._bytes -= os.path.getsize(path)
+            os.remove(path)
+        self._segments.remove(segment)
+
+    def _load_cursor(self):
+        """Returns the saved (segment, offset) read position, or the start of the oldest segment if there is none."""
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILENAME), "r") as cursor_file:
+                segment, offset = cursor_file.read().split()
+            return int(segment), int(offset)
+        except (IOError, ValueError):
+            return self._segments[0], 0
+
+    def _save_cursor(self):
+        """Save the read position, writing it to a temporary file first so a crash never leaves a partial cursor."""
+        path = os.path.join(self.directory, CURSOR_FILENAME)
+        with open(path + ".tmp", "w") as cursor_file:
+            cursor_file.write("%d %d" % (self._read_segment, self._read_offset))
+            cursor_file.flush()
+            os.fsync(cursor_file.fileno())
+        os.rename(path + ".tmp", path)
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, "%012d%s" % (segment, SEGMENT_EXTENSION))
+
+    @staticmethod
+    def _segment_number(path):
+        return int(os.path.basename(path)[:-len(SEGMENT_EXTENSION)])
@@ -0,0 +1,152 @@
+import decimal
+
+from sqlalchemy import text
+
+import schema_cache
+
+# information_schema data types whose values are bound as integers, floats and decimals rather than strings.
+INTEGER_TYPES = ["smallint", "integer", "bigint"]
+FLOAT_TYPES = ["real", "double precision"]
+DECIMAL_TYPES = ["numeric"]
+NUMERIC_TYPES = INTEGER_TYPES + FLOAT_TYPES + DECIMAL_TYPES
+
+
+class TableInserter(object):
+    """Inserts rows into a single wide database table, such as 'prosensing_paf' or 'iris_bite', using bound-parameter
+    statements.  The table's columns and their types are read from the shared schema cache the first time a row is
+    inserted and kept afterwards.  One INSERT statement is built for each distinct set of columns a row fills (its
+    column signature) and reused for every later row with the same signature, so packets from the same instrument always
+    produce the same statement text rather than a new string of literal values.
+
+    Parameters
+    ----------
+    table_name: string
+        Name of the database table rows are inserted into.
+
+    """
+
+    def __init__(self, table_name):
+        self.table_name = table_name
+        self._column_types = None
+        self._statements = {}
+
+    def load_columns(self, session, refresh=False):
+        """Load the table's column names and data types from the schema cache, replacing any loaded columns and
+        discarding every statement built from them.
+
+        Parameters
+        ----------
+        session: sqlalchemy session or connection
+            Database session used to query 'information_schema'.
+
+        refresh: boolean, optional
+            Default False.  If True, the columns are read from the database rather than the schema cache.
+
+        """
+        self._column_types = dict(schema_cache.get_columns(session, self.table_name, refresh=refresh))
+        self._statements = {}
+
+    def insert(self, session, row):
+        """Insert one row into the table.  Values are converted according to their column's type: any value containing
+        'inf' or 'Inf' is saved as NULL, values for integer, floating point and numeric columns are bound as integers,
+        floats and decimals, and null characters are stripped from the end of any other string.  If the row names a
+        column that is not in the cached column set, the columns are reloaded once in case the table has been migrated
+        since they were cached.
+
+        Parameters
+        ----------
+        session: sqlalchemy session or connection
+            Database session the insert is executed on.  The insert is not committed.
+
+        row: dictionary
+            Maps each column name to be filled to its value.
+
+        Raises
+        ------
+        ValueError
+            If the row names a column the table does not have.
+
+        """
+        if self._column_types is None:
+            self.load_columns(session)
+
+        if [column for column in row if column not in self._column_types]:
+            self.load_columns(session, refresh=True)
+            unknown_columns = [column for column in row if column not in self._column_types]
+            if unknown_columns:
+                raise ValueError("Table '%s' has no columns named %s" % (self.table_name, ", ".join(unknown_columns)))
+
+        signature = tuple(sorted(row.keys()))
+        statement = self._statements.get(signature)
+        if statement is None:
+            statement = self._build_statement(signature)
+            self._statements[signature] = statement
+
+        parameters = dict(("p%d" % index, self._convert_value(column, row[column]))
+                          for index, column in enumerate(signature))
+        session.execute(statement, parameters)
+
+    def _build_statement(self, signature):
+        """Build the INSERT statement for a column signature.  Parameters are named by position ('p0', 'p1', ...) rather
+        than by column, as column names are not always valid parameter names.
+
+        Parameters
+        ----------
+        signature: tuple of strings
+            Sorted names of the columns the statement fills.
+
+        Returns
+        -------
+        statement: sqlalchemy TextClause
+            Statement of the form 'INSERT INTO <table> (<column_1>, ...) VALUES (:p0, ...)'.
+
+        """
+        placeholders = ", ".join([":p%d" % index for index in xrange(len(signature))])
+        return text("INSERT INTO %s (%s) VALUES (%s)" % (self.table_name, ", ".join(signature), placeholders))
+
+    def _convert_value(self, column, value):
+        """Convert a value from an event packet into the value bound for 'column'.
+
+        Parameters
+        ----------
+        column: string
+            Name of the column the value is for.
+
+        value: object
+            The value as it was received.
+
+        Returns
+        -------
+        converted_value: integer, float, Decimal, string, or None
+            None for empty and infinite values, an integer for integer columns, a float for floating point columns, a
+            Decimal for numeric columns, or otherwise the value itself, with null characters stripped from the end of
+            strings.  A value with a fractional part for an integer column is bound as a float, for Postgres to round.
+
+        """
+        if value is None:
+            return None
+
+        # Postgresql has no equivalent for the infinities some instruments report, so they are saved as NULL.
+        if "inf" in str(value) or "Inf" in str(value):
+            return None
+
+        column_type = self._column_types[column]
+        try:
+            if column_type in INTEGER_TYPES:
+                # Integers are not converted through a float, which would lose the precision of large values.
+                if not isinstance(value, float):
+                    try:
+                        return int(value)
+                    except ValueError:
+                        value = float(value)
+                return int(value) if value.is_integer() else value
+            if column_type in FLOAT_TYPES:
+                return float(value)
+            if column_type in DECIMAL_TYPES:
+                return decimal.Decimal(str(value))
+        except (TypeError, ValueError, decimal.InvalidOperation):
+            pass
+
+        if isinstance(value, basestring):
+            return value.rstrip('\x00')
+        return value
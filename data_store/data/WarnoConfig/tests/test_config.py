@@ -1,3 +1,8 @@
+import os
+import mock
+import shutil
+import tempfile
+
 from unittest import TestCase
 
 from .. import config
@@ -22,3 +27,72 @@ class TestGetConfigContext(TestCase):
 
         self.assertIn('setup', config_construct, 'Configuration construct should have "setup" entry')
         self.assertIn('type', config_construct, 'Configuration construct should have "type" entry')
+
+
+class TestCachedConfig(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.config_filename = os.path.join(self.directory, "config.yml")
+        with open(self.config_filename, "w") as config_file:
+            config_file.write("database:\n    pool_size: \"5\"\n    test_db: \"yes\"\n    DB_PORT: 5432\n")
+
+        config.reload_config()
+        self.addCleanup(config.reload_config)
+
+    def test_load_cached_yaml_config_only_parses_changed_files(self):
+        """Tests that a file is parsed the first time it is loaded and from the cache afterwards, until it changes."""
+        with mock.patch.object(config, "load_yaml_config", wraps=config.load_yaml_config) as load_yaml_config:
+            config.load_cached_yaml_config(self.config_filename)
+            config.load_cached_yaml_config(self.config_filename)
+            self.assertEqual(load_yaml_config.call_count, 1, "Unchanged file was parsed again.")
+
+            with open(self.config_filename, "a") as config_file:
+                config_file.write("redis:\n    port: 6379\n")
+            loaded = config.load_cached_yaml_config(self.config_filename)
+
+        self.assertEqual(load_yaml_config.call_count, 2, "Changed file was not parsed again.")
+        self.assertEqual(loaded["redis"]["port"], 6379, "Changed file's new value was not loaded.")
+
+    def test_get_config_context_returns_a_copy(self):
+        """Tests that changing a returned context does not change the context returned to later callers."""
+        with mock.patch.dict(os.environ, {"ALT_CONFIG": self.config_filename, "DATA_STORE_PATH": self.directory + "/"}):
+            with open(os.path.join(self.directory, "secrets.yml"), "w") as secrets_file:
+                secrets_file.write("s_database:\n    DB_PASS: \"password\"\n")
+            config.get_config_context()["database"]["DB_PORT"] = 1
+            context = config.get_config_context()
+
+        self.assertEqual(context["database"]["DB_PORT"], 5432, "Cached context was modified by a caller.")
+        self.assertEqual(context["s_database"]["DB_PASS"], "password", "Secrets were not added to the context.")
+
+    def test_get_value_only_checks_files_for_changes_once_per_interval(self):
+        """Tests that values are read from the merged context without checking the files again until 'CHECK_INTERVAL'
+        has passed, and that edits are picked up after it has."""
+        with mock.patch.dict(os.environ, {"ALT_CONFIG": self.config_filename, "DATA_STORE_PATH": self.directory + "/"}):
+            with open(os.path.join(self.directory, "secrets.yml"), "w") as secrets_file:
+                secrets_file.write("{}\n")
+            config.get_value("database.DB_PORT")
+
+            with mock.patch.object(config.os, "stat", wraps=os.stat) as stat:
+                config.get_value("database.DB_PORT")
+                self.assertFalse(stat.called, "Files were checked for changes within the check interval.")
+
+            with open(self.config_filename, "a") as config_file:
+                config_file.write("redis:\n    port: 6379\n")
+            with mock.patch.object(config, "CHECK_INTERVAL", 0):
+                self.assertEqual(config.get_int("redis.port"), 6379, "Edited file was not picked up.")
+
+    def test_typed_accessors_convert_values(self):
+        """Tests that the typed accessors convert values to their type, return defaults for missing keys, and raise
+        errors for missing keys without defaults and values that can not be converted."""
+        with mock.patch.dict(os.environ, {"ALT_CONFIG": self.config_filename, "DATA_STORE_PATH": self.directory + "/"}):
+            with open(os.path.join(self.directory, "secrets.yml"), "w") as secrets_file:
+                secrets_file.write("{}\n")
+
+            self.assertEqual(config.get_int("database.pool_size"), 5, "String was not converted to an integer.")
+            self.assertIs(config.get_bool("database.test_db"), True, "String was not converted to a boolean.")
+            self.assertEqual(config.get_string("database.DB_PORT"), "5432", "Number was not converted to a string.")
+            self.assertEqual(config.get_float("database.pool_recycle", 3600.0), 3600.0, "Default was not returned.")
+            self.assertRaises(KeyError, config.get_int, "database.pool_recycle")
+            self.assertRaises(ValueError, config.get_bool, "database.DB_PORT")
@@ -1,3 +1,6 @@
+import mock
+import datetime
+
 from unittest import TestCase
 
 from .. import redis_interface
@@ -52,3 +55,257 @@ class TestUtilityFunctions(TestCase):
         result = redis_interface.RedisInterface._create_clean_integer(non_integer_string)
 
         self.assertIs(result, None, "Expected a 'None' return. Got '%s' instead'" % result)
+
+
+class TestPipelining(TestCase):
+
+    def test_pipeline_buffers_writes_until_execute_is_called(self):
+        """Tests that writes made through the interface returned by 'pipeline' are queued on a single Redis pipeline,
+        are not sent through the original connection, and are only sent once 'execute' is called.
+        """
+        interface = redis_interface.RedisInterface()
+        interface._r = mock.Mock()
+        pipe = interface._r.pipeline.return_value
+
+        buffered_interface = interface.pipeline()
+        buffered_interface.add_event_code(5, "attribute_string")
+
+        self.assertFalse(interface._r.set.called, "Write was sent through the unbuffered connection.")
+        self.assertTrue(pipe.set.called, "Write was not queued on the pipeline.")
+        self.assertFalse(pipe.execute.called, "Pipeline was executed before 'execute' was called.")
+
+        buffered_interface.execute()
+        pipe.execute.assert_called_once_with()
+
+    def test_add_value_set_for_table_attributes_sends_every_write_in_one_round_trip(self):
+        """Tests that the push and trim for the table's time and for every attribute are queued on one pipeline, which
+        is executed once, rather than sent through the connection one at a time.
+        """
+        interface = redis_interface.RedisInterface()
+        interface._r = mock.Mock()
+        pipe = interface._r.pipeline.return_value
+
+        interface.add_value_set_for_table_attributes(4, ["voltage", "temperature"], datetime.datetime(2017, 1, 1),
+                                                     [5.0, 20.0], "prosensing_paf")
+
+        self.assertFalse(interface._r.lpush.called, "A write was sent outside the pipeline.")
+        self.assertEqual(pipe.lpush.call_count, 3, "Time and attribute pushes were not all queued on the pipeline.")
+        self.assertEqual(pipe.ltrim.call_count, 3, "Time and attribute trims were not all queued on the pipeline.")
+        pipe.execute.assert_called_once_with()
+
+    def test_add_value_set_for_table_attributes_through_pipeline_waits_for_execute(self):
+        """Tests that, through an interface returned by 'pipeline', the writes are queued on that interface's pipeline
+        and are not sent until its 'execute' is called.
+        """
+        interface = redis_interface.RedisInterface()
+        interface._r = mock.Mock()
+        interface._r.pipeline.return_value = mock.Mock(spec=redis_interface.redis.client.Pipeline)
+        pipe = interface._r.pipeline.return_value
+
+        interface.pipeline().add_value_set_for_table_attributes(4, ["voltage"], datetime.datetime(2017, 1, 1), [5.0],
+                                                                "prosensing_paf")
+
+        self.assertEqual(pipe.lpush.call_count, 2, "Writes were not queued on the interface's pipeline.")
+        self.assertFalse(pipe.execute.called, "Pipeline was executed before 'execute' was called.")
+
+    def test_extend_moves_buffered_writes_onto_the_end_of_the_pipeline(self):
+        """Tests that 'extend' queues another buffered interface's writes after this interface's own, in order, and
+        leaves nothing buffered on the other interface.
+        """
+        interface = redis_interface.RedisInterface()
+        batch_interface = interface.pipeline()
+        event_interface = interface.pipeline()
+        batch_interface.add_event_code(5, "first")
+        event_interface.add_event_code(6, "second")
+
+        batch_interface.extend(event_interface)
+
+        self.assertListEqual([args[1] for args, _ in batch_interface._r.command_stack],
+                             ["event_code:5", "event_code:6"], "Writes were not moved onto the end of the pipeline.")
+        self.assertListEqual(event_interface._r.command_stack, [], "Moved writes were left on the other pipeline.")
+
+
+class TestSortedSetStorage(TestCase):
+
+    def setUp(self):
+        self.interface = redis_interface.RedisInterface(storage="sorted_set")
+        self.interface._r = mock.Mock()
+
+    def test_unknown_storage_mode_raises_value_error(self):
+        """Tests that an interface can not be created with a storage mode that is not one of STORAGE_MODES."""
+        with self.assertRaises(ValueError):
+            redis_interface.RedisInterface(storage="hash")
+
+    def test_add_values_for_attribute_scores_entries_by_time_and_trims_oldest(self):
+        """Tests that each time/value pair is added as one '<time>|<value>' member scored by its epoch time, and that
+        the sorted set is trimmed to MAX_ENTRIES.
+        """
+        times = [datetime.datetime(1970, 1, 1, 0, 1), datetime.datetime(1970, 1, 1, 0, 2, 0, 500000)]
+        self.interface.add_values_for_attribute(4, "temperature", times, [1.5, "NULL"])
+
+        self.interface._r.zadd.assert_called_once_with("instruments:4:temperature:series",
+                                                        {"1970-01-01T00:01:00|1.5": 60.0,
+                                                         "1970-01-01T00:02:00.500000|NULL": 120.5})
+        self.interface._r.zremrangebyrank.assert_called_once_with("instruments:4:temperature:series", 0,
+                                                                  -(redis_interface.RedisInterface.MAX_ENTRIES + 1))
+
+    def test_get_values_for_attribute_between_times_fetches_only_the_time_range(self):
+        """Tests that a time range is fetched with one range-by-score request, and that each member is split back into
+        its time and value.
+        """
+        pipe = self.interface._r.pipeline.return_value
+        pipe.execute.return_value = [["1970-01-01T00:02:00|2.5", "1970-01-01T00:01:00|1.5"]]
+
+        result = self.interface.get_values_for_attribute_between_times(4, "temperature",
+                                                                       datetime.datetime(1970, 1, 1, 0, 1),
+                                                                       datetime.datetime(1970, 1, 1, 0, 2))
+
+        pipe.zrevrangebyscore.assert_called_once_with("instruments:4:temperature:series", 120.0, 60.0)
+        self.assertFalse(self.interface._r.lrange.called, "Time range was read from the lists.")
+        self.assertEqual(result, [("1970-01-01T00:02:00", "2.5"), ("1970-01-01T00:01:00", "1.5")],
+                         "Returned entries '%s' do not match the stored members." % result)
+
+    def test_convert_lists_to_sorted_sets_pairs_table_times_with_each_attribute(self):
+        """Tests that a table's time list is converted to its own sorted set, and that each attribute value list under
+        the table is paired with the table's times.
+        """
+        self.interface._r.scan_iter.side_effect = [["instruments:1:prosensing_paf:time"],
+                                                   ["instruments:1:prosensing_paf:voltage:value"]]
+        self.interface._r.exists.return_value = False
+        self.interface._r.lrange.side_effect = [["1970-01-01T00:01:00"], ["5.0"]]
+        pipe = self.interface._r.pipeline.return_value
+
+        converted_keys = self.interface.convert_lists_to_sorted_sets()
+
+        self.assertEqual(converted_keys, ["instruments:1:prosensing_paf:series",
+                                          "instruments:1:prosensing_paf:voltage:series"],
+                         "Converted keys '%s' are not as expected." % converted_keys)
+        pipe.zadd.assert_any_call("instruments:1:prosensing_paf:voltage:series", {"1970-01-01T00:01:00|5.0": 60.0})
+        self.assertFalse(pipe.delete.called, "Lists were deleted without 'delete_lists'.")
+
+
+class TestBatchReads(TestCase):
+
+    def setUp(self):
+        self.interface = redis_interface.RedisInterface()
+        self.interface._r = mock.Mock()
+        self.pipe = self.interface._r.pipeline.return_value
+
+    def test_get_most_recent_values_fetches_every_attribute_in_one_round_trip(self):
+        """Tests that the latest time and value of attributes from different instruments, with and without a table, are
+        all queued on one pipeline that is executed once, and that each response is matched back to its request.
+        """
+        self.pipe.execute.return_value = ["2017-01-01T00:01:00", "1.5", "2017-01-01T00:02:00", "7.0", None, None]
+
+        results = self.interface.get_most_recent_values([(1, "temperature", None), (2, "voltage", "prosensing_paf"),
+                                                         ("not an id", "humidity", None), (3, "humidity", None)])
+
+        self.pipe.execute.assert_called_once_with()
+        self.assertFalse(self.interface._r.lindex.called, "A read was sent outside the pipeline.")
+        self.pipe.lindex.assert_any_call("instruments:2:prosensing_paf:time", 0)
+        self.pipe.lindex.assert_any_call("instruments:2:prosensing_paf:voltage:value", 0)
+        self.assertEqual(results, [dict(time="2017-01-01T00:01:00", value="1.5"),
+                                   dict(time="2017-01-01T00:02:00", value="7.0"), {}, {}],
+                         "Results '%s' do not match their requests." % results)
+
+    def test_get_values_between_times_filters_each_attribute_to_the_time_range(self):
+        """Tests that the time and value lists of every attribute are fetched in one round trip, and that each
+        attribute's entries are filtered to the time range separately.
+        """
+        self.pipe.execute.return_value = [["2017-01-01T00:03:00", "2017-01-01T00:02:00"], ["3.0", "2.0"],
+                                          ["2017-01-01T00:01:00"], ["1.0"]]
+
+        results = self.interface.get_values_between_times([(1, "temperature", None), (2, "voltage", None)],
+                                                          datetime.datetime(2017, 1, 1, 0, 1),
+                                                          datetime.datetime(2017, 1, 1, 0, 2))
+
+        self.pipe.execute.assert_called_once_with()
+        self.assertEqual(results, [[("2017-01-01T00:02:00", "2.0")], [("2017-01-01T00:01:00", "1.0")]],
+                         "Results '%s' were not filtered to the time range." % results)
+
+
+class TestConnectionPool(TestCase):
+
+    def tearDown(self):
+        redis_interface._process_connection_pools.clear()
+
+    def test_interfaces_share_the_process_connection_pool(self):
+        """Tests that every call to 'get_process_connection_pool' in the same process returns the same pool, and that
+        interfaces created with it take their connections from it.
+        """
+        pool = redis_interface.get_process_connection_pool(max_connections=3)
+        self.assertIs(redis_interface.get_process_connection_pool(), pool, "A second pool was created for the process.")
+        self.assertEqual(pool.max_connections, 3, "Pool was not created with the requested size.")
+
+        first_interface = redis_interface.RedisInterface(connection_pool=pool)
+        second_interface = redis_interface.RedisInterface(connection_pool=pool)
+        self.assertIs(first_interface._r.connection_pool, pool, "Interface did not use the given pool.")
+        self.assertIs(second_interface._r.connection_pool, pool, "Interface did not use the given pool.")
+
+    @mock.patch(__name__ + ".redis_interface.os.getpid")
+    def test_a_forked_process_gets_its_own_connection_pool(self, getpid):
+        """Tests that a process with a different id than the one that created a pool gets a new pool, rather than
+        reusing connections opened by its parent.
+        """
+        getpid.return_value = 100
+        parent_pool = redis_interface.get_process_connection_pool()
+        getpid.return_value = 101
+        child_pool = redis_interface.get_process_connection_pool()
+
+        self.assertIsNot(parent_pool, child_pool, "Forked process reused its parent's pool.")
+
+
+class TestBackfill(TestCase):
+
+    def setUp(self):
+        self.interface = redis_interface.RedisInterface()
+        self.interface._r = mock.MagicMock()
+        self.pipe = self.interface._r.pipeline.return_value.__enter__.return_value
+        self.fetched_times = [datetime.datetime(2017, 1, 1, 0, 2), datetime.datetime(2017, 1, 1, 0, 3)]
+        self.fetch_entries = mock.Mock(return_value=(self.fetched_times, [[2.0, 3.0]]))
+
+    def test_backfill_values_fetches_entries_after_the_newest_held(self):
+        """Tests that only the entries after the newest time Redis holds are fetched, and that they are pushed onto the
+        attribute's lists in one transaction, oldest first.
+        """
+        self.pipe.lindex.return_value = "2017-01-01T00:01:00+00:00"
+
+        added = self.interface.backfill_values(4, ["temperature"], self.fetch_entries)
+
+        self.fetch_entries.assert_called_once_with(datetime.datetime(2017, 1, 1, 0, 1))
+        self.pipe.watch.assert_called_once_with("instruments:4:temperature:time", "instruments:4:temperature:value")
+        self.pipe.multi.assert_called_once_with()
+        self.pipe.lpush.assert_any_call("instruments:4:temperature:time", "2017-01-01T00:02:00", "2017-01-01T00:03:00")
+        self.pipe.lpush.assert_any_call("instruments:4:temperature:value", 2.0, 3.0)
+        self.pipe.execute.assert_called_once_with()
+        self.assertEqual(added, 2, "Number of entries added was not returned.")
+
+    def test_backfill_values_replaces_entries_written_during_a_failed_transaction(self):
+        """Tests that when another client writes to the keys before the transaction runs, the retry removes the entries
+        it pushed that are newer than the newest entry held at the start, and fetches again from that entry.
+        """
+        self.pipe.lindex.return_value = "2017-01-01T00:01:00"
+        self.pipe.lrange.return_value = ["2017-01-01T00:04:00", "2017-01-01T00:01:00"]
+        self.pipe.execute.side_effect = [redis_interface.redis.WatchError(), []]
+
+        self.interface.backfill_values(4, ["voltage"], self.fetch_entries, table_name="prosensing_paf")
+
+        self.assertEqual(self.fetch_entries.call_args_list, [mock.call(datetime.datetime(2017, 1, 1, 0, 1))] * 2,
+                         "Retry did not fetch from the newest entry held at the start.")
+        self.pipe.ltrim.assert_any_call("instruments:4:prosensing_paf:time", 1, -1)
+        self.pipe.ltrim.assert_any_call("instruments:4:prosensing_paf:voltage:value", 1, -1)
+
+    def test_backfill_values_with_sorted_sets_adds_entries_without_a_transaction(self):
+        """Tests that with sorted set storage, the newest time held is read from the table's sorted set and the fetched
+        entries are added to the table's and the attribute's sorted sets.
+        """
+        self.interface.storage = "sorted_set"
+        self.interface._r.zrevrange.return_value = ["2017-01-01T00:01:00"]
+        pipe = self.interface._r.pipeline.return_value
+
+        self.interface.backfill_values(4, ["voltage"], self.fetch_entries, table_name="prosensing_paf")
+
+        self.fetch_entries.assert_called_once_with(datetime.datetime(2017, 1, 1, 0, 1))
+        self.assertFalse(pipe.watch.called, "Sorted sets were watched.")
+        self.assertEqual(pipe.zadd.call_count, 2, "Entries were not added to the table's and attribute's sorted sets.")
+        pipe.execute.assert_called_once_with()
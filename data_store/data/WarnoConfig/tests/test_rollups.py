@@ -0,0 +1,79 @@
+import math
+import mock
+import datetime
+
+from unittest import TestCase
+
+from .. import rollups
+
+
+class TestRollups(TestCase):
+
+    def test_split_time_range_reads_whole_days_and_hours_from_rollups_and_only_edges_from_rows(self):
+        """Tests that a range from partway through one day's hour to partway through a later day's hour, ending before
+        the rollups are complete to, is split into whole days, whole hours on either side, and partial hour edges."""
+        start_time = datetime.datetime(2017, 1, 1, 22, 30)
+        end_time = datetime.datetime(2017, 1, 4, 2, 15)
+
+        ranges = rollups.split_time_range(start_time, end_time, datetime.datetime(2017, 1, 5))
+
+        self.assertListEqual(ranges[rollups.DAY], [(datetime.datetime(2017, 1, 2), datetime.datetime(2017, 1, 4))],
+                             "Whole days were not read from the daily rollups.")
+        self.assertListEqual(ranges[rollups.HOUR], [(datetime.datetime(2017, 1, 1, 23), datetime.datetime(2017, 1, 2)),
+                                                    (datetime.datetime(2017, 1, 4), datetime.datetime(2017, 1, 4, 2))],
+                             "Whole hours at the edges were not read from the hourly rollups.")
+        self.assertListEqual(ranges[None], [(start_time, datetime.datetime(2017, 1, 1, 23)),
+                                            (datetime.datetime(2017, 1, 4, 2), end_time)],
+                             "Only the partial hours at the edges should be read from the data rows.")
+
+    def test_split_time_range_reads_rows_after_rollups_are_complete_to(self):
+        """Tests that with no end, everything after the time the rollups are complete to is read from the data rows,
+        and that everything is read from the data rows when there are no rollups."""
+        start_time = datetime.datetime(2017, 1, 1)
+        rolled_up_until = datetime.datetime(2017, 1, 1, 5)
+
+        ranges = rollups.split_time_range(start_time, None, rolled_up_until)
+        self.assertListEqual(ranges[rollups.HOUR], [(start_time, rolled_up_until)], "Rolled up hours were not used.")
+        self.assertListEqual(ranges[None], [(rolled_up_until, None)], "Rows after the rollups were not read.")
+
+        ranges = rollups.split_time_range(start_time, None, None)
+        self.assertListEqual(ranges[None], [(start_time, None)], "Rows were not read when there were no rollups.")
+
+    def test_combine_aggregates_matches_statistics_of_all_values(self):
+        """Tests that combining the rollups of two parts gives the same statistics as calculating them from the values
+        of both parts together, ignoring parts with no values."""
+        values = [1.0, 2.0, 4.0, 9.0]
+        parts = [(2, 3.0, 0.5, 1.0, 2.0), (0, None, None, None, None), (2, 13.0, 12.5, 4.0, 9.0)]
+
+        minimum, maximum, average, std_deviation, count = rollups.combine_aggregates(parts)
+
+        expected_average = sum(values) / len(values)
+        expected_std_deviation = math.sqrt(sum((value - expected_average) ** 2 for value in values) / len(values))
+        self.assertEqual((minimum, maximum, count), (1.0, 9.0, 4), "Minimum, maximum or count is wrong.")
+        self.assertAlmostEqual(average, expected_average, msg="Average does not match the values.")
+        self.assertAlmostEqual(std_deviation, expected_std_deviation, msg="Standard deviation does not match.")
+        self.assertEqual(rollups.combine_aggregates([]), (None, None, None, None, 0), "No values should give None.")
+
+    def test_combine_aggregates_keeps_precision_for_large_values_that_vary_little(self):
+        """Tests that the standard deviation of large values that differ by little is exact, where calculating it from
+        the sum of squares would lose it to cancellation."""
+        values = [1e9 + offset for offset in [0.0, 1.0, 2.0, 3.0]]
+        parts = [(2, values[0] + values[1], 0.5, values[0], values[1]), (2, values[2] + values[3], 0.5, values[2],
+                                                                         values[3])]
+
+        std_deviation = rollups.combine_aggregates(parts)[3]
+
+        self.assertAlmostEqual(std_deviation, math.sqrt(1.25), places=9, msg="Standard deviation lost its precision.")
+
+    def test_update_rollups_continues_from_last_update_minus_lookback(self):
+        """Tests that an instrument that was already rolled up is refreshed from 'lookback' before its last update, and
+        that its progress is moved forward rather than inserted again."""
+        session = mock.Mock()
+        session.execute.return_value.fetchone.return_value = (datetime.datetime(2017, 1, 2, 12),)
+        until = datetime.datetime(2017, 1, 2, 14)
+
+        with mock.patch.object(rollups, "refresh_rollups") as refresh_rollups:
+            rollups.update_rollups(session, 1, until, datetime.timedelta(hours=6))
+
+        refresh_rollups.assert_called_once_with(session, 1, datetime.datetime(2017, 1, 2, 6), until)
+        self.assertIn("UPDATE rollup_progress", session.execute.call_args[0][0], "Progress was not updated.")
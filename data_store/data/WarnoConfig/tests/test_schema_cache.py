@@ -0,0 +1,47 @@
+import mock
+
+from unittest import TestCase
+
+from .. import schema_cache
+
+
+class TestSchemaCache(TestCase):
+
+    def setUp(self):
+        schema_cache.invalidate()
+        self.addCleanup(schema_cache.invalidate)
+
+        self.session = mock.Mock()
+        self.session.execute.return_value.fetchall.return_value = [("time", "timestamp without time zone"),
+                                                                   ("temperature", "double precision")]
+        version_patcher = mock.patch.object(schema_cache, "_get_schema_version", return_value="9a3f1c5e7b20")
+        self.get_schema_version = version_patcher.start()
+        self.addCleanup(version_patcher.stop)
+
+    def test_get_columns_only_reads_each_table_once(self):
+        """Tests that a table's columns are read from the database the first time they are asked for, and from the
+        cache afterwards."""
+        first_columns = schema_cache.get_columns(self.session, "prosensing_paf")
+        second_columns = schema_cache.get_columns(self.session, "prosensing_paf")
+
+        self.assertEqual(self.session.execute.call_count, 1, "Columns were read from the database more than once.")
+        self.assertListEqual(first_columns, second_columns, "Cached columns differ from the columns read.")
+        self.assertListEqual(schema_cache.get_column_names(self.session, "prosensing_paf"), ["time", "temperature"],
+                             "Column names were not returned in order.")
+
+    @mock.patch.object(schema_cache, "VERSION_CHECK_INTERVAL", 0)
+    def test_get_columns_reads_tables_again_after_a_migration(self):
+        """Tests that the cached columns are discarded once the database is found to be at a different migration."""
+        schema_cache.get_columns(self.session, "prosensing_paf")
+        self.get_schema_version.return_value = "c41e8d2a6f93"
+        schema_cache.get_columns(self.session, "prosensing_paf")
+
+        self.assertEqual(self.session.execute.call_count, 2, "Columns were not read again after a migration.")
+
+    def test_table_exists_caches_missing_tables(self):
+        """Tests that a table with no columns does not exist, and that it is not looked up again."""
+        self.session.execute.return_value.fetchall.return_value = []
+
+        self.assertFalse(schema_cache.table_exists(self.session, "temperature"), "Missing table was found to exist.")
+        self.assertFalse(schema_cache.table_exists(self.session, "temperature"), "Missing table was found to exist.")
+        self.assertEqual(self.session.execute.call_count, 1, "Missing table was looked up more than once.")
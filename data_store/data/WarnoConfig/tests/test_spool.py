@@ -0,0 +1,103 @@
+import os
+import shutil
+import tempfile
+
+from unittest import TestCase
+
+from .. import spool
+
+
+class TestSpool(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_read_returns_records_in_order_until_they_are_committed(self):
+        """Tests that records are read back in the order they were appended, that reading does not remove them, and that
+        committing the read position moves on to the following records."""
+        test_spool = spool.Spool(self.directory)
+        test_spool.append(["first", "second", "third"])
+
+        records, position = test_spool.read(2)
+        self.assertEqual(records, ["first", "second"], "Records were not read in the order they were appended.")
+        records, position = test_spool.read(2)
+        self.assertEqual(records, ["first", "second"], "Reading without committing removed records.")
+
+        test_spool.commit(position)
+        records, position = test_spool.read(2)
+        self.assertEqual(records, ["third"], "Committing did not move past the committed records.")
+        self.assertEqual(test_spool.depth(), 1, "Depth does not count the one uncommitted record.")
+
+    def test_uncommitted_records_survive_reopening_the_spool(self):
+        """Tests that a new Spool on the same directory resumes at the first uncommitted record."""
+        test_spool = spool.Spool(self.directory)
+        test_spool.append(["first", "second", "third"])
+        records, position = test_spool.read(1)
+        test_spool.commit(position)
+
+        reopened_spool = spool.Spool(self.directory)
+        records, position = reopened_spool.read(10)
+        self.assertEqual(records, ["second", "third"], "Reopened spool did not resume after the committed record.")
+        self.assertEqual(reopened_spool.depth(), 2, "Reopened spool does not count the uncommitted records.")
+
+    def test_partially_written_record_is_dropped_when_the_spool_is_reopened(self):
+        """Tests that a record cut short by a crash is ignored, and that records appended afterwards are still read."""
+        test_spool = spool.Spool(self.directory)
+        test_spool.append(["complete"])
+        segment_path = test_spool._segment_path(0)
+        with open(segment_path, "ab") as segment_file:
+            segment_file.write(spool.RECORD_HEADER.pack(100) + "partial")
+
+        reopened_spool = spool.Spool(self.directory)
+        reopened_spool.append(["next"])
+        records, position = reopened_spool.read(10)
+        self.assertEqual(records, ["complete", "next"], "Partially written record was not dropped.")
+
+    def test_committed_segments_are_removed(self):
+        """Tests that a new segment is started once a segment is full, and that segments are deleted once every record
+        in them is committed."""
+        test_spool = spool.Spool(self.directory, segment_bytes=10)
+        test_spool.append(["0123456789"])
+        test_spool.append(["abcdefghij"])
+        self.assertEqual(len(os.listdir(self.directory)), 2, "A full segment did not start a new segment.")
+
+        records, position = test_spool.read(10)
+        test_spool.commit(position)
+        records, position = test_spool.read(10)
+        self.assertEqual(records, ["abcdefghij"], "Reading did not move on to the next segment.")
+        test_spool.commit(position)
+
+        segments = [name for name in os.listdir(self.directory) if name.endswith(spool.SEGMENT_EXTENSION)]
+        self.assertEqual(len(segments), 1, "Fully committed segment was not removed.")
+        self.assertEqual(test_spool.depth(), 0, "Spool is not empty after committing every record.")
+
+    def test_oldest_drop_policy_drops_oldest_segments_to_stay_within_quota(self):
+        """Tests that appending past the quota deletes the oldest segments, uncommitted records included, and that
+        committing records that were dropped while being read does not move the read position back."""
+        test_spool = spool.Spool(self.directory, segment_bytes=10, max_bytes=30, drop_policy="oldest")
+        test_spool.append(["0123456789"])
+        records, position = test_spool.read(10)
+        test_spool.append(["abcdefghij"])
+        test_spool.append(["ABCDEFGHIJ"])
+
+        self.assertLessEqual(test_spool.size_bytes(), 30, "Spool grew past its quota.")
+        self.assertEqual(test_spool.dropped(), 1, "Dropped record was not counted.")
+        self.assertEqual(test_spool.depth(), 2, "Depth does not match the records kept.")
+
+        test_spool.commit(position)
+        records, position = test_spool.read(10)
+        self.assertEqual(records, ["abcdefghij"], "Oldest kept record was not read next.")
+
+    def test_newest_drop_policy_drops_appended_records_that_do_not_fit(self):
+        """Tests that with the "newest" policy spooled records are kept, and appended records beyond the quota are
+        dropped."""
+        test_spool = spool.Spool(self.directory, max_bytes=30, drop_policy="newest")
+        test_spool.append(["0123456789", "abcdefghij", "ABCDEFGHIJ"])
+
+        records, position = test_spool.read(10)
+        self.assertEqual(records, ["0123456789", "abcdefghij"], "Records that fit within the quota were not kept.")
+        self.assertEqual(test_spool.dropped(), 1, "Dropped record was not counted.")
+        self.assertRaises(ValueError, spool.Spool, self.directory, drop_policy="random")
@@ -0,0 +1,70 @@
+import mock
+
+from unittest import TestCase
+
+from .. import schema_cache
+from .. import table_inserter
+
+
+class TestTableInserter(TestCase):
+
+    def setUp(self):
+        # Every query returns the same set of columns, which is only used for the 'information_schema' lookups.
+        self.session = mock.Mock()
+        self.session.execute.return_value.fetchall.return_value = [("time", "timestamp without time zone"),
+                                                                   ("instrument_id", "integer"),
+                                                                   ("temperature", "double precision"),
+                                                                   ("mode", "character varying")]
+        self.inserter = table_inserter.TableInserter("test_table")
+
+        # Columns are looked up through the process-wide schema cache, which must not hold another test's columns
+        schema_cache.invalidate()
+        version_patcher = mock.patch.object(schema_cache, "_get_schema_version", return_value="9a3f1c5e7b20")
+        version_patcher.start()
+        self.addCleanup(version_patcher.stop)
+
+    def test_insert_reuses_statement_for_rows_with_the_same_columns(self):
+        """Tests that two rows filling the same columns are inserted with the same statement, and that the table's
+        columns are only looked up once."""
+        self.inserter.insert(self.session, dict(time="2017-01-01T00:00:00", instrument_id=1, temperature=1.5))
+        self.inserter.insert(self.session, dict(time="2017-01-01T00:01:00", instrument_id=1, temperature=2.5))
+
+        # The first call is the column lookup, the next two are the inserts.
+        self.assertEqual(self.session.execute.call_count, 3, "Columns were looked up more than once.")
+        first_statement = self.session.execute.call_args_list[1][0][0]
+        second_statement = self.session.execute.call_args_list[2][0][0]
+        self.assertIs(first_statement, second_statement, "A new statement was built for the same columns.")
+        self.assertIn(":p0", str(first_statement), "Statement does not use bound parameters.")
+
+    def test_insert_converts_values_by_column_type(self):
+        """Tests that integer columns are bound as integers, infinities are bound as None, and null characters are
+        stripped from strings."""
+        self.inserter.insert(self.session, dict(instrument_id="3", temperature="-inf", mode="standby\x00\x00"))
+
+        parameters = self.session.execute.call_args_list[-1][0][1]
+        # Parameters are numbered by the sorted column names: instrument_id, mode, temperature
+        self.assertEqual(parameters["p0"], 3, "Integer value was not converted to an integer.")
+        self.assertIsInstance(parameters["p0"], int, "Integer value was bound as a float.")
+        self.assertEqual(parameters["p1"], "standby", "Null characters were not stripped from string value.")
+        self.assertIsNone(parameters["p2"], "Infinite value was not converted to None.")
+
+    def test_insert_binds_large_integers_exactly_and_floats_as_floats(self):
+        """Tests that an integer too large for a float to hold exactly is bound unchanged, that a whole number sent as
+        "7.0" is bound as an integer, and that floating point columns are bound as floats."""
+        self.inserter.insert(self.session, dict(instrument_id=2 ** 53 + 1, temperature="1"))
+        parameters = self.session.execute.call_args_list[-1][0][1]
+        self.assertEqual(parameters["p0"], 2 ** 53 + 1, "Large integer lost its precision.")
+        self.assertIsInstance(parameters["p1"], float, "Floating point value was not bound as a float.")
+
+        self.inserter.insert(self.session, dict(instrument_id="7.0"))
+        self.assertEqual(self.session.execute.call_args_list[-1][0][1]["p0"], 7, "Whole number was not an integer.")
+
+    def test_insert_raises_value_error_for_unknown_column_after_reloading_columns(self):
+        """Tests that a row with a column the table does not have raises a ValueError, after the columns have been
+        reloaded to check that the table was not migrated since they were cached."""
+        self.inserter.insert(self.session, dict(instrument_id=1))
+
+        with self.assertRaises(ValueError):
+            self.inserter.insert(self.session, dict(instrument_id=1, not_a_column=5))
+        # Initial lookup, first insert, then the reload for the unknown column.
+        self.assertEqual(self.session.execute.call_count, 3, "Columns were not reloaded for an unknown column.")
@@ -2,8 +2,12 @@ import subprocess
 import psycopg2
 import pandas
 import ijson
+import gzip
+import json
+import math
 import sys
 import os
+import itertools
 
 from sqlalchemy import create_engine
 
@@ -23,6 +27,9 @@ status_text = {1: "OPERATIONAL",
                4: "IN-UPGRADE",
                5: "TRANSIT"}
 
+# Engines created by 'get_engine', keyed by the id of the process that created them.
+_process_engines = {}
+
 
 def status_code_to_text(status):
     """Convert an instrument's status code to its text equivalent.
@@ -228,6 +235,35 @@ def initialize_database(curr, path="schema/"):
             create_table_from_file("%s/%s.schema" % (path, schema), curr)
 
 
+def get_engine():
+    """Returns the SQLAlchemy engine for the default WARNO database server for the current process, creating it the
+    first time it is asked for.  Each process gets its own engine, as pooled connections can not be shared with
+    processes forked from the one that opened them.  Every helper here that reads or writes the database shares the
+    engine's pool, so the configuration is only read and a connection only opened once, rather than on every call.
+
+    The pool keeps up to 'pool_size' connections open, opening at most 'pool_max_overflow' more while they are all in
+    use, and replaces connections that have been open longer than 'pool_recycle' seconds, all from the 'database'
+    section of config.yml.  Configuration files without these keys get 5, 10 and 3600.
+
+    Returns
+    -------
+    engine: sqlalchemy.engine.Engine
+        The current process's engine.
+
+    """
+    pid = os.getpid()
+    if pid not in _process_engines:
+        db_cfg = config.get_config_context()['database']
+        s_db_cfg = config.get_config_context()['s_database']
+        _process_engines[pid] = create_engine('postgresql://%s:%s@%s:%s/%s' %
+                                              (db_cfg['DB_USER'], s_db_cfg['DB_PASS'], db_cfg['DB_HOST'],
+                                               db_cfg['DB_PORT'], db_cfg['DB_NAME']),
+                                              pool_size=config.get_int("database.pool_size", 5),
+                                              max_overflow=config.get_int("database.pool_max_overflow", 10),
+                                              pool_recycle=config.get_int("database.pool_recycle", 3600))
+    return _process_engines[pid]
+
+
 def load_data_into_table(filename, table):
     """Loads a comma separated (no spaces) file 'filename' into the database table 'table'.
 
@@ -248,12 +284,7 @@ def load_data_into_table(filename, table):
 
     """
     df = pandas.read_csv(filename)
-    db_cfg = config.get_config_context()['database']
-    s_db_cfg = config.get_config_context()['s_database']
-    engine = create_engine('postgresql://%s:%s@%s:%s/%s' %
-                           (db_cfg['DB_USER'], s_db_cfg['DB_PASS'], db_cfg['DB_HOST'],
-                            db_cfg['DB_PORT'], db_cfg['DB_NAME']))
-    df.to_sql(table, engine, if_exists='append', index=False, chunksize=900)
+    df.to_sql(table, get_engine(), if_exists='append', index=False, chunksize=900)
 
 
 def dump_table_to_csv(filename, table, server=None):
@@ -266,17 +297,13 @@ def dump_table_to_csv(filename, table, server=None):
         Name of the file to be written to.
     table: string
         Name of the database table to dump into a file.
-    server: sqlalchemy engine, optional
-        A sqlalchemy engine for whichever database server the data will be read from,
-        defaults to the default WARNO server.
+    server: string, optional
+        Database URI of whichever database server the data will be read from,
+        defaults to the default WARNO server, read through the shared engine from 'get_engine'.
 
     """
     if server is None:
-        db_cfg = config.get_config_context()['database']
-        s_db_cfg = config.get_config_context()['s_database']
-        engine = create_engine('postgresql://%s:%s@%s:%s/%s' %
-                           (db_cfg['DB_USER'], s_db_cfg['DB_PASS'], db_cfg['DB_HOST'],
-                            db_cfg['DB_PORT'], db_cfg['DB_NAME']))
+        server = get_engine()
     else:
         server = create_engine(server)
 
@@ -285,79 +312,158 @@ def dump_table_to_csv(filename, table, server=None):
 
 
 def connect_db():
-    """ Connects to the default WARNO database server.
+    """ Connects to the default WARNO database server, taking a connection from the shared engine's pool (see
+    'get_engine').  Closing the connection returns it to the pool.
+
     Returns
     -------
     psycopg2 connection object for the WARNO database server.
 
     """
-    db_cfg = config.get_config_context()['database']
-    s_db_cfg = config.get_config_context()['s_database']
-    engine = create_engine('postgresql://%s:%s@%s:%s/%s' %
-                           (db_cfg['DB_USER'], s_db_cfg['DB_PASS'], db_cfg['DB_HOST'],
-                            db_cfg['DB_PORT'], db_cfg['DB_NAME']))
+    return get_engine().raw_connection()
+
 
+# Written in place of a value in COPY's text format to load it as NULL.
+COPY_NULL = "\\N"
 
-def save_rows_to_table(table, columns, data):
-    """ Saves the list of database values in 'data' into the 'columns' for the specified 'table'.
+
+def format_copy_value(value, data_type):
+    """Converts a value read from an archive into its representation in COPY's text format, according to the data type
+    of the column it is loaded into.
 
     Parameters
     ----------
-    table: string
-        Name of the database table to save the entries into.
-    columns: list of strings
-        List of column names to save the database entries into.  Length of list should match the length of each element
-        of 'data', as each value in a 'data' row maps to the corresponding column in 'columns'.
-    data: list of value lists
-        'data' is effectively a list of database table rows, with each row having the same number of elements as
-        'columns', and each element being the proper type for the column (not enforced here).
+    value: object
+        Value as read from the archive's json.  Times are ISO 8601 strings, which Postgres reads as they are, and
+        arrays are lists.
+    data_type: string
+        The column's data type, as named by 'information_schema' in the archive's column definitions, such as
+        'double precision', 'timestamp without time zone' or 'ARRAY'.
 
-    """
+    Returns
+    -------
+    text: string
+        The value in COPY's text format, with tabs, newlines and backslashes escaped.
 
-    # The index for the time column varies by table, but time must be updated to save properly.
-    if table in ["prosensing_paf", "instrument_logs"]:
-        time_index = 1
-    elif table == "pulse_captures":
-        time_index = 2
+    """
+    if value is None:
+        return COPY_NULL
+
+    if data_type == "ARRAY":
+        text = _format_array(value)
+    elif data_type in ("json", "jsonb"):
+        text = json.dumps(value)
+    elif data_type == "boolean" and not isinstance(value, basestring):
+        text = "t" if value else "f"
+    elif isinstance(value, float):
+        text = _format_float(value)
+    elif isinstance(value, basestring):
+        text = value
     else:
-        time_index = 3
+        text = str(value)
+
+    if isinstance(text, unicode):
+        text = text.encode("utf-8")
+    return text.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def _format_float(value):
+    """Writes a float the way Postgres reads it, without losing precision and including infinities and NaN."""
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "Infinity" if value > 0 else "-Infinity"
+    return repr(value)
+
+
+def _format_array(values):
+    """Writes a list, which may be nested, as a Postgres array literal such as '{1.5,NULL,2.5}'."""
+    elements = []
+    for value in values:
+        if value is None:
+            elements.append("NULL")
+        elif isinstance(value, list):
+            elements.append(_format_array(value))
+        elif isinstance(value, float):
+            elements.append(_format_float(value))
+        elif isinstance(value, basestring):
+            elements.append('"%s"' % value.replace("\\", "\\\\").replace('"', '\\"'))
+        else:
+            elements.append(str(value))
+    return "{" + ",".join(elements) + "}"
+
+
+class CopyRowStream(object):
+    """File-like object that reads rows in COPY's text format, formatting each row only when it is read.  Passed to
+    psycopg2's 'copy_expert', rows are streamed to the database as they are read from the archive, so a table is
+    loaded with one COPY without all of its rows being held in memory.
 
-    for item in data:
-        # Update the JSON compatible string for each data to one acceptable to the SQL query
-        item[time_index] = item[time_index].replace('Z', '').replace('T', ' ')
-
-    # First section of sql query, looks like 'INSERT INTO table_name(col_1, col_2, ..., col_N) VALUES '
-    sql_columns = "INSERT INTO " + str(table) + "(" + ", ".join(columns) + ") VALUES "
+    Parameters
+    ----------
+    rows: iterable of value lists
+        The rows to load, each with one value for each of 'data_types'.
+    data_types: list of strings
+        The data type of each column, see 'format_copy_value'.
 
-    # A bit hard to read, but should make it faster.
-    # Each row of data is written as a string, then parentheses are added to make it sql friendly.
-    # Final join makes it comma separated for the insert.
-    sql_data = ", ".join(["(" + ", ".join(["'" + str(d) + "'" if str(d) != 'None' else "NULL" for d in data_row]) +
-                          ")" for data_row in data])
+    """
 
-    # Connect the column and value strings into a full query
-    full_sql_query = sql_columns + sql_data
+    def __init__(self, rows, data_types):
+        self.rows = iter(rows)
+        self.data_types = data_types
+        self.row_count = 0
+        self._buffer = ""
+
+    def read(self, size=-1):
+        """Returns up to 'size' characters of formatted rows, or every remaining row if 'size' is negative.  Returns an
+        empty string once every row has been read."""
+        while size < 0 or len(self._buffer) < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            self._buffer += "\t".join(format_copy_value(value, data_type)
+                                      for value, data_type in zip(row, self.data_types)) + "\n"
+            self.row_count += 1
+
+        if size < 0:
+            size = len(self._buffer)
+        text, self._buffer = self._buffer[:size], self._buffer[size:]
+        return text
+
+
+def copy_rows_to_table(cursor, table, columns, rows):
+    """Loads rows into a database table with a single 'COPY ... FROM STDIN', streaming them from 'rows' as they are
+    read.  Each value is converted according to the data type of its column.  The rows are not committed.
 
-    # Connect to the database and execute the sql, closing the connection even if there is an exception.
-    db_cfg = config.get_config_context()['database']
-    s_db_cfg = config.get_config_context()['s_database']
+    Parameters
+    ----------
+    cursor: psycopg2 cursor
+        Cursor of the connection the rows are loaded through.
+    table: string
+        Name of the database table to load the rows into.
+    columns: list of (column_name, data_type) pairs
+        The columns each row has a value for, in the order of the values, as written in an archive's table definition.
+    rows: iterable of value lists
+        The rows to load.
 
-    engine = create_engine('postgresql://%s:%s@%s:%s/%s' %
-                           (db_cfg['DB_USER'], s_db_cfg['DB_PASS'], db_cfg['DB_HOST'],
-                            db_cfg['DB_PORT'], db_cfg['DB_NAME']))
-    connection = engine.connect()
+    Returns
+    -------
+    row_count: integer
+        Number of rows loaded.
 
-    try:
-        connection.execute(full_sql_query)
-        connection.execute("COMMIT")
-    finally:
-        connection.close()
+    """
+    stream = CopyRowStream(rows, [column[1] for column in columns])
+    cursor.copy_expert("COPY %s (%s) FROM STDIN" % (table, ", ".join(column[0] for column in columns)), stream)
+    return stream.row_count
 
 
 def load_json_data(filename):
-    """ Load json data from 'filename' into the database. Each file should have a list of 'definition'/'data' pairs, one
-    for each database table to have data loaded in.  Each definition should at least have: 'table_name', 'num_entries',
-    and 'columns'.
+    """ Load json data from 'filename' into the database.  Files ending in '.gz' are read as the gzip compressed newline
+    delimited json written by the Event Manager's archive, see 'load_ndjson_data'.  Any other file should have a list of
+    'definition'/'data' pairs, one for each database table to have data loaded in.  Each definition should at least
+    have: 'table_name', 'num_entries', and 'columns'.
+
+    Each table is loaded with one streaming COPY, see 'copy_rows_to_table', and the whole file is loaded through one
+    connection in a single transaction, so either all of the file is loaded or none of it is.
 
     Example File (indentation unnecessary):
 
@@ -397,42 +503,67 @@ def load_json_data(filename):
         Name of the file to be loaded into the database.  Must be proper JSON.
 
     """
+    connection = connect_db()
+
+    try:
+        cursor = connection.cursor()
+        if filename.endswith(".gz"):
+            load_ndjson_data(filename, cursor)
+        else:
+            with open(filename, "rb") as jfile:
+                # Read in the table definitions for the data
+                table_defs = list(ijson.items(jfile, "item.definition"))
+
+                # Seek back to the beginning of the file so it can be rerun, pulling data rather than definitions.  The
+                # rows of every table are read in one pass, each table taking the next 'num_entries' of them.
+                jfile.seek(0)
+                data_rows = ijson.items(jfile, "item.data.item")
+                for definition in table_defs:
+                    if definition['num_entries'] > 0:
+                        copy_rows_to_table(cursor, definition['table_name'], definition['columns'],
+                                           itertools.islice(data_rows, definition['num_entries']))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+
+def load_ndjson_data(filename, cursor):
+    """ Load gzip compressed, newline delimited json data from 'filename' into the database.  Each table in the file
+    starts with a line holding its definition, which should at least have 'table_name' and 'columns', followed by one
+    line for each of the table's data rows.  The file is read one line at a time, and each table's rows are streamed to
+    the database with one COPY as they are read, see 'copy_rows_to_table'.
+
+    Example File (uncompressed):
 
-    table_defs = []
-    with open(filename, "rb") as jfile:
-        # Read in the table definitions for the data
-        for definition in ijson.items(jfile, "item.definition"):
-            table_defs.append(definition)
-
-        table_index = 0
-        row_index = 0
-        data = []
-
-        # Seek back to the beginning of the file so it can be rerun, pulling data rather than definitions.
-        jfile.seek(0)
-        for data_row in ijson.items(jfile, "item.data.item"):
-
-            # For any tables with no entries, move on to the next table
-            while table_defs[table_index]['num_entries'] <= 0:
-                table_index += 1
-
-            row_index += 1
-            data.append(data_row)
-
-            # If the number of rows processed matches the number of entries for the table, save off any that
-            # haven't been saved yet, reset the row index, and move on to the next table definition.
-            if row_index >= table_defs[table_index]['num_entries']:
-                # Save data entries
-                if len(data) > 0:
-                    save_rows_to_table(table_defs[table_index]['table_name'],
-                                       [column[0] for column in table_defs[table_index]['columns']], data)
-                data = []
-                table_index += 1
-                row_index = 0
-
-            # Saves data in chunks of 500
-            if len(data) >= 500:
-                # Save data entries
-                save_rows_to_table(table_defs[table_index]['table_name'],
-                                   [column[0] for column in table_defs[table_index]['columns']], data)
-                data = []
+    {"definition": {"table_name": *database table name*, "columns": [[column_name_1, column_type_1], ...,
+                    [column_name_N, column_type_N]]}}
+    [val_1, val_2, ..., val_N]
+    [val_1, val_2, ..., val_N]
+    ...
+    {"definition": { *table_2* }}
+    ...
+
+    Parameters
+    ----------
+    filename: string
+        Name of the file to be loaded into the database.
+    cursor: psycopg2 cursor
+        Cursor of the connection the rows are loaded through.  The rows are not committed.
+
+    """
+    # Each definition line starts the next table, so counting the definitions read groups every row with its table
+    tables_started = [0]
+
+    def table_number(record):
+        if isinstance(record, dict):
+            tables_started[0] += 1
+        return tables_started[0]
+
+    with gzip.open(filename, "rb") as jfile:
+        records = (json.loads(line) for line in jfile if line.strip())
+        for _, table_records in itertools.groupby(records, table_number):
+            definition = next(table_records)['definition']
+            copy_rows_to_table(cursor, definition['table_name'], definition['columns'], table_records)
@@ -0,0 +1,48 @@
+"""Added instrument and time indexes to data tables
+
+Revision ID: c41e8d2a6f93
+Revises: 9a3f1c5e7b20
+Create Date: 2017-05-22 16:03:11.518730
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'c41e8d2a6f93'
+down_revision = '9a3f1c5e7b20'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# Data tables, which are almost always queried for one instrument over a range of time
+data_tables = ['prosensing_paf', 'iris_bite', 'events_with_value', 'events_with_text', 'instrument_logs',
+               'pulse_captures']
+
+# Tables only ever appended to in time order, where a BRIN index on time stays small however large the table grows
+append_only_tables = ['prosensing_paf', 'iris_bite', 'events_with_value', 'events_with_text', 'pulse_captures']
+
+
+def supports_brin():
+    # BRIN indexes were added in Postgres 9.5
+    return op.get_bind().dialect.server_version_info >= (9, 5)
+
+
+def upgrade():
+    for table in data_tables:
+        op.create_index('ix_%s_instrument_id_time' % table, table, ['instrument_id', 'time'])
+    op.create_index('ix_events_with_value_instrument_id_event_code_time', 'events_with_value',
+                    ['instrument_id', 'event_code', 'time'])
+
+    if supports_brin():
+        for table in append_only_tables:
+            op.create_index('ix_%s_time_brin' % table, table, ['time'], postgresql_using='brin')
+
+
+def downgrade():
+    if supports_brin():
+        for table in append_only_tables:
+            op.drop_index('ix_%s_time_brin' % table, table_name=table)
+
+    op.drop_index('ix_events_with_value_instrument_id_event_code_time', table_name='events_with_value')
+    for table in data_tables:
+        op.drop_index('ix_%s_instrument_id_time' % table, table_name=table)
@@ -0,0 +1,130 @@
+"""Partitioned data tables by month
+
+Revision ID: e2d7a9c4b815
+Revises: c41e8d2a6f93
+Create Date: 2017-06-05 15:47:20.913406
+
+Checked by hand against Postgres 11, as the test database is older and skips this migration.  With DB_HOST and
+DB_PORT in the config pointed at a Postgres 11 server, from the repository root:
+
+    source utility_setup_scripts/set_vagrant_env.sh && cd warno_event_manager/src
+    run() { python -c "import flask_migrate, warno_event_manager as em; em.app.app_context().push(); $1"; }
+    run "flask_migrate.upgrade(em.migration_path, 'c41e8d2a6f93')"
+    # Add events timed last year, this month and two years ahead, then:
+    run "flask_migrate.upgrade(em.migration_path, 'e2d7a9c4b815')"
+    psql -c "SELECT tableoid::regclass, count(*) FROM events_with_value GROUP BY 1"
+    run "flask_migrate.downgrade(em.migration_path, 'c41e8d2a6f93')"
+
+After the upgrade the past rows are in '<table>_history' and the future rows in '<table>_default', and after the
+downgrade every row is back in the unpartitioned table.  An event with a NULL time stops the upgrade with an
+error naming its table.
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e2d7a9c4b815'
+down_revision = 'c41e8d2a6f93'
+
+import datetime
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# Data tables and their primary key columns.  A partitioned table's primary key must include the partition column, so
+# each becomes (key, time).
+data_tables = [('prosensing_paf', 'packet_id'), ('iris_bite', 'packet_id'), ('events_with_value', 'id'),
+               ('events_with_text', 'id'), ('instrument_logs', 'log_number'), ('pulse_captures', 'id')]
+
+append_only_tables = ['prosensing_paf', 'iris_bite', 'events_with_value', 'events_with_text', 'pulse_captures']
+
+
+def supports_partitioning():
+    # Primary keys and indexes on partitioned tables were added in Postgres 11.  Older databases keep unpartitioned
+    # tables, and the Event Manager deletes archived rows from them instead of dropping partitions.
+    return op.get_bind().dialect.server_version_info >= (11,)
+
+
+def create_indexes(table):
+    op.create_index('ix_%s_instrument_id_time' % table, table, ['instrument_id', 'time'])
+    if table == 'events_with_value':
+        op.create_index('ix_events_with_value_instrument_id_event_code_time', 'events_with_value',
+                        ['instrument_id', 'event_code', 'time'])
+    if table in append_only_tables:
+        op.create_index('ix_%s_time_brin' % table, table, ['time'], postgresql_using='brin')
+
+
+def get_foreign_keys(table):
+    return op.get_bind().execute(sa.text("SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+                                         "WHERE conrelid = CAST(:table AS regclass) AND contype = 'f'"),
+                                 table=table).fetchall()
+
+
+def upgrade():
+    if not supports_partitioning():
+        return
+
+    # The time column becomes part of the primary key, so it can not be NULL.  Rows without a time have to be fixed or
+    # removed by hand, as there is no partition they could be moved to.
+    bind = op.get_bind()
+    for table, _ in data_tables:
+        null_count = bind.execute('SELECT count(*) FROM %s WHERE time IS NULL' % (table,)).scalar()
+        if null_count:
+            raise RuntimeError("Can not partition '%s' by time: %s rows have no time. Set or delete their times, then "
+                               "run the upgrade again." % (table, null_count))
+
+    # Every existing row goes in one partition ending at the start of next month.  The Event Manager creates monthly
+    # partitions from there on, and a DEFAULT partition holds any row timed beyond them until they are created.
+    now = datetime.datetime.utcnow()
+    history_end = datetime.datetime(now.year + now.month // 12, now.month % 12 + 1, 1)
+
+    for table, key in data_tables:
+        history = '%s_history' % table
+        op.execute('ALTER TABLE %s RENAME TO %s' % (table, history))
+        index_names = bind.execute(sa.text("SELECT indexname FROM pg_indexes WHERE tablename = :table"),
+                                   table=history).fetchall()
+        for (index_name,) in index_names:
+            op.execute('ALTER INDEX %s RENAME TO %s' % (index_name, index_name.replace(table, history, 1)))
+
+        # The foreign keys move to the partitioned table, which gives each partition its own copy
+        foreign_keys = get_foreign_keys(history)
+        for name, _ in foreign_keys:
+            op.execute('ALTER TABLE %s DROP CONSTRAINT %s' % (history, name))
+
+        op.execute('CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS) PARTITION BY RANGE (time)' % (table, history))
+        op.execute('ALTER TABLE %s ADD PRIMARY KEY (%s, time)' % (table, key))
+        for name, definition in foreign_keys:
+            op.execute('ALTER TABLE %s ADD CONSTRAINT %s %s' % (table, name, definition))
+        create_indexes(table)
+
+        # Rows timed from next month on would not fit in the history partition, so they go in the DEFAULT partition,
+        # from which the Event Manager moves them into their monthly partitions once it creates them.
+        op.execute('CREATE TABLE %s_default PARTITION OF %s DEFAULT' % (table, table))
+        op.execute("WITH moved AS (DELETE FROM %s WHERE time >= '%s' RETURNING *) INSERT INTO %s_default "
+                   "SELECT * FROM moved" % (history, history_end.isoformat(' '), table))
+        op.execute("ALTER TABLE %s ATTACH PARTITION %s FOR VALUES FROM (MINVALUE) TO ('%s')"
+                   % (table, history, history_end.isoformat(' ')))
+        sequence = bind.execute(sa.text("SELECT pg_get_serial_sequence(:table, :key)"), table=history, key=key).scalar()
+        op.execute('ALTER SEQUENCE %s OWNED BY %s.%s' % (sequence, table, key))
+
+
+def downgrade():
+    if not supports_partitioning():
+        return
+
+    bind = op.get_bind()
+    for table, key in data_tables:
+        unpartitioned = '%s_unpartitioned' % table
+        foreign_keys = get_foreign_keys(table)
+        sequence = bind.execute(sa.text("SELECT pg_get_serial_sequence(:table, :key)"), table=table, key=key).scalar()
+
+        op.execute('CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS)' % (unpartitioned, table))
+        op.execute('INSERT INTO %s SELECT * FROM %s' % (unpartitioned, table))
+        op.execute('ALTER SEQUENCE %s OWNED BY %s.%s' % (sequence, unpartitioned, key))
+        op.execute('DROP TABLE %s' % (table,))
+        op.execute('ALTER TABLE %s RENAME TO %s' % (unpartitioned, table))
+
+        op.execute('ALTER TABLE %s ADD PRIMARY KEY (%s)' % (table, key))
+        for name, definition in foreign_keys:
+            op.execute('ALTER TABLE %s ADD CONSTRAINT %s %s' % (table, name, definition))
+        create_indexes(table)
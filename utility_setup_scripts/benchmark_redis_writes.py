@@ -0,0 +1,83 @@
+"""Benchmarks the Redis writes for one table organized packet, such as a 'prosensing_paf' packet, comparing
+'RedisInterface.add_value_set_for_table_attributes' against sending a push and a trim for each attribute one at a time,
+the way it was written before it was pipelined.  Reports the number of round trips to the Redis server and the latency
+for each packet.
+
+Needs a running Redis server.  Writes under 'instruments:<instrument_id>:benchmark_table', which is deleted afterwards,
+so use an instrument id that is not in use:
+
+    python benchmark_redis_writes.py [--host localhost] [--port 6379] [--packets 200] [--attributes 300]
+"""
+import time
+import datetime
+import argparse
+
+import redis
+
+from WarnoConfig import redis_interface
+
+TABLE_NAME = "benchmark_table"
+
+
+class CountingConnection(redis.Connection):
+    """Redis connection that counts every time it sends commands to the server, which for a pipeline is once for the
+    whole pipeline."""
+    round_trips = 0
+
+    def send_packed_command(self, command, *args, **kwargs):
+        CountingConnection.round_trips += 1
+        return redis.Connection.send_packed_command(self, command, *args, **kwargs)
+
+
+def unpipelined_add_value_set(client, instrument_id, attributes, given_time, values):
+    """The unpipelined writes 'add_value_set_for_table_attributes' used to make, kept here as the baseline."""
+    time_key = redis_interface.RedisInterface._build_table_time_key(instrument_id, TABLE_NAME)
+    client.lpush(time_key, given_time.isoformat())
+    client.ltrim(time_key, 0, redis_interface.RedisInterface.MAX_INDEX)
+    for attribute, value in zip(attributes, values):
+        value_key = redis_interface.RedisInterface._build_base_attribute_key(instrument_id, attribute,
+                                                                               table_name=TABLE_NAME) + ":value"
+        client.lpush(value_key, value)
+        client.ltrim(value_key, 0, redis_interface.RedisInterface.MAX_INDEX)
+
+
+def run(name, write_packet, packets):
+    """Writes 'packets' packets with 'write_packet', then prints the round trips and latency per packet."""
+    CountingConnection.round_trips = 0
+    latencies = []
+    start_time = datetime.datetime(2017, 1, 1)
+    for packet in xrange(packets):
+        packet_start = time.time()
+        write_packet(start_time + datetime.timedelta(minutes=packet))
+        latencies.append(time.time() - packet_start)
+
+    latencies.sort()
+    print "%-12s round trips/packet: %8.1f   mean latency: %7.2f ms   95th percentile: %7.2f ms" % (
+        name, CountingConnection.round_trips / float(packets), 1000 * sum(latencies) / len(latencies),
+        1000 * latencies[int(len(latencies) * 0.95)])
+
+
+parser = argparse.ArgumentParser(description="Benchmark the Redis writes for one table organized packet.")
+parser.add_argument("--host", default="localhost", help="Redis server hostname.")
+parser.add_argument("--port", type=int, default=6379, help="Redis server port.")
+parser.add_argument("--instrument-id", type=int, default=999999, help="Instrument id the benchmark writes under.")
+parser.add_argument("--packets", type=int, default=200, help="Number of packets written by each run.")
+parser.add_argument("--attributes", type=int, default=300, help="Number of attributes in each packet.")
+args = parser.parse_args()
+
+client = redis.Redis(connection_pool=redis.ConnectionPool(host=args.host, port=args.port,
+                                                          connection_class=CountingConnection))
+redint = redis_interface.RedisInterface(args.host, args.port)
+redint._r = client
+
+attribute_names = ["attribute_%s" % index for index in xrange(args.attributes)]
+packet_values = [float(index) for index in xrange(args.attributes)]
+
+try:
+    run("unpipelined", lambda given_time: unpipelined_add_value_set(client, args.instrument_id, attribute_names,
+                                                                    given_time, packet_values), args.packets)
+    run("pipelined", lambda given_time: redint.add_value_set_for_table_attributes(
+        args.instrument_id, attribute_names, given_time, packet_values, TABLE_NAME), args.packets)
+finally:
+    for key in client.scan_iter(match="instruments:%s:%s:*" % (args.instrument_id, TABLE_NAME)):
+        client.delete(key)
@@ -0,0 +1,23 @@
+"""Converts the attribute values in Redis from the 'list' storage mode to the 'sorted_set' storage mode, so 'storage'
+can be switched to "sorted_set" in the 'redis' section of config.yml without waiting for the values to be rebuilt.
+
+Run from a shell with the WARNO environment set up (DATA_STORE_PATH on the PYTHONPATH), before restarting the Event
+Manager and User Portal with the new setting:
+
+    python convert_redis_storage.py [--delete-lists]
+
+'--delete-lists' removes the lists once they are converted, and should only be used once nothing reads them anymore.
+"""
+import argparse
+
+from WarnoConfig import redis_interface
+
+parser = argparse.ArgumentParser(description="Convert Redis attribute lists to sorted sets.")
+parser.add_argument("--host", default="localhost", help="Redis server hostname.")
+parser.add_argument("--port", type=int, default=6379, help="Redis server port.")
+parser.add_argument("--delete-lists", action="store_true", help="Delete the lists after they are converted.")
+args = parser.parse_args()
+
+redint = redis_interface.RedisInterface(args.host, args.port, storage="sorted_set")
+converted_keys = redint.convert_lists_to_sorted_sets(delete_lists=args.delete_lists)
+print "Converted %s sorted sets." % len(converted_keys)
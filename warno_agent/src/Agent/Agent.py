@@ -7,15 +7,19 @@ import sys
 import threading
 import wsgiref.simple_server
 from multiprocessing import Queue
+from Queue import Empty
 from time import sleep
 import psutil
 import os
 
 import requests
 from WarnoConfig import config, utility
+from WarnoConfig.spool import Spool
 from flask import Flask, render_template, redirect, url_for, request
 
 from PluginManager import PluginManager
+from EventSender import EventSender
+from plugins.Plugin import EventEnvelope
 
 global agent
 global remote_server
@@ -26,10 +30,11 @@ DEFAULT_PLUGIN_PATH = 'Agent/plugins/'
 MAX_CONN_ATTEMPTS = 99999
 CONN_RETRY_TIME = 15
 AGENT_DASHBOARD_PORT = 6309
+# Seconds the main loop sleeps when no plugin has produced an event.
+IDLE_INTERVAL = 0.1
 
-ctx = config.get_config_context()
-if ctx['agent']['local_debug']:
-    AGENT_DASHBOARD_PORT = int(ctx['agent']['dev_port'])
+if config.get_bool("agent.local_debug"):
+    AGENT_DASHBOARD_PORT = config.get_int("agent.dev_port")
 
 app = Flask(__name__)
 
@@ -63,9 +68,14 @@ def serve_dashboard():
         instrument_list.append({'instrument': manager.instrument['name'],
                             'plugin_list': manager.get_plugin_list()})
 
+    sender_stats = None
+    if agent.event_sender is not None:
+        sender_stats = agent.event_sender.get_stats()
+
     return render_template('index.html',
                            instrument_list=instrument_list,
-                           sys_stats=sys_stats)
+                           sys_stats=sys_stats,
+                           sender_stats=sender_stats)
 
 
 @app.route('/agent/<instrument>/<plugin_name>/stop')
@@ -121,22 +131,24 @@ class Agent(object):
     def __init__(self):
 
         self.plugin_path = DEFAULT_PLUGIN_PATH
-        self.config_ctxt = config.get_config_context()
-        self.event_manager_url = self.config_ctxt['setup']['em_url']
-        self.is_central = self.config_ctxt['type']['central_facility']
+        self.event_manager_url = config.get_string("setup.em_url")
+        self.is_central = config.get_bool("type.central_facility")
+        self.run_vm_agent = config.get_bool("setup.run_vm_agent")
         self.site_id = None
         self.msg_queue = Queue()
         self.event_code_dict = {}
         self.instrument_ids = []
         self.continue_processing_events = True
-        self.cert_verify = self.config_ctxt['setup']['cert_verify']
-        self.info = {'site': self.config_ctxt['setup']['site']}
+        # Either False or the path to a certificate, so it is read as is
+        self.cert_verify = config.get_value("setup.cert_verify")
+        self.info = {'site': config.get_string("setup.site")}
+        self.event_sender = None
         self.plugin_managers = [PluginManager({
-                                    'site': self.config_ctxt['setup']['site'],
+                                    'site': self.info['site'],
                                     'config_id': instrument_name
                                     }, instrument)
                                 for instrument_name, instrument
-                                in self.config_ctxt['agent']['instrument_list'].iteritems()]
+                                in config.get_value("agent.instrument_list").iteritems()]
 
         #Set up logging
         log_path = os.environ.get("LOG_PATH")
@@ -238,7 +250,7 @@ class Agent(object):
 
         """
         response = self.send_em_message(
-            utility.SITE_ID_REQUEST, self.config_ctxt['setup']['site'])
+            utility.SITE_ID_REQUEST, self.info['site'])
 
         if response.status_code == requests.codes.ok:
             response_dict = dict(json.loads(response.content))
@@ -299,29 +311,72 @@ class Agent(object):
         response = requests.post(self.event_manager_url, json=payload, headers=headers, verify=self.cert_verify)
         return response
 
+    def create_event_sender(self):
+        """ Create the event sender that plugin events are sent to the event manager through, along with the spool it
+        keeps undelivered events in, as configured in the 'agent' section of *config.yml*.
+
+        Returns
+        -------
+        event_sender: EventSender
+            The agent's event sender, not yet started.
+
+        """
+        spool = Spool(config.get_string("agent.spool_path"), max_bytes=config.get_int("agent.spool_max_bytes"),
+                      drop_policy=config.get_string("agent.spool_drop_policy"))
+        self.event_sender = EventSender(config.get_string("setup.em_batch_url"), spool,
+                                        batch_size=config.get_int("agent.send_batch_size"),
+                                        max_batch_age=config.get_float("agent.send_batch_age"),
+                                        max_in_flight=config.get_int("agent.send_connections"),
+                                        buffer_size=config.get_int("agent.send_buffer_size"),
+                                        max_retry_interval=config.get_int("agent.max_retry_interval"),
+                                        cert_verify=self.cert_verify)
+        return self.event_sender
+
     def process_plugin_event(self, manager):
-        """ Process message from a plugin.
+        """ Process message from a plugin, queueing it on the event sender to be sent to the event manager in a batch.
+        The message is an EventEnvelope, or a JSON string from plugins that do not use envelopes.  The event is only
+        encoded as JSON once, by the event sender.
 
         Parameters
         ----------
+        manager: PluginManager
+            Plugin manager whose message queue the message is taken from.  Raises Queue.Empty if it has no message.
 
         Returns
         -------
-        response: requests.response
-            Response from Event Manager
+        packet: dict
+            Event packet queued for the Event Manager.
 
         """
 
-        rec_msg = manager.msg_queue.get_nowait()
-        event = json.loads(rec_msg)
-        event['data']['site_id'] = self.site_id
-        event_code = manager.event_code_dict[event['event']]
-        event_msg = '{"event_code": %s, "data": %s}' % (
-            event_code, json.dumps(event['data']))
-        payload = json.loads(event_msg)
-        response = requests.post(
-            self.event_manager_url, json=payload, headers=headers, verify=self.cert_verify)
-        return response
+        envelope = manager.msg_queue.get_nowait()
+        # Plugins that do not use envelopes put JSON strings on the queue instead.
+        if isinstance(envelope, basestring):
+            envelope = EventEnvelope.from_json(envelope)
+        envelope.data['site_id'] = self.site_id
+        packet = {'event_code': manager.event_code_dict[envelope.event], 'data': envelope.data}
+        self.event_sender.add(packet)
+        return packet
+
+    def process_plugin_events(self):
+        """ Process the waiting messages of every plugin manager.  At most a batch worth of messages are taken from each
+        manager, so that a plugin producing events quickly can not hold up the events of the others.
+
+        Returns
+        -------
+        events_processed: int
+            Number of messages processed.
+
+        """
+        events_processed = 0
+        for manager in self.plugin_managers:
+            for _ in xrange(self.event_sender.batch_size):
+                try:
+                    self.process_plugin_event(manager)
+                except Empty:
+                    break
+                events_processed += 1
+        return events_processed
 
     def main(self):
         """ Start radar agent.
@@ -330,7 +385,7 @@ class Agent(object):
         -------
         """
 
-        if not self.config_ctxt['setup']['run_vm_agent']:
+        if not self.run_vm_agent:
             logging.info("run_vm_agent set to false, so shutting down Agent")
             sys.exit(0)
 
@@ -381,17 +436,14 @@ class Agent(object):
                 logging.debug(plugin)
                 self.register_plugin(plugin, manager)
 
+        self.create_event_sender().start()
         for manager in self.plugin_managers:
             manager.start_all_plugins()
 
         while self.continue_processing_events:
-            event_processed=0
-            for manager in self.plugin_managers:
-                if not manager.msg_queue.empty():
-                    response = self.process_plugin_event(manager)
-                    event_processed += 1
-            if event_processed == 0:
-                sleep(0.1)
+            if self.process_plugin_events() == 0:
+                sleep(IDLE_INTERVAL)
+        self.event_sender.stop()
 
 if __name__ == "__main__":
     agent = Agent()
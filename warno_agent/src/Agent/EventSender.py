@@ -0,0 +1,332 @@
+import json
+import time
+import Queue
+import logging
+import threading
+
+import requests
+
+
+class EventSender(object):
+    """Sends the events produced by the agent's plugins to the Event Manager in batches, in the background, so that a
+    plugin producing events quickly neither waits on the network itself nor holds up the events of other plugins.
+
+    Events are put into an in-memory queue by 'add'.  A batching thread collects them into batches, closing a batch once
+    it holds 'batch_size' events or its oldest event has waited 'max_batch_age' seconds.  Closed batches are posted to
+    the Event Manager's batch url by 'max_in_flight' sender threads, each keeping its own persistent keep-alive session,
+    so that several requests can be in flight at once.  The Event Manager keeps each instrument's most recent values in
+    Redis assuming they arrive in time order, so every instrument's events are always sent by the same sender thread:
+    each batch is split by instrument, and each part is queued for the sender thread owning that instrument, which
+    posts its batches one at a time.  Only batches for different instruments are ever in flight at once.  If a sender
+    thread is busy, at most one more batch waits for it, and once that is full the batching thread waits before closing
+    more.
+
+    Events that can not be delivered are kept in an on-disk spool rather than lost.  A batch whose request fails is
+    appended to the spool, and while anything is spooled, every later batch, whether just closed or already waiting for
+    a sender thread, is appended behind it instead of being sent, so that events are still delivered in order.  A
+    replay thread sends the oldest spooled events, one batch at a time, only removing them from the spool once the
+    Event Manager has accepted them.  After a failure it waits before trying again, doubling the wait after each
+    consecutive failure up to 'max_retry_interval'.  Only connection errors and server errors are retried: a batch the
+    Event Manager rejects as a bad request, or answers with a response that can not be read, would only be rejected
+    again, so it is logged, counted as rejected and dropped.  Memory use is bounded as well: once 'buffer_size' events
+    are waiting to be batched, the waiting events are moved into the spool and new events are written to the spool
+    after them.
+
+    Parameters
+    ----------
+    url: string
+        Url of the Event Manager's batch event route, '/eventmanager/events'.
+
+    spool: WarnoConfig.spool.Spool
+        Spool that undelivered events are kept in until they are delivered.
+
+    batch_size: integer, optional
+        Maximum number of events sent in one request. Default is 100.
+
+    max_batch_age: float, optional
+        Maximum number of seconds an event waits for its batch to fill before the batch is sent. Default is 1.
+
+    max_in_flight: integer, optional
+        Number of sender threads, and so the maximum number of requests in flight at once. Default is 4.
+
+    buffer_size: integer, optional
+        Maximum number of events held in memory before new events are written straight to the spool. Default is 10000.
+
+    max_retry_interval: integer, optional
+        Maximum number of seconds to wait between attempts while the Event Manager is unreachable. Default is 300.
+
+    cert_verify: boolean or string, optional
+        Passed to 'requests' as 'verify' for https connections. Default is False.
+
+    """
+
+    # Seconds before a request to the Event Manager is abandoned.
+    REQUEST_TIMEOUT = 30
+    # Seconds the replay thread waits before checking the spool again when it has nothing to send.
+    POLL_INTERVAL = 1
+
+    def __init__(self, url, spool, batch_size=100, max_batch_age=1, max_in_flight=4, buffer_size=10000,
+                 max_retry_interval=300, cert_verify=False):
+        self.url = url
+        self.spool = spool
+        self.batch_size = batch_size
+        self.max_batch_age = max_batch_age
+        self.max_in_flight = max_in_flight
+        self.max_retry_interval = max_retry_interval
+        self.cert_verify = cert_verify
+        self.logger = logging.getLogger(__name__)
+
+        self._events = Queue.Queue(maxsize=buffer_size)
+        # One queue of batches for each sender thread, holding the batch waiting for it.
+        self._batches = [Queue.Queue(maxsize=1) for _ in xrange(max_in_flight)]
+        self._lock = threading.Lock()
+        # Held while deciding whether a batch is spooled or sent, and while spooling, so that no batch is sent ahead of
+        # one being spooled.
+        self._spool_lock = threading.Lock()
+        self._stats = dict(sent=0, failed=0, rejected=0, batches=0)
+        self._retry_interval = 0
+        self._next_attempt = 0
+        self._running = False
+        self._threads = []
+
+    def start(self):
+        """Start the batching thread, the sender threads and the replay thread."""
+        self._running = True
+        self._threads = [threading.Thread(target=self._run_batcher, name="EventSenderBatcher"),
+                         threading.Thread(target=self._run_replay, name="EventSenderReplay")]
+        self._threads.extend(threading.Thread(target=self._run_sender, args=(self._batches[index],),
+                                              name="EventSender-%s" % index)
+                             for index in xrange(self.max_in_flight))
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        """Stop the threads, after every event already added has been sent or spooled."""
+        self._running = False
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def add(self, packet):
+        """Queue an event to be sent to the Event Manager.  Never blocks on the network.
+
+        Parameters
+        ----------
+        packet: dict
+            The event packet, of the form {"event_code": *code*, "data": *event data*}.
+
+        """
+        try:
+            self._events.put_nowait(packet)
+        except Queue.Full:
+            with self._spool_lock:
+                records = []
+                while True:
+                    try:
+                        records.append(json.dumps(self._events.get_nowait()))
+                    except Queue.Empty:
+                        break
+                records.append(json.dumps(packet))
+                self.spool.append(records)
+
+    def pending(self):
+        """Returns the number of events waiting to be delivered, either held in memory or spooled on disk."""
+        return self._events.qsize() + self.spool.depth()
+
+    def get_stats(self):
+        """Get the number of events sent, failed, spooled and dropped, and the number of batches posted.
+
+        Returns
+        -------
+        stats: dictionary
+            Of the form {'sent': (events accepted by the Event Manager), 'failed': (events the Event Manager could not
+            save), 'rejected': (events dropped because the Event Manager rejected their whole batch), 'batches':
+            (requests posted), 'spooled': (events waiting in the spool), 'spool_bytes': (size of the spool on disk),
+            'dropped': (events dropped to keep the spool within its quota)}.
+
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update(spooled=self.spool.depth(), spool_bytes=self.spool.size_bytes(), dropped=self.spool.dropped())
+        return stats
+
+    def _run_batcher(self):
+        while self._running or not self._events.empty():
+            # The batch is only collected slowly while few events arrive, when 'add' does not need the lock.
+            with self._spool_lock:
+                batch = self.collect_batch()
+                if not batch:
+                    continue
+                # Anything still spooled has to be delivered first, so new events wait behind it.
+                if self.spool.depth() > 0:
+                    self.spool.append([json.dumps(packet) for packet in batch])
+                    continue
+            for index, packets in sorted(self.split_batch(batch).iteritems()):
+                self._batches[index].put([json.dumps(packet) for packet in packets])
+        # Tell every sender thread there is nothing more to send.
+        for batches in self._batches:
+            batches.put(None)
+
+    def split_batch(self, batch):
+        """Split a batch into the events for each sender thread, so that each instrument's events are always sent by
+        the same sender thread, in order.
+
+        Parameters
+        ----------
+        batch: list of dicts
+            Event packets, in the order they were added.
+
+        Returns
+        -------
+        parts: dictionary
+            Of the form {(index of sender thread): (list of its event packets, in order)}.
+
+        """
+        parts = {}
+        for packet in batch:
+            data = packet.get("data")
+            instrument_id = data.get("instrument_id") if isinstance(data, dict) else None
+            parts.setdefault(hash(instrument_id) % self.max_in_flight, []).append(packet)
+        return parts
+
+    def collect_batch(self):
+        """Wait for events and collect them into one batch, returning once the batch holds 'batch_size' events or its
+        first event has waited 'max_batch_age' seconds.
+
+        Returns
+        -------
+        batch: list of dicts
+            The event packets collected, in the order they were added.  Empty if no event arrived within
+            'max_batch_age' seconds.
+
+        """
+        try:
+            batch = [self._events.get(timeout=self.max_batch_age)]
+        except Queue.Empty:
+            return []
+
+        deadline = time.time() + self.max_batch_age
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            try:
+                if remaining > 0:
+                    batch.append(self._events.get(timeout=remaining))
+                else:
+                    batch.append(self._events.get_nowait())
+            except Queue.Empty:
+                break
+        return batch
+
+    def _run_sender(self, batches):
+        session = requests.Session()
+        session.headers.update({'Content-Type': 'application/json'})
+        try:
+            while True:
+                records = batches.get()
+                if records is None:
+                    break
+                # A batch that failed may have been spooled while this one waited, so it has to go behind it.
+                with self._spool_lock:
+                    spooled = self.spool.depth() > 0
+                    if spooled:
+                        self.spool.append(records)
+                if spooled or self.send_batch(session, records) is not None:
+                    continue
+                with self._spool_lock:
+                    self.spool.append(records)
+        finally:
+            session.close()
+
+    def _run_replay(self):
+        session = requests.Session()
+        session.headers.update({'Content-Type': 'application/json'})
+        try:
+            while self._running:
+                # While a backlog is being replayed, keep sending full batches without waiting.
+                if time.time() < self._next_attempt or self.send_spooled_batch(session) < self.batch_size:
+                    time.sleep(self.POLL_INTERVAL)
+        finally:
+            session.close()
+
+    def send_spooled_batch(self, session):
+        """Send the oldest spooled events to the Event Manager as one batch, removing them from the spool once the
+        Event Manager has answered for them, whether it saved them or rejected them.
+
+        Parameters
+        ----------
+        session: requests.Session
+            Session to post the batch through.
+
+        Returns
+        -------
+        sent: integer
+            Number of events delivered.
+
+        """
+        records, position = self.spool.read(self.batch_size)
+        if not records:
+            return 0
+
+        if self.send_batch(session, records) is None:
+            return 0
+        self.spool.commit(position)
+        return len(records)
+
+    def send_batch(self, session, records):
+        """Post a batch of events to the Event Manager, logging any events it could not save.  If the batch could not
+        be delivered, the next replay of the spool is put off with backoff.
+
+        Parameters
+        ----------
+        session: requests.Session
+            Session to post the batch through.
+
+        records: list of JSON strings
+            Event packets to send.
+
+        Returns
+        -------
+        sent: integer or None
+            Number of events the Event Manager saved, or None if the batch should be sent again later because the
+            Event Manager could not be reached or had a server error.
+
+        """
+        try:
+            response = session.post(self.url, data="[%s]" % ", ".join(records), verify=self.cert_verify,
+                                    timeout=self.REQUEST_TIMEOUT)
+            if response.status_code >= 500:
+                response.raise_for_status()
+        except requests.RequestException, e:
+            with self._lock:
+                self._retry_interval = min(max(self._retry_interval * 2, 1), self.max_retry_interval)
+                self._next_attempt = time.time() + self._retry_interval
+            self.logger.warning("Could not send %s events to the Event Manager, retrying in %s seconds: %s",
+                                len(records), self._retry_interval, e)
+            return None
+
+        with self._lock:
+            self._retry_interval = 0
+            self._next_attempt = 0
+
+        try:
+            response.raise_for_status()
+            results = response.json()
+        except (requests.RequestException, ValueError), e:
+            self.logger.error("Event Manager rejected a batch of %s events, dropping them: %s", len(records), e)
+            self._update_stats(rejected=len(records), batches=1)
+            return 0
+
+        # Events the Event Manager rejected would be rejected again, so they are not retried.
+        failed = [result for result in results if result.get('status') != "OK"]
+        for result in failed:
+            self.logger.error("Event Manager could not save event with code %s: %s", result.get('event_code'),
+                              result.get('response'))
+        self._update_stats(sent=len(records) - len(failed), failed=len(failed), batches=1)
+        return len(records) - len(failed)
+
+    def _update_stats(self, **counts):
+        """Adds to the counts of events sent, failed and rejected, and batches posted."""
+        with self._lock:
+            for key, count in counts.iteritems():
+                self._stats[key] += count
@@ -1,10 +1,10 @@
 import datetime
 import traceback
 import time
-import json
 import os
 
 from Plugin import Plugin as Plugin
+from Plugin import EventEnvelope
 
 from WarnoConfig import config
 from WarnoConfig.bite_digest.digest import Digest
@@ -31,14 +31,14 @@ class IrisBitePlugin(Plugin):
         self.add_event_code("iris_bite")
         self.add_event_code("non_iris_event")
         self.white_list = white_list
-        self.config_ctxt = config.get_config_context()
+        self.instrument_list = config.get_value("agent.instrument_list")
         self.config_id = None
 
     def run(self, msg_queue, config, ctrl_queue):
 
         self.ctrl_queue = ctrl_queue
-        base_url = self.config_ctxt['agent']['instrument_list'][self.config_id]['base_url']
-        base_port = self.config_ctxt['agent']['instrument_list'][self.config_id]['base_port']
+        base_url = self.instrument_list[self.config_id]['base_url']
+        base_port = self.instrument_list[self.config_id]['base_port']
 
         # Counter for the 'non_iris_event'
         i = 1
@@ -51,9 +51,8 @@ class IrisBitePlugin(Plugin):
                 # Have to clean some of the BITE labels to allow them to be colummn names for postgresql
                 clean_events = { key.replace('+', 'pos').replace('-', 'minus').replace('.', '_').replace('/', '_').replace(' ', '_'): value
                                  for key, value in events.iteritems()}
-                events_payload = json.dumps(clean_events)
-                msg_queue.put('{"event": "%s", "data": {"instrument_id": %s, "time": "%s", "values": %s}}'
-                              % ("iris_bite", config['instrument_id'], timestamp, events_payload))
+                msg_queue.put(EventEnvelope("iris_bite", {'instrument_id': config['instrument_id'],
+                                                          'time': str(timestamp), 'values': clean_events}))
             except Exception, e:
                 with open(LOGFILE, "a+") as log:
                     log.write("--%s\n%s\n" % (str(self.get_timestamp()), e))
@@ -62,13 +61,13 @@ class IrisBitePlugin(Plugin):
                 del iris_digest
 
             timestamp = self.get_timestamp()
-            msg_queue.put('{"event": "non_iris_event", "data": {"instrument_id": %s, "time": "%s", "value": "%s"}}'\
-                          % (config['instrument_id'], timestamp, i))
+            msg_queue.put(EventEnvelope("non_iris_event", {'instrument_id': config['instrument_id'],
+                                                           'time': str(timestamp), 'value': str(i)}))
 
             i += 1
             self.process_ctrl_queue()
 
-            time.sleep(self.config_ctxt['agent']['instrument_list'][self.config_id]['sampling_interval'])
+            time.sleep(self.instrument_list[self.config_id]['sampling_interval'])
 
     def get_timestamp(self):
         return datetime.datetime.utcnow()
@@ -1,4 +1,5 @@
 import thread
+import json
 
 
 class Plugin(object):
@@ -57,5 +58,44 @@ class Plugin(object):
                 self.run_flag = False
 
 
+class EventEnvelope(object):
+    """An event produced by a plugin, put on the plugin's message queue as is.  The queue pickles it in binary on its
+    way to the agent, and it is only encoded as JSON once, when the agent sends it to the event manager.
 
+    Parameters
+    ----------
+    event: str
+        Name of the event code, as registered by the plugin.
+    data: dict
+        The event's data, such as 'instrument_id', 'time', and 'value' or 'values'.  Every value must be JSON
+        serializable, so times should be given as strings.
+
+    """
+    __slots__ = ("event", "data")
+
+    def __init__(self, event, data):
+        self.event = event
+        self.data = data
+
+    def __reduce__(self):
+        return EventEnvelope, (self.event, self.data)
+
+    @classmethod
+    def from_json(cls, message):
+        """ Create an envelope from a JSON message of the form {"event": *event code name*, "data": *event data*}, as
+        put on the queue by plugins that do not use envelopes.
+
+        Parameters
+        ----------
+        message: str
+            The JSON message.
+
+        Returns
+        -------
+        envelope: EventEnvelope
+            Envelope holding the message's event and data.
+
+        """
+        event = json.loads(message)
+        return cls(event['event'], event['data'])
 
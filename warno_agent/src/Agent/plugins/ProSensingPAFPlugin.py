@@ -1,11 +1,11 @@
 import datetime
 import traceback
 import time
-import json
 import os
 
 from pyarmret.io.PAFClient import PAFClient
 from Plugin import Plugin as Plugin
+from Plugin import EventEnvelope
 
 from WarnoConfig import config
 
@@ -33,15 +33,15 @@ class ProSensingPAFPlugin(Plugin):
         self.add_event_code("prosensing_paf")
         self.add_event_code("non_paf_event")
         self.white_list = white_list
-        self.config_ctxt = config.get_config_context()
+        self.instrument_list = config.get_value("agent.instrument_list")
         self.config_id = None
 
     def run(self, msg_queue, config, ctrl_queue):
 
         self.ctrl_queue = ctrl_queue
-        base_url = self.config_ctxt['agent']['instrument_list'][self.config_id]['base_url']
-        base_port = self.config_ctxt['agent']['instrument_list'][self.config_id]['base_port']
-        fmt = self.config_ctxt['agent']['instrument_list'][self.config_id]['ps_type']
+        base_url = self.instrument_list[self.config_id]['base_url']
+        base_port = self.instrument_list[self.config_id]['base_port']
+        fmt = self.instrument_list[self.config_id]['ps_type']
 
         # Counter for the 'non_paf_event'
         i = 1
@@ -51,9 +51,8 @@ class ProSensingPAFPlugin(Plugin):
                 pafc = PAFClient(base_url, base_port, fmt=fmt)
                 pafc.connect()
                 events = pafc.get_all_text_dict()
-                events_payload = json.dumps(events)
-                msg_queue.put('{"event": "%s", "data": {"instrument_id": %s, "time": "%s", "values": %s}}'
-                              % ("prosensing_paf", config['instrument_id'], timestamp, events_payload))
+                msg_queue.put(EventEnvelope("prosensing_paf", {'instrument_id': config['instrument_id'],
+                                                               'time': str(timestamp), 'values': events}))
             except Exception, e:
                 with open(LOGFILE, "a+") as log:
                     log.write("--%s\n%s\n" % (str(self.get_timestamp()), e))
@@ -62,13 +61,13 @@ class ProSensingPAFPlugin(Plugin):
                 pafc.close()
 
             timestamp = self.get_timestamp()
-            msg_queue.put('{"event": "non_paf_event", "data": {"instrument_id": %s, "time": "%s", "value": "%s"}}'\
-                          % (config['instrument_id'], timestamp, i))
+            msg_queue.put(EventEnvelope("non_paf_event", {'instrument_id': config['instrument_id'],
+                                                          'time': str(timestamp), 'value': str(i)}))
 
             i += 1
             self.process_ctrl_queue()
 
-            time.sleep(self.config_ctxt['agent']['instrument_list'][self.config_id]['sampling_interval'])
+            time.sleep(self.instrument_list[self.config_id]['sampling_interval'])
 
     def get_timestamp(self):
         return datetime.datetime.utcnow()
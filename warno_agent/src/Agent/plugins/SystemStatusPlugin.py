@@ -1,6 +1,5 @@
 import time
 import traceback
-import json
 import os
 import datetime
 import psutil
@@ -8,6 +7,7 @@ from time import sleep
 import logging
 
 from Plugin import Plugin as Plugin
+from Plugin import EventEnvelope
 from WarnoConfig import config
 
 log_path = os.environ.get("LOG_PATH")
@@ -29,17 +29,17 @@ class SystemStatusPlugin(Plugin):
         self.plugin_description = 'test'
         self.add_event_code("cpu_usage")
         self.white_list = white_list
-        self.config_ctxt = config.get_config_context()
+        self.instrument_list = config.get_value("agent.instrument_list")
         self.config_id = None
 
     def run(self, msg_queue, config, ctrl_queue):
         self.ctrl_queue = ctrl_queue
         while self.run_flag:
             timestamp = datetime.datetime.utcnow()
-            msg_queue.put('{"event": "%s", "data": {"instrument_id": %s, "time": "%s", "value": %s}}' %
-            ("cpu_usage", config['instrument_id'], timestamp, psutil.cpu_percent()))
+            msg_queue.put(EventEnvelope("cpu_usage", {'instrument_id': config['instrument_id'],
+                                                      'time': str(timestamp), 'value': psutil.cpu_percent()}))
             self.process_ctrl_queue()
-            sleep(self.config_ctxt['agent']['instrument_list'][self.config_id]['sampling_interval'])
+            sleep(self.instrument_list[self.config_id]['sampling_interval'])
 
 
 def get_plugin():
@@ -3,6 +3,7 @@ from Agent import Agent
 import os
 import sys
 import mock
+import pickle
 import requests
 import importlib
 from multiprocessing import Process
@@ -141,9 +142,39 @@ class TestAgent(TestCase):
     def test_main_loop_exits_when_configured_off(self,  mock_list_plugins, mock_requests):
 
         self.agent.continue_processing_events=False
-        self.agent.config_ctxt['setup']['run_vm_agent'] = False
+        self.agent.run_vm_agent = False
         with self.assertRaises(SystemExit) as e:
             self.agent.main()
         self.assertEqual(e.exception.code, 0, "Main loop did not exit with the correct code")
 
         self.assertFalse(mock_list_plugins.called,'Plugins were listed')
+
+    def test_process_plugin_events_takes_at_most_a_batch_from_each_manager(self):
+        """Tests that each pass queues at most a batch of events from each plugin manager on the event sender, so that
+        a busy plugin does not hold up the others."""
+        busy_manager = mock.Mock()
+        quiet_manager = mock.Mock()
+        busy_manager.event_code_dict = quiet_manager.event_code_dict = {"temperature": 3}
+        busy_manager.msg_queue.get_nowait.return_value = '{"event": "temperature", "data": {"value": 1}}'
+        quiet_manager.msg_queue.get_nowait.side_effect = [Agent.EventEnvelope("temperature", {"value": 2}),
+                                                          Agent.Empty()]
+        self.agent.plugin_managers = [busy_manager, quiet_manager]
+        self.agent.event_sender = mock.Mock()
+        self.agent.event_sender.batch_size = 5
+        self.agent.site_id = 1
+
+        self.assertEqual(self.agent.process_plugin_events(), 6, "Wrong number of events processed.")
+        self.agent.event_sender.add.assert_called_with({'event_code': 3, 'data': {'value': 2, 'site_id': 1}})
+        self.agent.site_id = None
+
+    def test_event_envelope_survives_pickling_and_reads_json_messages(self):
+        """Tests that an envelope keeps its event and data when pickled onto a queue, and that a JSON message from a
+        plugin that does not use envelopes is read into an envelope."""
+        envelope = pickle.loads(pickle.dumps(Agent.EventEnvelope("cpu_usage", {"instrument_id": 1, "value": 5.0}),
+                                             pickle.HIGHEST_PROTOCOL))
+        self.assertEqual((envelope.event, envelope.data), ("cpu_usage", {"instrument_id": 1, "value": 5.0}),
+                         "Envelope changed when pickled.")
+
+        envelope = Agent.EventEnvelope.from_json('{"event": "cpu_usage", "data": {"value": 5.0}}')
+        self.assertEqual((envelope.event, envelope.data), ("cpu_usage", {"value": 5.0}), "JSON message was not read.")
+
@@ -0,0 +1,132 @@
+import json
+import mock
+import Queue
+import shutil
+import tempfile
+import requests
+
+from unittest import TestCase
+
+from Agent.EventSender import EventSender
+from WarnoConfig.spool import Spool
+
+
+class TestEventSender(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.spool = Spool(self.directory)
+        self.sender = EventSender("http://localhost:8001/eventmanager/events", self.spool, batch_size=2,
+                                  max_batch_age=0.01, max_in_flight=2)
+        self.session = mock.Mock()
+        self.session.post.return_value.status_code = 200
+
+    def test_collect_batch_closes_batch_when_full(self):
+        """Tests that a batch holds at most 'batch_size' events, with the rest left for the next batch, and that no
+        batch is collected when there are no events."""
+        for event_code in [1, 2, 3]:
+            self.sender.add({"event_code": event_code, "data": {}})
+
+        self.assertEqual([packet["event_code"] for packet in self.sender.collect_batch()], [1, 2],
+                         "First batch was not the first 'batch_size' events.")
+        self.assertEqual([packet["event_code"] for packet in self.sender.collect_batch()], [3],
+                         "Partial batch was not sent once it was old enough.")
+        self.assertEqual(self.sender.collect_batch(), [], "Batch was collected without any events.")
+
+    def test_send_batch_posts_batch_and_counts_rejected_events(self):
+        """Tests that a batch is posted as one JSON list, and that events the Event Manager could not save are
+        counted as failed."""
+        batch = [{"event_code": 1, "data": {"value": 1}}, {"event_code": 2, "data": {"value": 2}}]
+        records = [json.dumps(packet) for packet in batch]
+        self.session.post.return_value.json.return_value = [dict(index=0, event_code=1, status="OK", response=""),
+                                                            dict(index=1, event_code=2, status="ERROR", response="")]
+
+        sent = self.sender.send_batch(self.session, records)
+
+        self.assertEqual(json.loads(self.session.post.call_args[1]["data"]), batch, "Batch was not posted as JSON.")
+        self.assertEqual(sent, 1, "Saved events were not counted.")
+        self.assertEqual(self.sender.get_stats(), dict(sent=1, failed=1, rejected=0, batches=1, spooled=0,
+                                                         spool_bytes=0, dropped=0),
+                         "Stats were not updated.")
+
+    def test_split_batch_gives_each_instrument_one_sender_thread(self):
+        """Tests that a batch is split so that every event for an instrument goes to the same sender thread, in the
+        order the events were added."""
+        batch = [{"event_code": 1, "data": {"instrument_id": 1}}, {"event_code": 2, "data": {"instrument_id": 2}},
+                 {"event_code": 3, "data": {"instrument_id": 1}}]
+
+        parts = self.sender.split_batch(batch)
+
+        self.assertEqual(parts, {1: [batch[0], batch[2]], 0: [batch[1]]},
+                         "Events were not split by instrument, in order.")
+
+    def test_send_spooled_batch_keeps_events_until_delivered(self):
+        """Tests that spooled events stay in the spool while the Event Manager is unreachable, that the next attempt is
+        put off, and that they are removed once delivered."""
+        self.spool.append(['{"event_code": 1, "data": {}}', '{"event_code": 2, "data": {}}'])
+        self.session.post.side_effect = requests.ConnectionError("Connection refused")
+
+        self.assertEqual(self.sender.send_spooled_batch(self.session), 0, "Undelivered events were counted as sent.")
+        self.assertEqual(self.spool.depth(), 2, "Undelivered events were removed from the spool.")
+        self.assertGreater(self.sender._next_attempt, 0, "Next attempt was not put off after a failure.")
+
+        self.session.post.side_effect = None
+        self.session.post.return_value.json.return_value = [dict(status="OK"), dict(status="OK")]
+        self.assertEqual(self.sender.send_spooled_batch(self.session), 2, "Spooled events were not sent.")
+        self.assertEqual(self.session.post.call_args[1]["data"], '[{"event_code": 1, "data": {}}, '
+                                                                 '{"event_code": 2, "data": {}}]',
+                         "Spooled events were not sent in order.")
+        self.assertEqual(self.spool.depth(), 0, "Delivered events were not removed from the spool.")
+
+    def test_send_spooled_batch_drops_batch_the_event_manager_rejects(self):
+        """Tests that a batch rejected as a bad request is dropped from the spool and counted, rather than being
+        retried ahead of every later batch."""
+        self.spool.append(['{"event_code": 1, "data": {}}'])
+        self.session.post.return_value.status_code = 400
+        self.session.post.return_value.raise_for_status.side_effect = requests.HTTPError("400 Bad Request")
+
+        self.sender.send_spooled_batch(self.session)
+
+        self.assertEqual(self.spool.depth(), 0, "Rejected batch was kept in the spool.")
+        self.assertEqual(self.sender.get_stats()["rejected"], 1, "Rejected event was not counted.")
+        self.assertEqual(self.sender._next_attempt, 0, "Rejected batch put off the next attempt.")
+
+    def test_add_spools_events_in_order_once_buffer_is_full(self):
+        """Tests that when the in-memory buffer is full, the waiting events are spooled ahead of the new event."""
+        sender = EventSender("http://localhost:8001/eventmanager/events", self.spool, buffer_size=1)
+        sender.add({"event_code": 1, "data": {}})
+        sender.add({"event_code": 2, "data": {}})
+
+        self.assertEqual([json.loads(record) for record in self.spool.read(10)[0]],
+                         [{"event_code": 1, "data": {}}, {"event_code": 2, "data": {}}],
+                         "Events were not spooled in order.")
+        self.assertEqual(sender.pending(), 2, "Pending count does not include every event.")
+
+    @mock.patch("Agent.EventSender.requests.Session")
+    def test_sender_spools_waiting_batches_behind_a_failed_batch(self, session_class):
+        """Tests that once a batch fails and is spooled, the next batch waiting for the sender thread is spooled behind
+        it rather than sent ahead of it."""
+        session_class.return_value.post.side_effect = requests.ConnectionError("Connection refused")
+        batches = Queue.Queue()
+        for records in [['{"event_code": 1, "data": {}}'], ['{"event_code": 2, "data": {}}'], None]:
+            batches.put(records)
+
+        self.sender._run_sender(batches)
+
+        self.assertEqual(session_class.return_value.post.call_count, 1, "Batch was sent ahead of the spooled batch.")
+        self.assertEqual(self.spool.read(10)[0], ['{"event_code": 1, "data": {}}', '{"event_code": 2, "data": {}}'],
+                         "Batches were not spooled in order.")
+
+    @mock.patch("Agent.EventSender.requests.Session")
+    def test_stop_sends_every_added_event(self, session_class):
+        """Tests that events added before the sender is stopped are all posted by the sender threads."""
+        session_class.return_value.post.return_value.json.return_value = []
+        self.sender.start()
+        for event_code in [1, 2, 3]:
+            self.sender.add({"event_code": event_code, "data": {}})
+        self.sender.stop()
+
+        posted = [packet["event_code"] for call in session_class.return_value.post.call_args_list
+                  for packet in json.loads(call[1]["data"])]
+        self.assertEqual(sorted(posted), [1, 2, 3], "Every added event was not posted.")
@@ -0,0 +1,229 @@
+import gzip
+import json
+import shutil
+import tempfile
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from WarnoConfig import rollups
+from WarnoConfig import schema_cache
+from WarnoConfig.models import db
+
+# Number of rows fetched from the database by each query.
+CHUNK_SIZE = 5000
+
+
+def get_archive_columns(session, table):
+    """Returns the (column_name, data_type) pairs of a table, in the order the columns are defined in the table.
+
+    Parameters
+    ----------
+    session: sqlalchemy session
+        Database session used to query 'information_schema'.
+
+    table: string
+        Name of the database table.
+
+    Returns
+    -------
+    columns: list of tuples
+        (column_name, data_type) pair for each column of the table.
+
+    """
+    return schema_cache.get_columns(session, table)
+
+
+def get_primary_key(table):
+    """Returns the name of a table's primary key column, used to order rows that share the same time.
+
+    Parameters
+    ----------
+    table: string
+        Name of the database table, which must be defined in WarnoConfig.models.
+
+    Returns
+    -------
+    column_name: string
+        Name of the table's primary key column.
+
+    """
+    return db.metadata.tables[table].primary_key.columns.values()[0].name
+
+
+def iterate_rows(session, table, column_names, instrument_id, cutoff_time, chunk_size=CHUNK_SIZE):
+    """Yields every row of a table for an instrument older than the cutoff time, oldest first.
+
+    Rows are fetched 'chunk_size' at a time using keyset pagination on (time, primary key): each query continues from
+    the last row of the previous chunk instead of using OFFSET, so later queries do not have to read and discard every
+    row already returned, and each query is short rather than one long running scan.
+
+    Parameters
+    ----------
+    session: sqlalchemy session
+        Database session the rows are read from.
+
+    table: string
+        Name of the database table.
+
+    column_names: list of strings
+        Names of the columns to select, in the order they are returned in each row.  Must include 'time'.
+
+    instrument_id: integer
+        Id of the instrument the rows are for.
+
+    cutoff_time: datetime
+        Only rows with a time before this are returned.
+
+    chunk_size: integer, optional
+        Number of rows fetched by each query.
+
+    Yields
+    ------
+    row: list
+        Each row's values, in the order of 'column_names'.
+
+    """
+    primary_key = get_primary_key(table)
+    select = "SELECT %s, %s AS archive_key FROM %s WHERE instrument_id = :id AND time < :time" \
+             % (", ".join(column_names), primary_key, table)
+    order = " ORDER BY time ASC, %s ASC LIMIT :chunk_size" % (primary_key,)
+    parameters = dict(id=instrument_id, time=cutoff_time.isoformat(), chunk_size=chunk_size)
+
+    rows = session.execute(select + order, parameters).fetchall()
+    while rows:
+        for row in rows:
+            yield list(row)[:-1]
+
+        if len(rows) < chunk_size:
+            break
+        parameters['last_time'] = rows[-1]['time']
+        parameters['last_key'] = rows[-1]['archive_key']
+        rows = session.execute(select + " AND (time, %s) > (:last_time, :last_key)" % (primary_key,) + order,
+                               parameters).fetchall()
+
+
+def write_table_archive(session, datafile, table, instrument_id, cutoff_time, chunk_size=CHUNK_SIZE):
+    """Writes one table section of an instrument's archive file, in the format described by 'save_json_db_data': a
+    line holding the table's definition, followed by one line for each row.
+
+    The table is read once.  Rows are written to a temporary file as they are read, while the start time, end time and
+    number of rows are recorded, and the temporary file is copied into 'datafile' after the definition once they are
+    known.
+
+    Parameters
+    ----------
+    session: sqlalchemy session
+        Database session the rows are read from.
+
+    datafile: file
+        Archive file the table section is written to.
+
+    table: string
+        Name of the database table.
+
+    instrument_id: integer
+        Id of the instrument the rows are for.
+
+    cutoff_time: datetime
+        Only rows with a time before this are archived.
+
+    chunk_size: integer, optional
+        Number of rows fetched by each query.
+
+    """
+    definition = dict()
+    definition['table_name'] = table
+
+    # List of (column_name, data_type) pairs to define the format of each data row
+    definition['columns'] = get_archive_columns(session, table)
+    column_names = [column[0] for column in definition['columns']]
+    time_index = column_names.index("time")
+
+    count = 0
+    start_time = None
+    end_time = None
+    with tempfile.TemporaryFile() as datafile_rows:
+        for row in iterate_rows(session, table, column_names, instrument_id, cutoff_time, chunk_size):
+            # Datetimes must be converted to iso compliant time format for json.dump
+            row[time_index] = row[time_index].isoformat() + "Z"
+
+            # Rows are in time order, so the first row has the start time and the last has the end time
+            if count == 0:
+                start_time = row[time_index]
+            end_time = row[time_index]
+            datafile_rows.write(json.dumps(row) + "\n")
+            count += 1
+
+        # Together 'start_time' and 'end_time' allow anyone reading the file to easily get the time range of the
+        # values, and 'num_entries' makes reading in the data easier
+        definition['start_time'] = start_time
+        definition['end_time'] = end_time
+        definition['num_entries'] = count
+
+        # Write the definition, followed by the data rows
+        datafile.write(json.dumps(dict(definition=definition)) + "\n")
+        datafile_rows.seek(0)
+        shutil.copyfileobj(datafile_rows, datafile)
+
+
+def archive_instrument(database_uri, instrument_id, tables, cutoff_time, filename, partition_cutoffs=None):
+    """Archives the data of one instrument older than the cutoff time to a gzip compressed file, then deletes the
+    archived data from the database.  Run by the worker processes of 'save_json_db_data', so it opens its own database
+    connection rather than sharing the Event Manager's.
+
+    The data is only deleted once the whole file has been written, and is deleted for every table in one transaction,
+    along with the attribute rollups of the deleted data.  Rows in partitions that are dropped once every instrument is
+    archived are left for the drop to remove, rather than deleted one at a time.
+
+    Parameters
+    ----------
+    database_uri: string
+        SQLAlchemy url of the database to archive.
+
+    instrument_id: integer
+        Id of the instrument to archive.
+
+    tables: list of strings
+        Names of the tables to archive, in the order they are written to the file.
+
+    cutoff_time: datetime
+        Only rows with a time before this are archived.
+
+    filename: string
+        Name of the file the archive is written to.
+
+    partition_cutoffs: dictionary, optional
+        Maps each partitioned table to the start of its oldest partition that is not dropped after archiving.  Only rows
+        from that time to the cutoff time are deleted from the table.  Tables not in the dictionary have every archived
+        row deleted.
+
+    Returns
+    -------
+    filename: string
+        Name of the file the archive was written to.
+
+    """
+    engine = create_engine(database_uri)
+    session = sessionmaker(bind=engine)()
+    try:
+        with gzip.open(filename, "wb") as datafile:
+            for table in tables:
+                write_table_archive(session, datafile, table, instrument_id, cutoff_time)
+
+        partition_cutoffs = partition_cutoffs or {}
+        for table in tables:
+            if table in partition_cutoffs:
+                session.execute("DELETE FROM %s WHERE time >= :start AND time < :time AND instrument_id = :id"
+                                % (table,), dict(start=partition_cutoffs[table].isoformat(),
+                                                 time=cutoff_time.isoformat(), id=instrument_id))
+            else:
+                session.execute("DELETE FROM %s WHERE time < :time AND instrument_id = :id" % (table,),
+                                dict(time=cutoff_time.isoformat(), id=instrument_id))
+        rollups.remove_rollups_before(session, instrument_id, cutoff_time)
+        session.commit()
+    finally:
+        session.close()
+        engine.dispose()
+
+    return filename
@@ -0,0 +1,178 @@
+import time
+import Queue
+import logging
+import threading
+
+import requests
+
+
+class CentralForwarder(object):
+    """Forwards events saved by a site Event Manager on to the central facility in the background, so that saving an
+    event locally never waits on the connection to the central facility.
+
+    Events are put into a bounded in-memory buffer by 'enqueue'.  A background thread moves buffered events into an
+    on-disk spool, then sends the oldest spooled events to the central facility's batch url, only removing them from the
+    spool once the central facility has accepted them.  If a send fails, the thread waits before trying again, doubling
+    the wait after each consecutive failure up to 'max_retry_interval'.  Only connection errors and server errors are
+    retried.  Events the central facility answers with an error, or a whole batch it rejects as a bad request, would
+    only be rejected again, so they are logged, counted by 'rejected', and removed from the spool.  If the buffer fills
+    up, for example while the thread is waiting to retry, the buffered events are moved into the spool and new events
+    are written straight to the spool after them, so events are still forwarded in the order they were saved.
+
+    Parameters
+    ----------
+    url: string
+        Url of the central facility's batch event route, '/eventmanager/events'.
+
+    spool: WarnoConfig.spool.Spool
+        Spool that events are kept in until they are delivered.
+
+    batch_size: integer, optional
+        Maximum number of events sent in one request. Default is 100.
+
+    buffer_size: integer, optional
+        Maximum number of events held in memory before new events are written straight to the spool. Default is 1000.
+
+    max_retry_interval: integer, optional
+        Maximum number of seconds to wait between attempts while the central facility is unreachable. Default is 300.
+
+    cert_verify: boolean or string, optional
+        Passed to 'requests' as 'verify' for https connections. Default is False.
+
+    """
+
+    # Seconds the background thread waits for new events before checking the spool again.
+    POLL_INTERVAL = 1
+    # Seconds before a request to the central facility is abandoned.
+    REQUEST_TIMEOUT = 30
+
+    def __init__(self, url, spool, batch_size=100, buffer_size=1000, max_retry_interval=300, cert_verify=False):
+        self.url = url
+        self.spool = spool
+        self.batch_size = batch_size
+        self.max_retry_interval = max_retry_interval
+        self.cert_verify = cert_verify
+        self.logger = logging.getLogger(__name__)
+
+        self._buffer = Queue.Queue(maxsize=buffer_size)
+        # Held while moving buffered events into the spool, so events spooled directly never go ahead of them.
+        self._spool_lock = threading.Lock()
+        self._session = requests.Session()
+        self._session.headers.update({'Content-Type': 'application/json'})
+        self._retry_interval = 0
+        self._next_attempt = 0
+        self._rejected = 0
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """Start the background thread that spools and sends events."""
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="CentralForwarder")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread, after it spools any events still in the buffer."""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+
+    def enqueue(self, msg):
+        """Queue an event to be forwarded to the central facility.  Never blocks on the network.
+
+        Parameters
+        ----------
+        msg: JSON string
+            The event packet, exactly as it should be sent to the central facility.
+
+        """
+        try:
+            self._buffer.put_nowait(msg)
+        except Queue.Full:
+            # The buffer is not empty, so moving it into the spool never waits for events to arrive.
+            with self._spool_lock:
+                self._spool_buffered_events(0)
+                self.spool.append([msg])
+
+    def pending(self):
+        """Returns the number of events waiting to be forwarded, either buffered in memory or spooled on disk."""
+        return self._buffer.qsize() + self.spool.depth()
+
+    def rejected(self):
+        """Returns the number of events the central facility could not save since the forwarder was created."""
+        return self._rejected
+
+    def _run(self):
+        wait = self.POLL_INTERVAL
+        while self._running:
+            with self._spool_lock:
+                self._spool_buffered_events(wait)
+            wait = self.POLL_INTERVAL
+            if time.time() >= self._next_attempt:
+                # While a backlog is being sent, keep sending full batches without waiting for new events.
+                if self.send_spooled_batch() == self.batch_size:
+                    wait = 0
+        with self._spool_lock:
+            self._spool_buffered_events(0)
+
+    def _spool_buffered_events(self, wait):
+        """Move every buffered event into the spool, waiting up to 'wait' seconds for the first one to arrive.  Must be
+        called holding '_spool_lock'."""
+        try:
+            records = [self._buffer.get(timeout=wait)]
+        except Queue.Empty:
+            return
+
+        while True:
+            try:
+                records.append(self._buffer.get_nowait())
+            except Queue.Empty:
+                break
+        self.spool.append(records)
+
+    def send_spooled_batch(self):
+        """Send the oldest spooled events to the central facility as one batch, removing them from the spool once the
+        central facility has answered for them, and scheduling a retry with backoff if it could not be reached or had
+        a server error.  Events the central facility could not save are logged and counted by 'rejected'.
+
+        Returns
+        -------
+        handled: integer
+            Number of events removed from the spool, whether the central facility saved them or not.
+
+        """
+        records, position = self.spool.read(self.batch_size)
+        if not records:
+            return 0
+
+        try:
+            response = self._session.post(self.url, data="[%s]" % ", ".join(records), verify=self.cert_verify,
+                                          timeout=self.REQUEST_TIMEOUT)
+            if response.status_code >= 500:
+                response.raise_for_status()
+        except requests.RequestException, e:
+            self._retry_interval = min(max(self._retry_interval * 2, 1), self.max_retry_interval)
+            self._next_attempt = time.time() + self._retry_interval
+            self.logger.warning("Could not forward %s events to central facility, retrying in %s seconds: %s",
+                                len(records), self._retry_interval, e)
+            return 0
+
+        self._retry_interval = 0
+        self._next_attempt = 0
+        try:
+            response.raise_for_status()
+            results = response.json()
+        except (requests.RequestException, ValueError), e:
+            self.logger.error("Central facility rejected a batch of %s events, dropping them: %s", len(records), e)
+            self._rejected += len(records)
+            self.spool.commit(position)
+            return len(records)
+
+        for result in results:
+            if result.get('status') != "OK":
+                self.logger.error("Central facility could not save event with code %s: %s", result.get('event_code'),
+                                  result.get('response'))
+                self._rejected += 1
+        self.spool.commit(position)
+        return len(records)
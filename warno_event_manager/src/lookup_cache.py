@@ -0,0 +1,71 @@
+import threading
+
+from collections import OrderedDict
+
+
+class LookupCache(object):
+    """Keeps the results of lookups that rarely change, such as event codes and instrument data references, so that
+    repeating them does not need a database round trip.  Holds at most 'max_size' entries, discarding the least recently
+    used entry when full.  Safe to share between threads.
+
+    Parameters
+    ----------
+    max_size: integer
+        Maximum number of entries kept.
+
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Get the value cached for a key, marking it as the most recently used.
+
+        Parameters
+        ----------
+        key: hashable
+            Key the value was cached under.
+
+        default: object, optional
+            Returned if nothing is cached for 'key'.  Default is None.
+
+        Returns
+        -------
+        value: object
+            The cached value, or 'default'.
+
+        """
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value = self._entries.pop(key)
+            self._entries[key] = value
+            return value
+
+    def set(self, key, value):
+        """Cache a value for a key, discarding the least recently used entry if the cache is full.
+
+        Parameters
+        ----------
+        key: hashable
+            Key to cache the value under.
+
+        value: object
+            Value to cache.
+
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Discard every cached entry."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,270 @@
+import re
+import datetime
+
+# Data tables partitioned by month of 'time', when the database supports it.
+PARTITIONED_TABLES = ["prosensing_paf", "iris_bite", "events_with_value", "events_with_text", "instrument_logs",
+                      "pulse_captures"]
+
+# Native partitioning with primary keys and indexes on the partitioned table was added in Postgres 11.  On older
+# databases the tables are left unpartitioned and old rows are deleted instead of dropped with their partition.
+MINIMUM_SERVER_VERSION = 110000
+
+# Matches the time bounds in a partition's 'FOR VALUES FROM (...) TO (...)' expression, where MINVALUE has no quotes.
+BOUND_PATTERN = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+
+def supports_partitioning(session):
+    """Returns whether the database supports the monthly partitioning of the data tables.
+
+    Parameters
+    ----------
+    session: sqlalchemy session
+        Database session to check the server version through.
+
+    Returns
+    -------
+    supported: boolean
+        True if the server is Postgres 11 or newer.
+
+    """
+    return int(session.execute("SHOW server_version_num").fetchone()[0]) >= MINIMUM_SERVER_VERSION
+
+
+def is_partitioned(session, table):
+    """Returns whether a table is partitioned.
+
+    Parameters
+    ----------
+    session: sqlalchemy session
+        Database session used to query the system catalogs.
+
+    table: string
+        Name of the database table.
+
+    Returns
+    -------
+    partitioned: boolean
+        True if the table is a partitioned table.
+
+    """
+    if not supports_partitioning(session):
+        return False
+    row = session.execute("SELECT 1 FROM pg_partitioned_table JOIN pg_class ON pg_class.oid = "
+                          "pg_partitioned_table.partrelid WHERE pg_class.relname = :table",
+                          dict(table=table)).fetchone()
+    return row is not None
+
+
+def parse_bound(bound):
+    """Converts one side of a partition's bounds to a datetime.
+
+    Parameters
+    ----------
+    bound: string
+        Either MINVALUE, MAXVALUE, or a quoted timestamp such as "'2017-06-01 00:00:00'".
+
+    Returns
+    -------
+    bound_time: datetime or None
+        The bound's time, or None for MINVALUE or MAXVALUE.
+
+    """
+    if bound in ("MINVALUE", "MAXVALUE"):
+        return None
+    return datetime.datetime.strptime(bound.strip("'"), "%Y-%m-%d %H:%M:%S")
+
+
+def get_partitions(session, table):
+    """Returns a partitioned table's partitions and their time bounds, in time order.
+
+    Parameters
+    ----------
+    session: sqlalchemy session
+        Database session used to query the system catalogs.
+
+    table: string
+        Name of the partitioned table.
+
+    Returns
+    -------
+    partitions: list of tuples
+        (partition_name, start_time, end_time) for each partition, where 'start_time' is None for a partition with no
+        lower bound.  Each partition holds the rows from 'start_time' up to, but not including, 'end_time'.
+
+    """
+    rows = session.execute("SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) FROM pg_inherits "
+                           "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+                           "JOIN pg_class child ON child.oid = pg_inherits.inhrelid WHERE parent.relname = :table",
+                           dict(table=table)).fetchall()
+
+    partitions = []
+    for name, bound_expression in rows:
+        # The DEFAULT partition has no bounds, see 'get_default_partition'
+        match = BOUND_PATTERN.search(bound_expression)
+        if match is not None:
+            partitions.append((name, parse_bound(match.group(1)), parse_bound(match.group(2))))
+    return sorted(partitions, key=lambda partition: partition[2])
+
+
+def get_default_partition(session, table):
+    """Returns the name of a partitioned table's DEFAULT partition, which holds any row no other partition covers, such
+    as a row timed further ahead than the monthly partitions created so far.
+
+    Parameters
+    ----------
+    session: sqlalchemy session
+        Database session used to query the system catalogs.
+
+    table: string
+        Name of the partitioned table.
+
+    Returns
+    -------
+    default_partition: string or None
+        Name of the DEFAULT partition, or None if the table has none.
+
+    """
+    row = session.execute("SELECT child.relname FROM pg_inherits "
+                          "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+                          "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                          "WHERE parent.relname = :table AND pg_get_expr(child.relpartbound, child.oid) = 'DEFAULT'",
+                          dict(table=table)).fetchone()
+    return row[0] if row is not None else None
+
+
+def month_start(given_time, months_later=0):
+    """Returns the start of the month holding 'given_time', or of a month after it.
+
+    Parameters
+    ----------
+    given_time: datetime
+        Time in the month.
+
+    months_later: integer, optional
+        Number of months after the month of 'given_time' to return the start of.
+
+    Returns
+    -------
+    start_time: datetime
+        Midnight on the first day of the month.
+
+    """
+    month_index = given_time.year * 12 + given_time.month - 1 + months_later
+    return datetime.datetime(month_index // 12, month_index % 12 + 1, 1)
+
+
+def create_future_partitions(session, table, until_time):
+    """Creates monthly partitions for a partitioned table following its latest partition, until there is a partition
+    for every time before the end of the month holding 'until_time'.  Partitions are named '<table>_p<YYYY><MM>'.  The
+    changes are not committed.
+
+    A partition can not be created while the DEFAULT partition holds rows in its range, so the DEFAULT partition is
+    detached while the partitions are created, its rows in each new partition's range are moved into it, and it is
+    attached again afterwards.
+
+    Parameters
+    ----------
+    session: sqlalchemy session
+        Database session the partitions are created through.
+
+    table: string
+        Name of the partitioned table.
+
+    until_time: datetime
+        Time that must have a partition.
+
+    Returns
+    -------
+    created: list of tuples
+        (partition_name, moved_rows) for each partition created, where 'moved_rows' is the number of rows moved into it
+        from the DEFAULT partition.
+
+    """
+    partitions = get_partitions(session, table)
+    next_start = partitions[-1][2] if partitions else month_start(until_time)
+    if next_start > until_time:
+        return []
+
+    default_partition = get_default_partition(session, table)
+    if default_partition is not None:
+        session.execute("ALTER TABLE %s DETACH PARTITION %s" % (table, default_partition))
+
+    created = []
+    while next_start <= until_time:
+        next_end = month_start(next_start, 1)
+        name = "%s_p%s" % (table, next_start.strftime("%Y%m"))
+        session.execute("CREATE TABLE %s PARTITION OF %s FOR VALUES FROM ('%s') TO ('%s')"
+                        % (name, table, next_start.isoformat(" "), next_end.isoformat(" ")))
+        moved_rows = 0
+        if default_partition is not None:
+            moved_rows = session.execute("WITH moved AS (DELETE FROM %s WHERE time >= '%s' AND time < '%s' "
+                                         "RETURNING *) INSERT INTO %s SELECT * FROM moved"
+                                         % (default_partition, next_start.isoformat(" "), next_end.isoformat(" "),
+                                            name)).rowcount
+        created.append((name, moved_rows))
+        next_start = next_end
+
+    if default_partition is not None:
+        session.execute("ALTER TABLE %s ATTACH PARTITION %s DEFAULT" % (table, default_partition))
+    return created
+
+
+def get_drop_cutoff(session, table, cutoff_time):
+    """Returns the time before which a table's rows can be removed by dropping whole partitions, when every row before
+    'cutoff_time' is being removed.  This is the end of the latest partition that holds only rows before the start of
+    the month holding 'cutoff_time'.
+
+    Parameters
+    ----------
+    session: sqlalchemy session
+        Database session used to query the system catalogs.
+
+    table: string
+        Name of the database table.
+
+    cutoff_time: datetime
+        Time every row before is being removed.
+
+    Returns
+    -------
+    drop_cutoff: datetime or None
+        Time before which every partition can be dropped, or None if the table is not partitioned or no partition is
+        old enough to drop.
+
+    """
+    if not is_partitioned(session, table):
+        return None
+    ends = [end_time for _, _, end_time in get_partitions(session, table)
+            if end_time is not None and end_time <= month_start(cutoff_time)]
+    return max(ends) if ends else None
+
+
+def drop_partitions_before(session, table, before_time):
+    """Drops every partition of a partitioned table holding only rows older than 'before_time'.  Dropping a partition
+    removes its rows without leaving dead rows for vacuum to clean up, as deleting them would.  The changes are not
+    committed.
+
+    Parameters
+    ----------
+    session: sqlalchemy session
+        Database session the partitions are dropped through.
+
+    table: string
+        Name of the partitioned table.
+
+    before_time: datetime
+        Partitions ending at or before this time are dropped.
+
+    Returns
+    -------
+    dropped: list of strings
+        Names of the partitions dropped.
+
+    """
+    dropped = []
+    for name, _, end_time in get_partitions(session, table):
+        if end_time is not None and end_time <= before_time:
+            session.execute("ALTER TABLE %s DETACH PARTITION %s" % (table, name))
+            session.execute("DROP TABLE %s" % (name,))
+            dropped.append(name)
+    return dropped
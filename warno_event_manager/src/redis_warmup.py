@@ -0,0 +1,171 @@
+import logging
+import datetime
+import threading
+
+from multiprocessing.pool import ThreadPool
+
+from WarnoConfig import schema_cache
+
+# Columns of the special tables that are not saved to Redis as attributes.
+IGNORED_COLUMNS = ["packet_id", "site_id", "instrument_id", "time"]
+
+# Tables holding the events of attributes that do not have their own table, in the order they are checked.
+EVENT_TABLES = [("events_with_value", "value"), ("events_with_text", "text")]
+
+
+class RedisWarmup(object):
+    """Brings Redis up to date with the database when the Event Manager starts, without clearing it first.  For each
+    instrument data reference, only the entries newer than the newest entry Redis already holds are read from the
+    database, and they are written to Redis in a single pipeline or transaction per reference.  Instruments are warmed
+    up in parallel, and the warm-up runs alongside the Event Manager saving new events, so its progress is kept for
+    'get_progress' to report.
+
+    Parameters
+    ----------
+    redint: RedisInterface
+        Interface the entries are written through.
+
+    workers: integer, optional
+        Number of instruments warmed up at once, each in its own thread with its own database session.
+
+    """
+
+    def __init__(self, redint, workers=4):
+        self.redint = redint
+        self.workers = workers
+        self.logger = logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._progress = dict(status="waiting", references=0, completed=0, failed=0, entries_added=0,
+                              started_time=None, finished_time=None)
+
+    def run(self, app, session):
+        """Warms up Redis for every instrument data reference, returning once every instrument is done.  Event codes
+        are loaded into Redis first, as saving new events reads them.
+
+        Parameters
+        ----------
+        app: Flask application
+            Application whose context each worker thread runs in.
+
+        session: sqlalchemy scoped session
+            Database session, which gives each worker thread a session of its own.
+
+        """
+        with app.app_context():
+            pipe = self.redint.pipeline()
+            for event_code, description in session.execute("SELECT event_code, description FROM event_codes"):
+                pipe.add_event_code(event_code, description)
+            pipe.execute()
+
+            references = session.execute("SELECT instrument_id, special, description "
+                                         "FROM instrument_data_references ORDER BY instrument_id").fetchall()
+
+        instrument_references = {}
+        for instrument_id, special, description in references:
+            instrument_references.setdefault(instrument_id, []).append((special, description))
+
+        self._update_progress(status="running", references=len(references), started_time=datetime.datetime.now())
+        self.logger.info("Warming up Redis for %s data references of %s instruments", len(references),
+                         len(instrument_references))
+
+        pool = ThreadPool(self.workers)
+        try:
+            pool.map(lambda item: self._warm_up_instrument(app, session, item[0], item[1]),
+                     instrument_references.items())
+        finally:
+            pool.close()
+            pool.join()
+
+        self._update_progress(status="finished", finished_time=datetime.datetime.now())
+        progress = self.get_progress()
+        self.logger.info("Finished warming up Redis, added %s entries, %s data references failed",
+                         progress["entries_added"], progress["failed"])
+
+    def get_progress(self):
+        """Get the progress of the warm-up.
+
+        Returns
+        -------
+        progress: dictionary
+            Of the form {'status': ("waiting", "running", or "finished"), 'references': (data references to warm up),
+            'completed': (data references done), 'failed': (data references that could not be warmed up),
+            'entries_added': (entries written to Redis), 'started_time': (ISO 8601 time or None), 'finished_time':
+            (ISO 8601 time or None)}.
+
+        """
+        with self._lock:
+            progress = dict(self._progress)
+        for time_key in ("started_time", "finished_time"):
+            if progress[time_key] is not None:
+                progress[time_key] = progress[time_key].isoformat()
+        return progress
+
+    def _update_progress(self, **changes):
+        """Sets progress values, adding to them instead for the counts of references and entries done."""
+        with self._lock:
+            for key, value in changes.iteritems():
+                if key in ("completed", "failed", "entries_added"):
+                    self._progress[key] += value
+                else:
+                    self._progress[key] = value
+
+    def _warm_up_instrument(self, app, session, instrument_id, references):
+        """Warms up each of an instrument's data references in turn.  A reference that fails is logged and skipped."""
+        with app.app_context():
+            for special, description in references:
+                try:
+                    if special:
+                        added = self._warm_up_table(session, instrument_id, description)
+                    else:
+                        added = self._warm_up_attribute(session, instrument_id, description)
+                    self._update_progress(completed=1, entries_added=added)
+                except Exception, e:
+                    session.rollback()
+                    self.logger.error("Failed to warm up Redis for '%s' of instrument %s: %s", description,
+                                      instrument_id, e)
+                    self._update_progress(completed=1, failed=1)
+
+    def _warm_up_table(self, session, instrument_id, table):
+        """Backfills the attributes of a special table, which are organized under the table in Redis."""
+        columns = [column for column in schema_cache.get_column_names(session, table) if column not in IGNORED_COLUMNS]
+
+        def fetch_entries(after_time):
+            rows = self._fetch_rows(session, table, ["time"] + columns, "instrument_id = :instrument_id",
+                                    dict(instrument_id=instrument_id), after_time)
+            values = [[row[index] if row[index] is not None else "NULL" for row in rows]
+                      for index in xrange(1, len(columns) + 1)]
+            return [row[0] for row in rows], values
+
+        return self.redint.backfill_values(instrument_id, columns, fetch_entries, table_name=table)
+
+    def _warm_up_attribute(self, session, instrument_id, attribute):
+        """Backfills an attribute saved as events, named after the description of its event code."""
+        event_code = session.execute("SELECT event_code FROM event_codes WHERE description = :description",
+                                     dict(description=attribute)).fetchone()
+        if event_code is None:
+            return 0
+
+        def fetch_entries(after_time):
+            # An attribute's events are either all values or all text
+            rows = []
+            for table, column in EVENT_TABLES:
+                rows = self._fetch_rows(session, table, ["time", column],
+                                        "instrument_id = :instrument_id AND event_code = :event_code",
+                                        dict(instrument_id=instrument_id, event_code=event_code[0]), after_time)
+                if rows:
+                    break
+            return [row[0] for row in rows], [[row[1] if row[1] is not None else "NULL" for row in rows]]
+
+        return self.redint.backfill_values(instrument_id, [attribute], fetch_entries)
+
+    def _fetch_rows(self, session, table, columns, condition, parameters, after_time):
+        """Returns the newest rows of a table matching 'condition' that are after 'after_time' (if it is not None), at
+        most as many as Redis keeps, ordered from oldest to newest."""
+        parameters = dict(parameters, limit=self.redint.MAX_ENTRIES)
+        if after_time is not None:
+            condition += " AND time > :after_time"
+            parameters["after_time"] = after_time
+        rows = session.execute("SELECT %s FROM %s WHERE %s ORDER BY time DESC LIMIT :limit"
+                               % (", ".join(columns), table, condition), parameters).fetchall()
+        return list(reversed(rows))
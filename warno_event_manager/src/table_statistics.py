@@ -0,0 +1,83 @@
+import json
+import datetime
+
+
+class TableStatistics(object):
+    """Keeps statistics about the data tables for the Event Manager home page, so loading the page never has to count
+    or scan the tables.
+
+    'refresh' gathers the statistics, and is run on a schedule in the background.  Row counts are the query planner's
+    row estimates, which come from the statistics Postgres keeps for each table and cost nothing to read, rather than
+    exact counts, which read every row.  The oldest and newest times are found using each table's
+    (instrument_id, time) index, by reading the first and last row of each instrument.
+
+    Parameters
+    ----------
+    tables: list of strings
+        Names of the data tables to keep statistics for.  Each must have 'instrument_id' and 'time' columns.
+
+    """
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.refreshed_time = None
+        self._statistics = []
+
+    def refresh(self, session, cutoff_time):
+        """Gather new statistics for every table, replacing the previous statistics once all of them are gathered.
+
+        Parameters
+        ----------
+        session: sqlalchemy session
+            Database session the statistics are read through.
+
+        cutoff_time: datetime
+            Time before which data is archived, used to estimate how many rows are archivable.
+
+        """
+        statistics = []
+        for table in self.tables:
+            oldest, newest = self._get_time_range(session, table)
+            statistics.append(dict(name=table, count=self._estimate_rows(session, table),
+                                   cutoff_entries=self._estimate_rows(session, table, cutoff_time),
+                                   oldest=oldest, newest=newest))
+
+        # Replaced in one assignment, so readers always see a complete set of statistics
+        self._statistics = statistics
+        self.refreshed_time = datetime.datetime.now()
+
+    def get_statistics(self):
+        """Get the statistics from the last refresh.
+
+        Returns
+        -------
+        statistics: list of dictionaries
+            For each table, a dictionary of the form {'name': (table name), 'count': (estimated rows), 'cutoff_entries':
+            (estimated rows older than the cutoff time), 'oldest': (time of the oldest row, or None if the table is
+            empty), 'newest': (time of the newest row, or None)}.  Empty if the statistics have not been refreshed.
+
+        """
+        return list(self._statistics)
+
+    def _estimate_rows(self, session, table, cutoff_time=None):
+        """Returns the planner's estimate of the number of rows in a table, or of the rows older than 'cutoff_time'."""
+        if cutoff_time is None:
+            rows = session.execute("EXPLAIN (FORMAT JSON) SELECT 1 FROM %s" % (table,)).fetchone()
+        else:
+            rows = session.execute("EXPLAIN (FORMAT JSON) SELECT 1 FROM %s WHERE time < :cutoff_time" % (table,),
+                                   dict(cutoff_time=cutoff_time.isoformat())).fetchone()
+
+        # Depending on the driver version, the plan is returned either already decoded or as JSON text
+        plan = rows[0]
+        if isinstance(plan, basestring):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+    def _get_time_range(self, session, table):
+        """Returns the times of the oldest and newest rows of a table, reading one row at each end of every
+        instrument's data through the (instrument_id, time) index rather than scanning the table."""
+        return session.execute("SELECT min(oldest.time), max(newest.time) FROM instruments, "
+                               "LATERAL (SELECT time FROM %s WHERE instrument_id = instruments.instrument_id "
+                               "ORDER BY time ASC LIMIT 1) AS oldest, "
+                               "LATERAL (SELECT time FROM %s WHERE instrument_id = instruments.instrument_id "
+                               "ORDER BY time DESC LIMIT 1) AS newest" % (table, table)).fetchone()
@@ -0,0 +1,65 @@
+import mock
+import json
+import datetime
+
+from StringIO import StringIO
+from unittest import TestCase
+
+from .. import archiver
+
+
+class FakeRow(object):
+    """Stands in for a sqlalchemy row, which can be read by index or by column name."""
+
+    def __init__(self, names, values):
+        self.names = names
+        self.values = values
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __getitem__(self, key):
+        if isinstance(key, basestring):
+            return self.values[self.names.index(key)]
+        return self.values[key]
+
+
+class TestArchiver(TestCase):
+
+    def setUp(self):
+        columns = [("id", "integer"), ("instrument_id", "integer"), ("event_code", "integer"),
+                   ("time", "timestamp without time zone"), ("value", "double precision")]
+        names = [column[0] for column in columns] + ["archive_key"]
+        rows = [FakeRow(names, [index, 1, 3, datetime.datetime(2001, 1, 1, 1, index), float(index), index])
+                for index in range(1, 4)]
+
+        self.session = mock.Mock()
+        self.session.execute.return_value.fetchall.side_effect = [columns, rows[:2], rows[2:]]
+
+        # Columns are looked up through the process-wide schema cache, which must not hold another test's columns
+        archiver.schema_cache.invalidate()
+        version_patcher = mock.patch.object(archiver.schema_cache, "_get_schema_version", return_value="9a3f1c5e7b20")
+        version_patcher.start()
+        self.addCleanup(version_patcher.stop)
+
+    def test_write_table_archive_pages_by_time_and_key_and_writes_definition_from_single_pass(self):
+        """Tests that each chunk after the first continues from the last (time, id) read rather than using an offset,
+        and that the start time, end time and row count are written from the rows read."""
+        datafile = StringIO()
+        archiver.write_table_archive(self.session, datafile, "events_with_value", 1, datetime.datetime(2002, 1, 1),
+                                     chunk_size=2)
+
+        queries = [str(call[0][0]) for call in self.session.execute.call_args_list]
+        self.assertNotIn("OFFSET", " ".join(queries), "Rows were paged with OFFSET.")
+        self.assertIn("(time, id) > (:last_time, :last_key)", queries[2], "Second chunk did not continue from the key.")
+        self.assertEqual(self.session.execute.call_args_list[2][0][1]["last_key"], 2,
+                         "Second chunk did not continue from the last row of the first chunk.")
+
+        lines = datafile.getvalue().splitlines()
+        definition = json.loads(lines[0])["definition"]
+        self.assertEqual(definition["num_entries"], 3, "Row count does not match rows written.")
+        self.assertEqual(len(lines), 4, "Definition was not followed by one line per row.")
+        self.assertEqual(definition["start_time"], "2001-01-01T01:01:00Z", "Start time is not the first row.")
+        self.assertEqual(definition["end_time"], "2001-01-01T01:03:00Z", "End time is not the last row.")
+        self.assertEqual(json.loads(lines[1]), [1, 1, 3, "2001-01-01T01:01:00Z", 1.0],
+                         "Row was not written in column order with an iso time.")
@@ -1,4 +1,6 @@
 import mock
+import gzip
+import json
 import os
 
 from flask.ext.fixtures import FixturesMixin
@@ -6,6 +8,7 @@ from flask.ext.testing import TestCase
 
 from .. import warno_event_manager
 from WarnoConfig.models import db
+from WarnoConfig.models import EventWithValue
 from WarnoConfig import config
 
 
@@ -50,7 +53,7 @@ class TestEventManager(TestCase, FixturesMixin):
 
         # Get the three most recently created files (which should have been created when the tested function was called)
         dated_files = [(os.path.getmtime(fn), os.path.basename(fn))
-                       for fn in possible_files if fn.lower().endswith('.json')]
+                       for fn in possible_files if fn.lower().endswith('.json') or fn.lower().endswith('.ndjson.gz')]
 
         dated_files.sort()
         dated_files.reverse()
@@ -64,17 +67,17 @@ class TestEventManager(TestCase, FixturesMixin):
         expected = ""
 
         # Test each file against the expected example files
-        with open(first_instrument, 'r') as borky:
+        with gzip.open(first_instrument, 'rb') as borky:
             contents = borky.read()
-        with open(os.path.join(os.path.dirname(__file__), "archive_testfile_1.json"), 'r') as borky:
+        with open(os.path.join(os.path.dirname(__file__), "archive_testfile_1.ndjson"), 'r') as borky:
             expected = borky.read()
-        self.assertEqual(contents, expected, "Instrument 1's output does not match 'archive_testfile_1.json'")
+        self.assertEqual(contents, expected, "Instrument 1's output does not match 'archive_testfile_1.ndjson'")
 
-        with open(second_instrument, 'r') as borky:
+        with gzip.open(second_instrument, 'rb') as borky:
             contents = borky.read()
-        with open(os.path.join(os.path.dirname(__file__), "archive_testfile_2.json"), 'r') as borky:
+        with open(os.path.join(os.path.dirname(__file__), "archive_testfile_2.ndjson"), 'r') as borky:
             expected = borky.read()
-        self.assertEqual(contents, expected, "Instrument 2's output does not match 'archive_testfile_2.json'")
+        self.assertEqual(contents, expected, "Instrument 2's output does not match 'archive_testfile_2.ndjson'")
 
         with open(db_info, 'r') as borky:
             contents = borky.read()
@@ -84,4 +87,68 @@ class TestEventManager(TestCase, FixturesMixin):
 
         os.remove(first_instrument)
         os.remove(second_instrument)
-        os.remove(db_info)
\ No newline at end of file
+        os.remove(db_info)
+
+    @mock.patch.object(warno_event_manager, 'forwarder')
+    @mock.patch.object(warno_event_manager, 'redint')
+    def test_events_saves_every_valid_event_in_batch_and_reports_status_for_each(self, redint, forwarder, logger):
+        """A batch posted to '/eventmanager/events' saves each valid event, reports an 'ERROR' status only for the
+        malformed events without losing the rest of the batch, sends all Redis writes through one pipeline, and only
+        forwards the events that were saved."""
+        pipeline = mock.Mock()
+        redint.pipeline.return_value = pipeline
+        initial_count = db.session.query(EventWithValue).count()
+
+        batch = [{"event_code": 3, "data": {"instrument_id": 1, "time": "2016-01-01T01:01:01Z", "value": 5}},
+                 {"event_code": 3, "data": {"instrument_id": 1}},
+                 {"event_code": 3, "data": {"instrument_id": 1, "time": "2016-01-01T01:02:01Z", "value": 6}},
+                 "not an event"]
+        result = self.client.post('/eventmanager/events', data=json.dumps(batch))
+
+        statuses = [entry["status"] for entry in json.loads(result.data)]
+        self.assertEqual(statuses, ["OK", "ERROR", "OK", "ERROR"], "Unexpected per-event statuses '%s'" % statuses)
+        self.assertEqual(db.session.query(EventWithValue).count(), initial_count + 2,
+                         "The two valid events in the batch were not both saved.")
+        self.assertEqual(pipeline.execute.call_count, 1, "Batch Redis pipeline was not executed exactly once.")
+        self.assertEqual(forwarder.enqueue.call_count, 2, "Only the saved events were not forwarded.")
+
+    @mock.patch.object(warno_event_manager, 'forwarder')
+    @mock.patch.object(warno_event_manager, 'redint')
+    def test_events_never_sends_the_redis_writes_of_an_event_that_fails(self, redint, forwarder, logger):
+        """An event in the middle of a batch that fails after queuing its Redis writes is rolled back, and its writes
+        are never moved onto the batch's Redis pipeline, while the writes of the events either side of it are."""
+        pipelines = []
+
+        def new_pipeline():
+            pipelines.append(mock.Mock())
+            return pipelines[-1]
+        redint.pipeline.side_effect = new_pipeline
+
+        def handler(msg, msg_struct):
+            warno_event_manager.redis_writer().add_values_for_attribute(1, "value", None, msg_struct["data"])
+            if msg_struct["data"] == "fails":
+                raise ValueError("Event failed after queuing its Redis writes")
+            return "", 200
+
+        batch = [{"event_code": 3, "data": "first"}, {"event_code": 3, "data": "fails"},
+                 {"event_code": 3, "data": "third"}]
+        with mock.patch.object(warno_event_manager, 'save_misc_event', side_effect=handler):
+            result = self.client.post('/eventmanager/events', data=json.dumps(batch))
+
+        statuses = [entry["status"] for entry in json.loads(result.data)]
+        self.assertEqual(statuses, ["OK", "ERROR", "OK"], "Unexpected per-event statuses '%s'" % statuses)
+        batch_pipeline, first, failed, third = pipelines
+        self.assertListEqual(batch_pipeline.extend.call_args_list, [mock.call(first), mock.call(third)],
+                             "Only the Redis writes of the saved events were not moved onto the batch pipeline.")
+        failed.execute.assert_not_called()
+        self.assertEqual(batch_pipeline.execute.call_count, 1, "Batch Redis pipeline was not executed exactly once.")
+
+    @mock.patch.object(warno_event_manager, 'forwarder')
+    @mock.patch.object(warno_event_manager, 'redint')
+    def test_save_misc_event_queues_event_for_central_facility_without_sending_it(self, redint, forwarder, logger):
+        """At a site, a saved event is handed to the forwarder to be sent to the central facility in the background,
+        rather than being posted before the event manager responds."""
+        msg = '{"event_code": 3, "data": {"instrument_id": 1, "time": "2016-01-01T01:01:01Z", "value": 5}}'
+        warno_event_manager.save_misc_event(msg, json.loads(msg))
+
+        forwarder.enqueue.assert_called_once_with(msg)
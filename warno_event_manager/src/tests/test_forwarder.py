@@ -0,0 +1,77 @@
+import mock
+import shutil
+import tempfile
+
+import requests
+from unittest import TestCase
+
+from .. import forwarder
+from WarnoConfig.spool import Spool
+
+
+class TestCentralForwarder(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.forwarder = forwarder.CentralForwarder("http://central/eventmanager/events", Spool(self.directory),
+                                                    batch_size=2, max_retry_interval=4)
+        self.forwarder._session = mock.Mock()
+        self.forwarder._session.post.return_value.status_code = 200
+        self.forwarder._session.post.return_value.json.return_value = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_send_spooled_batch_posts_oldest_events_and_removes_them_once_accepted(self):
+        """Tests that up to 'batch_size' spooled events are posted as one JSON list and are only removed from the spool
+        after the post succeeds."""
+        self.forwarder.spool.append(['{"event_code": 1}', '{"event_code": 2}', '{"event_code": 3}'])
+
+        sent = self.forwarder.send_spooled_batch()
+
+        self.assertEqual(sent, 2, "Batch did not contain 'batch_size' events.")
+        data = self.forwarder._session.post.call_args[1]["data"]
+        self.assertEqual(data, '[{"event_code": 1}, {"event_code": 2}]', "Posted batch '%s' is not as expected." % data)
+        self.assertEqual(self.forwarder.pending(), 1, "Delivered events were not removed from the spool.")
+
+    def test_failed_send_keeps_events_and_backs_off(self):
+        """Tests that events stay spooled when the central facility cannot be reached, and that the retry interval
+        doubles after each failure without exceeding 'max_retry_interval'."""
+        self.forwarder._session.post.side_effect = requests.ConnectionError("unreachable")
+        self.forwarder.spool.append(['{"event_code": 1}'])
+
+        intervals = []
+        for attempt in range(4):
+            self.assertEqual(self.forwarder.send_spooled_batch(), 0, "Failed send reported delivered events.")
+            intervals.append(self.forwarder._retry_interval)
+
+        self.assertEqual(intervals, [1, 2, 4, 4], "Retry intervals '%s' do not back off as expected." % intervals)
+        self.assertEqual(self.forwarder.pending(), 1, "Event was lost after failed sends.")
+
+    def test_enqueue_spools_buffered_events_first_when_buffer_is_full(self):
+        """Tests that when the in-memory buffer is full, the buffered events are spooled ahead of the new event rather
+        than it being dropped or spooled out of order."""
+        full_forwarder = forwarder.CentralForwarder("http://central/eventmanager/events", Spool(self.directory),
+                                                    buffer_size=1)
+        full_forwarder.enqueue('{"event_code": 1}')
+        full_forwarder.enqueue('{"event_code": 2}')
+
+        self.assertEqual(full_forwarder.spool.read(10)[0], ['{"event_code": 1}', '{"event_code": 2}'],
+                         "Buffered event was not spooled ahead of the event that did not fit in the buffer.")
+        self.assertEqual(full_forwarder.pending(), 2, "Pending count does not include every event.")
+
+    def test_send_spooled_batch_counts_rejected_events(self):
+        """Tests that events the central facility could not save, and batches it rejects as bad requests, are counted
+        and removed from the spool rather than retried."""
+        self.forwarder.spool.append(['{"event_code": 1}', '{"event_code": 2}', '{"event_code": 3}'])
+        self.forwarder._session.post.return_value.json.return_value = [dict(index=0, event_code=1, status="OK"),
+                                                                       dict(index=1, event_code=2, status="ERROR")]
+        self.forwarder.send_spooled_batch()
+        self.assertEqual(self.forwarder.rejected(), 1, "Event the central facility could not save was not counted.")
+
+        self.forwarder._session.post.return_value.status_code = 400
+        self.forwarder._session.post.return_value.raise_for_status.side_effect = requests.HTTPError("400 Bad Request")
+        self.assertEqual(self.forwarder.send_spooled_batch(), 1, "Rejected batch was not removed from the spool.")
+        self.assertEqual(self.forwarder.rejected(), 2, "Rejected batch was not counted.")
+        self.assertEqual(self.forwarder.pending(), 0, "Rejected batch was kept in the spool.")
+
@@ -0,0 +1,27 @@
+from unittest import TestCase
+
+from ..lookup_cache import LookupCache
+
+
+class TestLookupCache(TestCase):
+
+    def setUp(self):
+        self.cache = LookupCache(2)
+
+    def test_get_returns_default_for_missing_keys(self):
+        """Tests that a key that was never cached returns the given default."""
+        self.assertIsNone(self.cache.get("temperature"), "Missing key did not return None.")
+        self.assertEqual(self.cache.get("temperature", 0), 0, "Missing key did not return the given default.")
+
+    def test_set_discards_least_recently_used_entry_when_full(self):
+        """Tests that once the cache is full, adding an entry discards the entry used longest ago, where reading an
+        entry counts as using it."""
+        self.cache.set("temperature", 10000)
+        self.cache.set("voltage", 10001)
+        self.cache.get("temperature")
+        self.cache.set("humidity", 10002)
+
+        self.assertEqual(len(self.cache), 2, "Cache grew past its maximum size.")
+        self.assertIsNone(self.cache.get("voltage"), "Least recently used entry was not discarded.")
+        self.assertEqual(self.cache.get("temperature"), 10000, "Recently read entry was discarded.")
+        self.assertEqual(self.cache.get("humidity"), 10002, "New entry was not cached.")
@@ -0,0 +1,76 @@
+import mock
+import datetime
+
+from unittest import TestCase
+
+from .. import partitions
+
+
+class TestPartitions(TestCase):
+
+    def setUp(self):
+        # A history partition holding everything before May 2017, followed by monthly partitions for May and June.
+        self.partitions = [("events_with_value_history", None, datetime.datetime(2017, 5, 1)),
+                           ("events_with_value_p201705", datetime.datetime(2017, 5, 1), datetime.datetime(2017, 6, 1)),
+                           ("events_with_value_p201706", datetime.datetime(2017, 6, 1), datetime.datetime(2017, 7, 1))]
+        self.session = mock.Mock()
+
+    def test_month_start_rolls_over_into_the_next_year(self):
+        """Tests that the start of a month a number of months later is found across the end of a year."""
+        self.assertEqual(partitions.month_start(datetime.datetime(2017, 11, 15, 10), 2), datetime.datetime(2018, 1, 1),
+                         "Month two months after November was not January of the next year.")
+
+    @mock.patch.object(partitions, "is_partitioned", return_value=True)
+    def test_get_drop_cutoff_only_includes_partitions_ending_before_the_month_of_the_cutoff(self, is_partitioned):
+        """Tests that a cutoff partway through June only drops partitions that end by the start of June, so the rows
+        from the start of June to the cutoff are left to be deleted."""
+        with mock.patch.object(partitions, "get_partitions", return_value=self.partitions):
+            drop_cutoff = partitions.get_drop_cutoff(self.session, "events_with_value", datetime.datetime(2017, 6, 20))
+
+        self.assertEqual(drop_cutoff, datetime.datetime(2017, 6, 1), "Partitions were not dropped up to June.")
+
+    @mock.patch.object(partitions, "is_partitioned", return_value=False)
+    def test_get_drop_cutoff_is_none_for_tables_that_are_not_partitioned(self, is_partitioned):
+        """Tests that no partitions are dropped from a table that is not partitioned."""
+        self.assertIsNone(partitions.get_drop_cutoff(self.session, "events_with_value", datetime.datetime(2017, 6, 20)),
+                          "A drop cutoff was returned for an unpartitioned table.")
+
+    def test_create_future_partitions_continues_from_the_latest_partition(self):
+        """Tests that partitions are created for each month after the latest partition, up to the month holding the
+        given time."""
+        with mock.patch.object(partitions, "get_partitions", return_value=self.partitions), \
+                mock.patch.object(partitions, "get_default_partition", return_value=None):
+            created = partitions.create_future_partitions(self.session, "events_with_value",
+                                                          datetime.datetime(2017, 8, 1))
+
+        self.assertListEqual(created, [("events_with_value_p201707", 0), ("events_with_value_p201708", 0)],
+                             "Partitions were not created for July and August.")
+        self.assertIn("FOR VALUES FROM ('2017-07-01 00:00:00') TO ('2017-08-01 00:00:00')",
+                      self.session.execute.call_args_list[0][0][0], "July partition does not cover July.")
+
+    def test_create_future_partitions_moves_rows_out_of_the_default_partition(self):
+        """Tests that the DEFAULT partition is detached while a partition is created, that its rows in the new
+        partition's range are moved into the new partition, and that it is attached again afterwards."""
+        self.session.execute.return_value.rowcount = 3
+        with mock.patch.object(partitions, "get_partitions", return_value=self.partitions), \
+                mock.patch.object(partitions, "get_default_partition", return_value="events_with_value_default"):
+            created = partitions.create_future_partitions(self.session, "events_with_value",
+                                                          datetime.datetime(2017, 7, 1))
+
+        self.assertListEqual(created, [("events_with_value_p201707", 3)], "Moved rows were not counted.")
+        statements = [call[0][0] for call in self.session.execute.call_args_list]
+        self.assertEqual(statements[0], "ALTER TABLE events_with_value DETACH PARTITION events_with_value_default",
+                         "Default partition was not detached first.")
+        self.assertIn("DELETE FROM events_with_value_default WHERE time >= '2017-07-01 00:00:00' AND "
+                      "time < '2017-08-01 00:00:00'", statements[2], "July rows were not moved out of the default.")
+        self.assertEqual(statements[-1], "ALTER TABLE events_with_value ATTACH PARTITION events_with_value_default "
+                                         "DEFAULT", "Default partition was not attached again.")
+
+    def test_create_future_partitions_leaves_the_default_partition_when_none_are_needed(self):
+        """Tests that nothing is changed when the latest partition already covers the given time."""
+        with mock.patch.object(partitions, "get_partitions", return_value=self.partitions):
+            created = partitions.create_future_partitions(self.session, "events_with_value",
+                                                          datetime.datetime(2017, 6, 15))
+
+        self.assertListEqual(created, [], "Partitions were created when none were needed.")
+        self.session.execute.assert_not_called()
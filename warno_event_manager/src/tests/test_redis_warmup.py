@@ -0,0 +1,55 @@
+import mock
+import datetime
+
+from unittest import TestCase
+
+from .. import redis_warmup
+from ..redis_warmup import RedisWarmup
+
+
+class TestRedisWarmup(TestCase):
+
+    def setUp(self):
+        self.redint = mock.Mock()
+        self.redint.MAX_ENTRIES = 100
+        self.redint.backfill_values.return_value = 3
+        self.warmup = RedisWarmup(self.redint, workers=2)
+        self.app = mock.MagicMock()
+        self.session = mock.Mock()
+
+    def test_run_backfills_every_reference_and_reports_progress(self):
+        """Tests that event codes are loaded, each data reference is backfilled as a table or a single attribute, and
+        that a reference that fails is counted without stopping the rest."""
+        references = [(1, True, "prosensing_paf"), (1, False, "temperature"), (2, False, "voltage")]
+        self.session.execute.return_value.fetchall.return_value = references
+        self.session.execute.return_value.__iter__ = mock.Mock(return_value=iter([(3, "temperature")]))
+        self.redint.backfill_values.side_effect = [3, 3, Exception("Connection lost")]
+
+        with mock.patch.object(redis_warmup.schema_cache, "get_column_names", return_value=["packet_id", "voltage"]):
+            self.warmup.run(self.app, self.session)
+
+        self.redint.pipeline.return_value.add_event_code.assert_called_once_with(3, "temperature")
+        backfilled = sorted((call[0][0], tuple(call[0][1]), call[1].get("table_name"))
+                            for call in self.redint.backfill_values.call_args_list)
+        self.assertListEqual(backfilled, [(1, ("temperature",), None), (1, ("voltage",), "prosensing_paf"),
+                                          (2, ("voltage",), None)], "Every reference was not backfilled.")
+
+        progress = self.warmup.get_progress()
+        self.assertEqual(progress["status"], "finished", "Warm-up was not finished.")
+        self.assertEqual((progress["references"], progress["completed"], progress["failed"], progress["entries_added"]),
+                         (3, 3, 1, 6), "Progress '%s' does not match the references warmed up." % progress)
+
+    def test_fetch_rows_only_reads_rows_after_the_newest_held(self):
+        """Tests that rows are only read after the given time, newest first and limited to what Redis keeps, and are
+        returned oldest first."""
+        self.session.execute.return_value.fetchall.return_value = [("newer",), ("older",)]
+
+        rows = self.warmup._fetch_rows(self.session, "events_with_value", ["time", "value"],
+                                       "instrument_id = :instrument_id", dict(instrument_id=1),
+                                       datetime.datetime(2017, 1, 1))
+
+        query, parameters = self.session.execute.call_args[0]
+        self.assertIn("AND time > :after_time ORDER BY time DESC LIMIT :limit", query, "Query was not limited.")
+        self.assertEqual(parameters, dict(instrument_id=1, limit=100, after_time=datetime.datetime(2017, 1, 1)),
+                         "Query parameters were not as expected.")
+        self.assertListEqual(rows, [("older",), ("newer",)], "Rows were not returned oldest first.")
@@ -0,0 +1,42 @@
+import mock
+import datetime
+
+from unittest import TestCase
+
+from ..table_statistics import TableStatistics
+
+
+class TestTableStatistics(TestCase):
+
+    def setUp(self):
+        self.statistics = TableStatistics(["events_with_value"])
+        self.session = mock.Mock()
+        self.oldest = datetime.datetime(2017, 5, 1)
+        self.newest = datetime.datetime(2017, 6, 1)
+
+    def test_estimate_rows_reads_plan_returned_as_json_text(self):
+        """Tests that the row estimate is read from an EXPLAIN plan the driver returns as JSON text."""
+        self.session.execute.return_value.fetchone.return_value = ('[{"Plan": {"Plan Rows": 1500}}]',)
+
+        self.assertEqual(self.statistics._estimate_rows(self.session, "events_with_value"), 1500,
+                         "Row estimate was not read from the JSON text plan.")
+
+    def test_estimate_rows_reads_plan_returned_decoded(self):
+        """Tests that the row estimate is read from an EXPLAIN plan the driver has already decoded."""
+        self.session.execute.return_value.fetchone.return_value = ([{"Plan": {"Plan Rows": 1500}}],)
+
+        self.assertEqual(self.statistics._estimate_rows(self.session, "events_with_value"), 1500,
+                         "Row estimate was not read from the decoded plan.")
+
+    def test_refresh_replaces_statistics_for_every_table(self):
+        """Tests that a refresh stores the estimates and time range of each table, and records when it was done."""
+        self.assertListEqual(self.statistics.get_statistics(), [], "Statistics existed before the first refresh.")
+
+        with mock.patch.object(TableStatistics, "_estimate_rows", side_effect=[1500, 200]), \
+                mock.patch.object(TableStatistics, "_get_time_range", return_value=(self.oldest, self.newest)):
+            self.statistics.refresh(self.session, datetime.datetime(2017, 5, 15))
+
+        self.assertListEqual(self.statistics.get_statistics(),
+                             [dict(name="events_with_value", count=1500, cutoff_entries=200, oldest=self.oldest,
+                                   newest=self.newest)], "Refreshed statistics were not stored.")
+        self.assertIsNotNone(self.statistics.refreshed_time, "Refresh time was not recorded.")
@@ -4,9 +4,12 @@ import logging
 import psutil
 import json
 import os
+import time
+import threading
+import multiprocessing
 import dateutil.parser
 
-from flask import Flask, request, render_template
+from flask import Flask, request, render_template, g, has_app_context
 from flask_migrate import Migrate, upgrade
 from flask_migrate import migrate as db_migrate
 from flask_migrate import downgrade
@@ -14,10 +17,20 @@ from flask_migrate import downgrade
 from WarnoConfig import config
 from WarnoConfig import utility
 from WarnoConfig import redis_interface
+from WarnoConfig import rollups
+from WarnoConfig import schema_cache
+from WarnoConfig.spool import Spool
+from WarnoConfig.table_inserter import TableInserter
 from WarnoConfig.models import db
 from WarnoConfig.models import EventWithValue, EventWithText, ProsensingPAF, InstrumentDataReference, User
 from WarnoConfig.models import Instrument, Site, InstrumentLog, PulseCapture, EventCode
 
+import archiver
+import partitions
+from forwarder import CentralForwarder
+from lookup_cache import LookupCache
+from redis_warmup import RedisWarmup
+from table_statistics import TableStatistics
 
 # Set up logging
 LOG_PATH = os.environ.get("LOG_PATH")
@@ -89,7 +102,8 @@ app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql://%s:%s@%s:%s/%s' % (db_cfg[
                                                                          db_cfg['DB_NAME'])
 
 # Redis setup.  This whole setup section feels pretty wrong. Probably needs a dire rework.
-redint = redis_interface.RedisInterface()
+redint = redis_interface.RedisInterface(storage=config.get_string("redis.storage"))
+redis_warmup = RedisWarmup(redint, workers=config.get_int("redis.warmup_threads"))
 
 
 db.init_app(app)
@@ -99,11 +113,30 @@ migration_path = os.environ.get("MIGRATION_PATH")
 is_central = 0
 cf_url = ""
 cfg = None
+# Forwards saved events to the central facility in the background. Only set up for site event managers.
+forwarder = None
+# Worker processes that archive instruments, see 'start_archive_pool'.  Until it is started, instruments are archived
+# one at a time in this process.
+archive_pool = None
 
 headers = {'Content-Type': 'application/json'}
 
+# Inserters for the tables special events are saved to, which cache each table's columns and insert statements.
+special_table_inserters = {"prosensing_paf": TableInserter("prosensing_paf"),
+                           "iris_bite": TableInserter("iris_bite")}
+
 cert_verify = False
 
+# Event codes and instrument data references never change once created, so lookups of them are cached.  Event codes by
+# description, descriptions by event code, and the (instrument_id, description) pairs that have data references.
+event_code_cache = LookupCache(db_cfg['lookup_cache_size'])
+event_description_cache = LookupCache(db_cfg['lookup_cache_size'])
+data_reference_cache = LookupCache(db_cfg['lookup_cache_size'])
+
+# Statistics about the data tables shown on the home page, refreshed in the background.
+table_statistics = TableStatistics(["prosensing_paf", "iris_bite", "events_with_value", "events_with_text",
+                                    "instrument_logs", "pulse_captures"])
+
 
 def save_json_db_info():
     """Saves database tables containing more permanent information, such as sites or instruments, to a json file.
@@ -166,9 +199,7 @@ def save_json_db_info():
             definition = dict()
             definition['table_name'] = table
 
-            rows = db.session.execute("SELECT column_name, data_type FROM information_schema.columns "
-                                      "WHERE table_name = :table", dict(table=table)).fetchall()
-            definition['columns'] = [(row[0], row[1]) for row in rows]
+            definition['columns'] = schema_cache.get_columns(db.session, table)
 
             # Write the definition and start the data section, with its list of records
             json.dump(definition, datafile)
@@ -198,41 +229,27 @@ def save_json_db_info():
 
 @app.route("/eventmanager/archive_data")
 def save_json_db_data():
-    """Saves database tables containing data information, such as 'events_with_value' or 'prosensing_paf' events, to a
-    json file.  'num_entries' for each table specifies how many data rows are in the file for the table, making
-    iterative parsing much easier.
-
-    Example File (indentation unnecessary):
+    """Saves database tables containing data information, such as 'events_with_value' or 'prosensing_paf' events, to
+    gzip compressed newline delimited json files, one for each instrument, then deletes the saved data from the
+    database.  Instruments are archived at the same time by the worker processes of 'archive_pool', each running
+    'archiver.archive_instrument', or one at a time in this process if the pool was not started.
 
-    [
-        {
-            "definition":
-                {
-
-                    "table_name":
-                        *database table name*,
-
-                    "columns":
-                        [(column_name_1, column_type_1), ..., (column_name_N, column_type_N)]
+    Partitioned tables drop each monthly partition once every instrument's rows in it are archived, and only delete the
+    archived rows newer than the last dropped partition.  Other tables delete every archived row.
 
-                }
-
-            "data":
-                [
-                [val_1, val_2, ..., val_N],
-                [val_1, val_2, ..., val_N],
-                ...,
-                [val_1, val_2, ..., val_N] ]
-
-            },
-
-            { *table_2* },
-
-            ...,
+    Each table in a file starts with a line holding the table's definition, followed by one line for each of the
+    table's data rows.  'num_entries' for each table specifies how many data rows follow its definition.
 
-            { *table_N* }
+    Example File (uncompressed):
 
-        ]
+    {"definition": {"table_name": *database table name*, "columns": [[column_name_1, column_type_1], ...,
+                    [column_name_N, column_type_N]], "num_entries": *N rows*, "start_time": *time of first row*,
+                    "end_time": *time of last row*}}
+    [val_1, val_2, ..., val_N]
+    [val_1, val_2, ..., val_N]
+    ...
+    {"definition": { *table_2* }}
+    ...
 
     """
     # Get the cutoff time for the data.  Any data recorded before this time will be saved to json and deleted from the
@@ -243,12 +260,12 @@ def save_json_db_data():
     # File name format described next
     save_json_db_info()
 
-    # Each data file saved will use this extension, resulting in "*id*_archived_*day*_*month*_*year*.json".
+    # Each data file saved will use this extension, resulting in "*id*_archived_*day*_*month*_*year*.ndjson.gz".
     # For example, for an instrument id of 5, the filename would be "5_archived_30_12_1999", meaning all the data in the
     # archived file is dated on or before 30th of December, 1999
     filename_extension = "_archived_" + str(cutoff_time.day) + "_" + str(cutoff_time.month) + \
                          "_" + str(cutoff_time.year) + "_t_" + str(cutoff_time.hour) + "_" + \
-                         str(cutoff_time.minute) + ".json"
+                         str(cutoff_time.minute) + ".ndjson.gz"
 
     # Names of the tables to be saved.
     tables = ["prosensing_paf", "events_with_value", "events_with_text", "instrument_logs", "pulse_captures"]
@@ -257,104 +274,298 @@ def save_json_db_data():
     rows = db.session.execute("SELECT instrument_id FROM instruments").fetchall()
     instrument_ids = [row[0] for row in rows]
 
+    # Rows in partitions ending before these times are removed by dropping the partitions after archiving
+    partition_cutoffs = {}
+    for table in tables:
+        drop_cutoff = partitions.get_drop_cutoff(db.session, table, cutoff_time)
+        if drop_cutoff is not None:
+            partition_cutoffs[table] = drop_cutoff
+    db.session.commit()
+
+    # Worker processes connect to the database themselves, as connections can not be shared between processes
+    archive_arguments = [(app.config['SQLALCHEMY_DATABASE_URI'], instrument_id, tables, cutoff_time,
+                          str(instrument_id) + filename_extension, partition_cutoffs)
+                         for instrument_id in instrument_ids]
+    if archive_pool is not None:
+        results = [archive_pool.apply_async(archiver.archive_instrument, arguments) for arguments in archive_arguments]
+        for result in results:
+            EM_LOGGER.info("Archived data to '%s'", result.get())
+    else:
+        for arguments in archive_arguments:
+            EM_LOGGER.info("Archived data to '%s'", archiver.archive_instrument(*arguments))
+
+    # Every instrument has been archived, so the partitions holding only archived rows can be dropped
+    for table, drop_cutoff in partition_cutoffs.iteritems():
+        for name in partitions.drop_partitions_before(db.session, table, drop_cutoff):
+            EM_LOGGER.info("Dropped archived partition '%s'", name)
+    db.session.commit()
+
+    return "Finish"
+
+
+def start_archive_pool():
+    """Starts 'archive_pool', the 'archive_processes' worker processes (specified in *config.yml*) that instruments are
+    archived by.  It must be started before any other thread, as a process forked while another thread holds a lock,
+    such as a logging or connection pool lock, is left with that lock held forever.
+
+    """
+    global archive_pool
+    archive_pool = multiprocessing.Pool(db_cfg['archive_processes'])
+
+
+def update_all_rollups(start_time=None, end_time=None):
+    """Updates the hourly and daily attribute rollups of every instrument.  With no time range, each instrument's
+    rollups are brought up to the start of the current hour, continuing from 'rollup_lookback_hours' (specified in
+    *config.yml*) before they were last updated.  With a time range, every bucket in the range is recomputed, which can
+    be repeated safely, for example after loading archived data back into the database.
+
+    Parameters
+    ----------
+    start_time: datetime, optional
+        Start of the time range to recompute.
+
+    end_time: datetime, optional
+        End of the time range to recompute.
+
+    """
+    rows = db.session.execute("SELECT instrument_id FROM instruments").fetchall()
+    instrument_ids = [row[0] for row in rows]
+
+    rolled_up_until = rollups.floor_time(datetime.datetime.utcnow(), rollups.HOUR)
+    lookback = datetime.timedelta(hours=db_cfg['rollup_lookback_hours'])
+
+    # Each instrument is committed on its own so a long update does not hold every instrument's rollups locked
     for instrument_id in instrument_ids:
-        filename = str(instrument_id) + filename_extension
-        first_table = True
-        with open(filename, "w") as datafile:
-            # Begin the list of tables
-            datafile.write("[")
-            # Only prepend a comma separation if it is not the first table to be saved
-            for table in tables:
-                if not first_table:
-                    datafile.write(", ")
-                else:
-                    first_table = False
-                datafile.write('{\n"definition": ')
-
-                definition = dict()
-                definition['table_name'] = table
-
-                # List of (column_name, data_type) pairs to define the format of each data row
-                rows = db.session.execute("SELECT column_name, data_type FROM information_schema.columns WHERE table_name = :table",
-                                          dict(table=table)).fetchall()
-                definition['columns'] = [(row[0], row[1]) for row in rows]
-
-                # If there are any values to be saved, defines the oldest as the 'start_time' and the newest as the
-                # 'end_time'.  Together they allow anyone reading the file to easily get the time range of the values
-                rows = db.session.execute("SELECT time FROM %s WHERE instrument_id = :id ORDER BY time ASC LIMIT 1" % (table,),
-                                          dict(id=instrument_id)).fetchall()
-                if len(rows) > 0:
-                    # A little extra work to make the database time JSON serializable UTC
-                    definition['start_time'] = rows[0][0].isoformat() + "Z"
-                else:
-                    definition['start_time'] = None
+        if start_time is None:
+            rollups.update_rollups(db.session, instrument_id, rolled_up_until, lookback)
+        else:
+            rollups.refresh_rollups(db.session, instrument_id, start_time, end_time)
+        db.session.commit()
 
-                rows = db.session.execute("SELECT time FROM %s WHERE instrument_id = :id ORDER BY time DESC LIMIT 1" % (table,),
-                                          dict(id=instrument_id)).fetchall()
-                if len(rows) > 0:
-                    # A little extra work to make the database time JSON serializable UTC
-                    definition['end_time'] = rows[0][0].isoformat() + "Z"
-                else:
-                    definition['end_time'] = None
-
-                # Count the number of rows to be saved off.  Having this defined makes reading in the data easier
-                count = db.session.execute("SELECT count(*) FROM %s WHERE time < :time AND instrument_id = :id" % (table,),
-                                           dict(time=cutoff_time.isoformat(), id=instrument_id)).fetchall()[0][0]
-                definition['num_entries'] = count
-
-                # Write the definition and start the data section, with its list of records
-                json.dump(definition, datafile)
-                datafile.write(', "data": [')
-
-                offset = 0
-                chunk_size = 5000
-                first_record = True
-                while True:
-                    # Using offset and chunk_size in conjunction, retrieves and saves chunks of 5000 records at a time
-                    # Loop runs until no records are returned, then breaks
-                    rows = db.session.execute("SELECT * FROM %s WHERE time < :time AND instrument_id = :id ORDER BY time ASC OFFSET :offset LIMIT :chunk_size" % (table,),
-                                              dict(offset=offset, chunk_size=chunk_size, time=cutoff_time.isoformat(), id=instrument_id)).fetchall()
-                    if len(rows) <= 0:
-                        break
-
-                    # The data must be a list to update values by index
-                    data = [list(row) for row in rows]
-
-                    # Datetimes must be converted to iso compliant time format for json.dump
-                    # Different tables have time in different places
-                    if table in ["prosensing_paf", "instrument_logs"]:
-                        time_index = 1
-                    elif table == "pulse_captures":
-                        time_index = 2
-                    else:
-                        time_index = 3
-                    for item in data:
-                        item[time_index] = item[time_index].isoformat() + "Z"
-
-                    # Encode each data row into a JSON string
-                    data = [json.dumps(item) for item in data]
-
-                    # If the record is not the first, prepends a comma separation to separate the list elements.
-                    # The rows are joined by commas to make them JSON compliant
-                    if not first_record:
-                        msg = ", ".join(data)
-                        datafile.write(", %s" % msg)
-                    else:
-                        first_record = False
-                        msg = ", ".join(data)
-                        datafile.write(msg)
-
-                    offset += chunk_size
-                # Close the JSON for this table section
-                datafile.write("]}")
-                db.session.execute("DELETE FROM %s WHERE time < :time AND instrument_id = :id" % (table,),
-                                   dict(time=cutoff_time.isoformat(), id=instrument_id))
-                db.session.commit()
-            # Close the list of tables
-            datafile.write("]\n")
+
+@app.route("/eventmanager/update_rollups")
+def update_rollups():
+    """Updates the hourly and daily attribute rollups the User Portal reads attribute statistics from, using
+    'update_all_rollups'.  The rollups are also updated in the background every 'rollup_update_interval' seconds, so
+    this only needs to be called to recompute a time range.
+
+    Parameters
+    ----------
+    start: string, optional
+        Passed as an HTML query parameter, the start of the time range to recompute.  Needs 'end'.
+
+    end: string, optional
+        Passed as an HTML query parameter, the end of the time range to recompute.
+
+    """
+    start = request.args.get("start")
+    end = request.args.get("end")
+    if start and end:
+        update_all_rollups(rollups.to_utc(dateutil.parser.parse(start)), rollups.to_utc(dateutil.parser.parse(end)))
+    else:
+        update_all_rollups()
 
     return "Finish"
 
+
+def create_future_partitions():
+    """Creates the monthly partitions of every partitioned data table needed to hold data up to
+    'partition_months_ahead' months (specified in *config.yml*) from now.  Does nothing for tables that are not
+    partitioned, such as on databases older than Postgres 11.
+
+    """
+    until_time = partitions.month_start(datetime.datetime.utcnow(), db_cfg['partition_months_ahead'])
+    for table in partitions.PARTITIONED_TABLES:
+        if partitions.is_partitioned(db.session, table):
+            for name, moved_rows in partitions.create_future_partitions(db.session, table, until_time):
+                EM_LOGGER.info("Created partition '%s'", name)
+                if moved_rows:
+                    EM_LOGGER.warning("Moved %s rows timed beyond the monthly partitions from the default partition "
+                                      "into '%s'", moved_rows, name)
+    db.session.commit()
+
+
+def refresh_table_statistics():
+    """Refreshes the data table statistics shown on the Event Manager home page."""
+    cutoff_time = datetime.datetime.now() + datetime.timedelta(-db_cfg['days_retained'])
+    table_statistics.refresh(db.session, cutoff_time)
+    db.session.commit()
+
+
+def run_periodically(task, interval):
+    """Runs a task inside the application context every 'interval' seconds, forever, logging any error the task raises
+    rather than stopping.  Run in a daemon thread started with the Event Manager.
+
+    Parameters
+    ----------
+    task: function
+        Function to run, taking no arguments.
+
+    interval: integer
+        Seconds between runs.
+
+    """
+    while True:
+        try:
+            with app.app_context():
+                task()
+        except Exception, e:
+            EM_LOGGER.error("Failed to run '%s': %s", task.__name__, e)
+        time.sleep(interval)
+
+
+def current_ingest_batch():
+    """Returns the ingest batch being processed by the current request, if there is one.
+
+    Returns
+    -------
+    batch: dict or None
+        The batch state set up by 'events', holding the Redis pipeline of the event being processed under 'redis' and
+        the lookups to cache once the batch commits under 'cache_writes', or None if the current request is not a
+        batch.
+
+    """
+    if has_app_context():
+        return getattr(g, 'ingest_batch', None)
+    return None
+
+
+def redis_writer():
+    """Returns the Redis interface that writes for the current request should go through.  Inside an ingest batch this
+    is the pipeline of the event being processed, which is moved onto the batch's pipeline once the event is saved, so
+    that all of the batch's Redis writes are sent in one round trip once the database transaction has committed.  Reads
+    must always go through 'redint' directly.
+
+    Returns
+    -------
+    interface: RedisInterface
+        Either the event's pipelined interface or the shared 'redint'.
+
+    """
+    batch = current_ingest_batch()
+    if batch is not None:
+        return batch['redis']
+    return redint
+
+
+def cache_after_commit(cache, key, value):
+    """Caches a lookup for something the current request created, once it is in the database.  Outside an ingest
+    batch the request has already committed it.  Inside a batch it is cached once the batch commits, and not at all if
+    the event that created it is rolled back.
+
+    Parameters
+    ----------
+    cache: LookupCache
+        Cache to add the entry to.
+
+    key: hashable
+        Key to cache the value under.
+
+    value: object
+        Value to cache.
+
+    """
+    batch = current_ingest_batch()
+    if batch is not None:
+        batch['cache_writes'].append((cache, key, value))
+    else:
+        cache.set(key, value)
+
+
+def forward_after_commit(msg):
+    """Forwards an event on to the central facility once it is saved.  Outside an ingest batch the request has already
+    committed it.  Inside a batch it is forwarded once the batch commits, and not at all if the event is rolled back.
+
+    Parameters
+    ----------
+    msg: JSON string
+        The event packet, exactly as it should be sent to the central facility.
+
+    """
+    batch = current_ingest_batch()
+    if batch is not None:
+        batch['forwards'].append(msg)
+    else:
+        forwarder.enqueue(msg)
+
+
+def reset_db_keys_after_commit():
+    """Resets the database's primary key sequences (see 'utility.reset_db_keys') once rows inserted with explicit ids
+    are committed, as the reset runs in its own connection and can not see uncommitted rows.  Inside an ingest batch
+    the reset happens once, after the batch commits.
+
+    """
+    batch = current_ingest_batch()
+    if batch is not None:
+        batch['reset_db_keys'] = True
+    else:
+        utility.reset_db_keys()
+
+
+def get_event_description(event_code):
+    """Returns the description of an event code, which is the name of the attribute its events are saved under.
+    Looked up in Redis the first time each event code is asked for, and cached afterwards.
+
+    Parameters
+    ----------
+    event_code: integer
+        The event code.
+
+    Returns
+    -------
+    description: string or None
+        The event code's description, or None if it is not known.
+
+    """
+    description = event_description_cache.get(event_code)
+    if description is None:
+        description = redint.get_attribute_by_event_code(event_code)
+        if description is not None:
+            event_description_cache.set(event_code, description)
+    return description
+
+
+def commit_session():
+    """Commits the database session, unless the current request is an ingest batch.  Batches commit every event in one
+    transaction at the end of the batch, so inside a batch the session is only flushed, surfacing any errors for the
+    event currently being processed.
+
+    """
+    if current_ingest_batch() is not None:
+        db.session.flush()
+    else:
+        db.session.commit()
+
+
+def get_event_handler(msg_event_code):
+    """Returns the function that handles events with the given event code.  Codes that are not part of the predefined
+    set of special event codes are handled as miscellaneous events by 'save_misc_event'.
+
+    Parameters
+    ----------
+    msg_event_code: integer
+        Event code of the message to be handled.
+
+    Returns
+    -------
+    handler: function
+        Function taking the raw message and its decoded dictionary, returning the response for the event.
+
+    """
+    EVENT_ROUTING_TABLE = {
+        utility.EVENT_CODE_REQUEST:     new_event,
+        utility.SITE_ID_REQUEST:        get_site_id,
+        utility.INSTRUMENT_ID_REQUEST:  get_instrument_id,
+        utility.PULSE_CAPTURE:          save_pulse_capture,
+        utility.INSTRUMENT_LOG:         save_instrument_log,
+        utility.PROSENSING_PAF:         save_special_event,
+        utility.IRIS_BITE:              save_special_event,
+    }
+
+    # The save_misc_event is the default value if the event_code does not exist in the table.
+    return EVENT_ROUTING_TABLE.get(msg_event_code, save_misc_event)
+
+
 def new_event(msg, msg_struct):
     """ Register a new event
 
@@ -392,18 +603,74 @@ def event():
 
     msg_event_code = msg_struct['event_code']
 
-    EVENT_ROUTING_TABLE = {
-        utility.EVENT_CODE_REQUEST:     new_event,
-        utility.SITE_ID_REQUEST:        get_site_id,
-        utility.INSTRUMENT_ID_REQUEST:  get_instrument_id,
-        utility.PULSE_CAPTURE:          save_pulse_capture,
-        utility.INSTRUMENT_LOG:         save_instrument_log,
-        utility.PROSENSING_PAF:         save_special_event,
-        utility.IRIS_BITE:              save_special_event,
-    }
+    return get_event_handler(msg_event_code)(msg, msg_struct)
 
-    # The save_misc_event is the default value if the event_code does not exist in the table.
-    return EVENT_ROUTING_TABLE.get(msg_event_code, save_misc_event)(msg, msg_struct)
+
+@app.route("/eventmanager/events", methods=['POST'])
+def events():
+    """Batched version of 'event'.  The request is a JSON list of event packets, each of the same form accepted by
+    'event', and each is routed to the same handler 'event' would use.  Every event is saved inside its own savepoint of
+    a single database transaction, which is committed once for the whole batch, and every Redis write is buffered into
+    one pipeline that is sent after that commit.  An event that fails is rolled back to its savepoint without affecting
+    the rest of the batch, and none of its Redis writes are sent.
+
+    Returns
+    -------
+    message: JSON list
+        One entry per event, in the order received, of the form {"index": *position in batch*, "event_code": *code*,
+        "status": *"OK" or "ERROR"*, "response": *handler response, or error message on failure*}.
+
+    """
+    msg_structs = json.loads(request.data)
+
+    results = []
+    batch_redis = redint.pipeline()
+    g.ingest_batch = dict(redis=None, cache_writes=[], forwards=[], reset_db_keys=False)
+    try:
+        for index, msg_struct in enumerate(msg_structs):
+            if not isinstance(msg_struct, dict):
+                EM_LOGGER.error("Event %s of batch is not an event packet: %s", index, msg_struct)
+                results.append(dict(index=index, event_code=None, status="ERROR",
+                                    response="Event is not a JSON object"))
+                continue
+
+            msg_event_code = msg_struct.get('event_code')
+            savepoint = db.session.begin_nested()
+            cache_write_count = len(g.ingest_batch['cache_writes'])
+            forward_count = len(g.ingest_batch['forwards'])
+            # The event's Redis writes are kept apart until its savepoint commits, as the commit can still fail.
+            g.ingest_batch['redis'] = redint.pipeline()
+            try:
+                response = get_event_handler(msg_event_code)(json.dumps(msg_struct), dict(msg_struct))
+                savepoint.commit()
+                batch_redis.extend(g.ingest_batch['redis'])
+            except Exception, e:
+                savepoint.rollback()
+                # Nothing the failed event created was saved, so none of it is written to Redis, cached or forwarded
+                del g.ingest_batch['cache_writes'][cache_write_count:]
+                del g.ingest_batch['forwards'][forward_count:]
+                EM_LOGGER.error("Failed to save event %s of batch: %s", index, e)
+                results.append(dict(index=index, event_code=msg_event_code, status="ERROR", response=str(e)))
+                continue
+
+            # Handlers return either a response body or a (body, status) pair.
+            if isinstance(response, tuple):
+                response = response[0]
+            results.append(dict(index=index, event_code=msg_event_code, status="OK", response=response))
+
+        db.session.commit()
+        if g.ingest_batch['reset_db_keys']:
+            utility.reset_db_keys()
+        batch_redis.execute()
+        for cache, key, value in g.ingest_batch['cache_writes']:
+            cache.set(key, value)
+        for msg in g.ingest_batch['forwards']:
+            forwarder.enqueue(msg)
+    finally:
+        g.ingest_batch = None
+
+    EM_LOGGER.info("Saved batch of %s events", len(results))
+    return json.dumps(results)
 
 
 def save_misc_event(msg, msg_struct):
@@ -430,12 +697,12 @@ def save_misc_event(msg, msg_struct):
         event_wv.value = float_value
 
         db.session.add(event_wv)
-        db.session.commit()
+        commit_session()
 
         # Add the entry to the Redis database.
-        attribute_name = redint.get_attribute_by_event_code(msg_event_code)
-        redint.add_values_for_attribute(event_wv.instrument_id, attribute_name,
-                                        dateutil.parser.parse(timestamp), float_value)
+        attribute_name = get_event_description(msg_event_code)
+        redis_writer().add_values_for_attribute(event_wv.instrument_id, attribute_name,
+                                                dateutil.parser.parse(timestamp), float_value)
         EM_LOGGER.info("Saved Value Event")
     except ValueError:
         event_wt = EventWithText()
@@ -445,17 +712,16 @@ def save_misc_event(msg, msg_struct):
         event_wt.text = msg_struct['data']['value']
 
         db.session.add(event_wt)
-        db.session.commit()
+        commit_session()
 
         # Add the entry to the Redis database.
-        attribute_name = redint.get_attribute_by_event_code(msg_event_code)
-        redint.add_values_for_attribute(event_wt.instrument_id, attribute_name,
-                                        dateutil.parser.parse(timestamp), msg_struct['data']['value'])
+        attribute_name = get_event_description(msg_event_code)
+        redis_writer().add_values_for_attribute(event_wt.instrument_id, attribute_name,
+                                                dateutil.parser.parse(timestamp), msg_struct['data']['value'])
         EM_LOGGER.info("Saved Text Event")
     # If application is at a site instead of the central facility, passes data on to be saved at central facility
     if not is_central:
-        payload = json.loads(msg)
-        requests.post(cf_url, json=payload, headers=headers, verify=cert_verify)
+        forward_after_commit(msg)
 
     return "", 200
 
@@ -485,43 +751,31 @@ def save_special_event(msg, msg_struct):
     else:
         table_name = "prosensing_paf"  # A default that should never be reached
 
-    sql_query_a = "INSERT INTO %s(time, site_id, instrument_id" % table_name
-    sql_query_b = ") VALUES ('%s', %s, %s" % (timestamp, msg_struct['data']['site_id'],
-                                              msg_struct['data']['instrument_id'])
+    row = dict(msg_struct['data']['values'])
+    row.update(time=timestamp, site_id=msg_struct['data']['site_id'],
+               instrument_id=msg_struct['data']['instrument_id'])
+    # The inserter handles conversion of the values for the database, including saving infinities as NULL
+    special_table_inserters[table_name].insert(db.session, row)
+    commit_session()
+
     redis_attributes = []
     redis_values = []
     for key, value in msg_struct['data']['values'].iteritems():
-        sql_query_a = ', '.join([sql_query_a, key])
-        # Converts inf and -inf to Postgresql equivalents
-
         # Add Redis attribute
         redis_attributes.append(key)
-        if "-inf" in str(value) or "inf" in str(value) or "-Inf" in str(value) or "Inf" in str(value):
-            sql_query_b = ', '.join([sql_query_b, "NULL"])
-
+        if "inf" in str(value) or "Inf" in str(value):
             # Add value to list of Redis values to save
             redis_values.append("NULL")
         else:
-            try:
-                float(value)
-                sql_query_b = ', '.join([sql_query_b, "%s" % value])
-            except ValueError:
-                sql_query_b = ', '.join([sql_query_b, "'%s'" % value.rstrip('\x00')])
-
             # Add value to list of Redis values to save
             redis_values.append(value)
-    sql_query = ''.join([sql_query_a, sql_query_b, ")"])
-
-    db.session.execute(sql_query)
-    db.session.commit()
 
     # Save values to Redis
-    redint.add_value_set_for_table_attributes(msg_struct["data"]["instrument_id"], redis_attributes,
-                                              dateutil.parser.parse(timestamp), redis_values, table_name)
+    redis_writer().add_value_set_for_table_attributes(msg_struct["data"]["instrument_id"], redis_attributes,
+                                                      dateutil.parser.parse(timestamp), redis_values, table_name)
 
     if not is_central:
-        payload = json.loads(msg)
-        requests.post(cf_url, json=payload, headers=headers, verify=cert_verify)
+        forward_after_commit(msg)
     return "OK"
 
 
@@ -549,7 +803,7 @@ def save_instrument_log(msg, msg_struct):
     new_log.supporting_images = msg_struct['data']['supporting_images']
 
     db.session.add(new_log)
-    db.session.commit()
+    commit_session()
 
     return "OK"
 
@@ -578,11 +832,10 @@ def save_pulse_capture(msg, msg_struct):
     new_pulse.data = msg_struct['data']['values']
 
     db.session.add(new_pulse)
-    db.session.commit()
+    commit_session()
 
     if not is_central:
-        payload = json.loads(msg)
-        requests.post(cf_url, json=payload, headers=headers, verify=cert_verify)
+        forward_after_commit(msg)
     return "OK"
 
 
@@ -647,8 +900,8 @@ def get_instrument_id(msg, msg_struct):
             new_instrument.description = cf_data['description']
 
             db.session.add(new_instrument)
-            db.session.commit()
-            utility.reset_db_keys()
+            commit_session()
+            reset_db_keys_after_commit()
 
             EM_LOGGER.info("Saved New Instrument")
             return '{"event_code": %i, "data": {"instrument_id": %s, "site_id": %s, "name_short": "%s", ' \
@@ -720,8 +973,8 @@ def get_site_id(msg, msg_struct):
             new_site.location_name = cf_data['location_name']
 
             db.session.add(new_site)
-            db.session.commit()
-            utility.reset_db_keys()
+            commit_session()
+            reset_db_keys_after_commit()
 
             EM_LOGGER.info("Saved New Site")
             return '{"event_code": %i, "data": {"site_id": %s, "name_short": "%s", "name_long": "%s", ' \
@@ -737,7 +990,8 @@ def save_instrument_data_reference(msg_struct):
     instrument (some events are for all instruments, some only for specific instrument types).  If an instrument data
     reference is to be added, this function also determines whether the reference is 'special' or not.  If there is an
     entire special table devoted to the event (where 'description' is the table name), then it is classified as
-    'special'.
+    'special'.  References known to exist are cached in 'data_reference_cache', so they are only looked up in the
+    database the first time.
 
     Parameters
     ----------
@@ -745,15 +999,19 @@ def save_instrument_data_reference(msg_struct):
         Decoded version of msg, converted to python dictionary.
 
     """
+    reference_key = (msg_struct['data']['instrument_id'], msg_struct['data']['description'])
+    if data_reference_cache.get(reference_key):
+        return
+
     db_refs = db.session.query(InstrumentDataReference)\
         .filter(InstrumentDataReference.instrument_id == msg_struct['data']['instrument_id'])\
         .filter(InstrumentDataReference.description == msg_struct['data']['description']).all()
-    if not db_refs:
+    if db_refs:
+        data_reference_cache.set(reference_key, True)
+    else:
         special = "false"
         # "special" indicates whether this particular data description has its own table
-        rows = db.session.execute('''SELECT column_name FROM information_schema.columns WHERE table_name = :table''',
-                                  dict(table=msg_struct['data']['description'])).fetchall()
-        if rows:
+        if schema_cache.table_exists(db.session, msg_struct['data']['description']):
             special = "true"
         new_instrument_data_ref = InstrumentDataReference()
         new_instrument_data_ref.instrument_id = msg_struct['data']['instrument_id']
@@ -761,7 +1019,8 @@ def save_instrument_data_reference(msg_struct):
         new_instrument_data_ref.special = special
 
         db.session.add(new_instrument_data_ref)
-        db.session.commit()
+        commit_session()
+        cache_after_commit(data_reference_cache, reference_key, True)
         EM_LOGGER.info("Saved new instrument data reference")
 
 
@@ -769,7 +1028,8 @@ def get_event_code(msg, msg_struct):
     """Searches the database for any event codes where the description matches 'msg_struct['description']'.  If the
     'is_central' flag is set and there is no event code, creates the event code in the database and returns it. If the
     'is_central' flag is not set, it then forwards the packet on to the 'cf_url' (both specified in *config.yml*) and
-    returns whatever the central facility determines the event code is.
+    returns whatever the central facility determines the event code is.  Event codes are cached in 'event_code_cache'
+    once found or created, so each description is only looked up in the database the first time.
 
     Parameters
     ----------
@@ -785,12 +1045,19 @@ def get_event_code(msg, msg_struct):
 
     """
 
-    db_code = db.session.query(EventCode).filter(EventCode.description == msg_struct['data']['description']).first()
+    description = msg_struct['data']['description']
+    cached_code = event_code_cache.get(description)
+    if cached_code is None:
+        db_code = db.session.query(EventCode.event_code).filter(EventCode.description == description).first()
+        if db_code:
+            cached_code = db_code[0]
+            event_code_cache.set(description, cached_code)
+            event_description_cache.set(cached_code, description)
+
     # If the event code defined here, return it downstream
-    if db_code:
+    if cached_code is not None:
         EM_LOGGER.info("Found Existing Event Code")
-        return '{"event_code": %i, "data": {"description": "%s"}}' % (
-            db_code.event_code, msg_struct['data']['description'])
+        return '{"event_code": %i, "data": {"description": "%s"}}' % (cached_code, description)
 
     # If it is not defined at the central facility, inserts a new entry into the table and returns the new code
     elif is_central:
@@ -808,9 +1075,11 @@ def get_event_code(msg, msg_struct):
         new_ec.description = msg_struct['data']['description']
 
         db.session.add(new_ec)
-        db.session.commit()
+        commit_session()
 
-        redint.add_event_code(new_ec.event_code, new_ec.description)
+        redis_writer().add_event_code(new_ec.event_code, new_ec.description)
+        cache_after_commit(event_code_cache, new_ec.description, new_ec.event_code)
+        cache_after_commit(event_description_cache, new_ec.event_code, new_ec.description)
 
         new_event_code = db.session.query(EventCode.event_code).filter(
                 EventCode.description == msg_struct['data']['description']).first()[0]
@@ -830,10 +1099,12 @@ def get_event_code(msg, msg_struct):
         new_ec.description = cf_msg['data']['description']
 
         db.session.add(new_ec)
-        db.session.commit()
-        utility.reset_db_keys()
+        commit_session()
+        reset_db_keys_after_commit()
 
-        redint.add_event_code(new_ec.event_code, new_ec.description)
+        redis_writer().add_event_code(new_ec.event_code, new_ec.description)
+        cache_after_commit(event_code_cache, new_ec.description, new_ec.event_code)
+        cache_after_commit(event_description_cache, new_ec.event_code, new_ec.description)
 
         EM_LOGGER.info("Saved Event Code")
         return '{"event_code": %i, "data": {"description": "%s"}}' % (
@@ -892,6 +1163,8 @@ def initialize_database():
             db.session.commit()
 
         upgrade(directory=migration_path)
+        schema_cache.invalidate()
+        create_future_partitions()
         # trigger_migration_migrate(migration_path)
         # db_migrate(directory=migration_path) # These functions can be used instead of upgrade for Flask Migrate
         # downgrade(directory=migration_path)
@@ -906,7 +1179,8 @@ def initialize_database():
             db_user = User.query.first()
             if db_user is None:
                 utility.load_dumpfile()
-                clear_and_populate_redis()
+                # Anything Redis holds came from the database that was replaced, and the warm-up would keep it
+                redint.clear_database()
 
         # Then if there are still no users, assume the database is empty and populate the basic information
         db_user = User.query.first()
@@ -952,7 +1226,7 @@ def initialize_database():
                 else:
                     EM_LOGGER.info("%ss in table.", table)
 
-            clear_and_populate_redis()
+            redint.clear_database()
         else:
             EM_LOGGER.info("Config not set to development test database, not populating demo data. ")
 
@@ -960,119 +1234,68 @@ def initialize_database():
         utility.reset_db_keys()
 
 
-def clear_and_populate_redis():
-    """Completely wipes the Redis database, then loads recent entries and event codes from the main database into Redis.
+def warm_up_redis():
+    """Brings Redis up to date with the database, adding only the entries it is missing.  Run in the background once
+    the database is initialized, while the Event Manager saves new events.  Progress is reported by
+    'redis_warmup_progress'.
+    """
+    try:
+        redis_warmup.run(app, db.session)
+    except Exception, e:
+        EM_LOGGER.error("Failed to warm up Redis: %s", e)
+
+
+@app.route("/eventmanager/redis_warmup")
+def redis_warmup_progress():
+    """Reports the progress of the Redis warm-up started when the Event Manager started.
+
+    Returns
+    -------
+    progress: JSON
+        Dictionary of the form {"status": *"waiting", "running", or "finished"*, "references": *data references to
+        warm up*, "completed": *data references done*, "failed": *data references that failed*, "entries_added":
+        *entries written to Redis*, "started_time": *ISO DateTime or null*, "finished_time": *ISO DateTime or null*}
 
-        This is mostly only called after loading in test data, or loading a database file.
     """
-    redint.clear_database()
-
-    references = db.session.query(InstrumentDataReference).all()
-
-    # Lists of data passed into the Redis interface must be ordered from oldest to most recent, which may require
-    # reordering list of data before passing it in.
-    for reference in references:
-        # For special tables, utilize bulk insertion functionality
-        if reference.special:
-            # Get a list of all possible columns for the particular table.
-            rows = db.session.execute("SELECT column_name FROM information_schema.columns WHERE table_name = :table",
-                                      dict(table=reference.description)).fetchall()
-            # Because time is needed for specific parts of this function, force it to always be the first element.
-            # Some columns necessary to the main database are irrelevant to the Redis database.
-            columns = ["time"] + [row[0] for row in rows if row[0] not in ["packet_id", "site_id", "time"]]
-            sql_column_string = ",".join(columns)
-
-            # Get the most recent values from the main database.
-            sql_query = ("SELECT %s FROM %s WHERE instrument_id=:instrument_id ORDER BY time DESC LIMIT :limit"
-                         % (sql_column_string, reference.description))
-            db_result = db.session.execute(sql_query, dict(instrument_id=reference.instrument_id,
-                                                           limit=redint.MAX_ENTRIES)).fetchall()
-            if db_result:
-                # add_values_for_attribute assumes the list of values is sorted oldest to newest, which is the opposite
-                # of the resulting list from the database call.  Therefore all lists passed should be reversed first.
-                reversed_result = [ x for x in reversed(db_result)]
-                time_list = [row[0] for row in reversed_result]
-                temp_group = []
-                # Need to rearrange entries into the format expected by the Redis interface.
-                for index in xrange(1, len(columns)):
-                    temp_group.append([row[index] if row[index] is not None else "NULL"
-                                                              for row in reversed_result])
-                # Don't pass the first entry in 'columns' as it is 'time', which already has its own list passed.
-                redint.bulk_insert_values_for_table_attributes(reference.instrument_id, columns[1:], time_list,
-                                                               temp_group, table_name="prosensing_paf")
-        else:
-            # There is a general assumption that there really shouldn't be an EventWithText and an EventWithValue with
-            # the same attribute name.  Otherwise one or the other could be overwritten here.
-            event_code = (db.session.query(EventCode.event_code)
-                          .filter(EventCode.description == reference.description).first())
-
-            events_with_text = (db.session.query(EventWithText)
-                                .filter(EventWithText.event_code_id == event_code)
-                                .filter(EventWithText.instrument_id == reference.instrument_id)
-                                .order_by(EventWithText.time.desc())
-                                .limit(redint.MAX_ENTRIES).all())
-            events_with_value = (db.session.query(EventWithValue)
-                                 .filter(EventWithValue.event_code_id == event_code)
-                                .filter(EventWithValue.instrument_id == reference.instrument_id)
-                                 .order_by(EventWithValue.time.desc())
-                                 .limit(redint.MAX_ENTRIES).all())
-
-            if len(events_with_text) > 0:
-                event_times = [event.time for event in reversed(events_with_value)]
-                event_values = [event.value for event in reversed(events_with_value)]
-                redint.add_values_for_attribute(reference.instrument_id, reference.description,
-                                                event_times, event_values)
-
-            if len(events_with_value) > 0:
-                event_times = [event.time for event in reversed(events_with_value)]
-                event_values = [event.value for event in reversed(events_with_value)]
-                redint.add_values_for_attribute(reference.instrument_id, reference.description,
-                                                event_times, event_values)
-
-    # Load event codes into Redis.
-    db_event_codes = db.session.query(EventCode).all()
-    for db_ec in db_event_codes:
-        redint.add_event_code(db_ec.event_code, db_ec.description)
+    return json.dumps(redis_warmup.get_progress())
+
 
 @app.route('/eventmanager')
 def event_manager_home():
     """Calculates very basic information (cpu usage, site name) and passes the information to a template, serving as
-    a home page for the event manager.
+    a home page for the event manager.  The data table statistics are read from 'table_statistics', which is refreshed
+    in the background every 'table_statistics_interval' seconds (specified in *config.yml*), rather than from the
+    tables themselves.
 
     Returns
     -------
     index.html: HTML document
 
     """
-    table_stats = []
-    data_tables = ["prosensing_paf", "iris_bite", "events_with_value", "events_with_text", "instrument_logs", "pulse_captures"]
-
     cutoff_time = datetime.datetime.now() + datetime.timedelta(-db_cfg['days_retained'])
 
-    for table in data_tables:
-        table_stat_name = table
-
-        # Total entry count in table
-        entry_count = db.session.execute("SELECT count(*) from %s" % table).first()[0]
-        # Number of entries that are beyond the cutoff date (if data is archived, number of entries archived)
-        cutoff_entries = db.session.execute("SELECT count(*) from %s WHERE time < :cutoff_time" % table,
-                                            dict(cutoff_time=cutoff_time.isoformat())).first()[0]
-
-        oldest_entry = db.session.execute("SELECT time from %s ORDER BY time ASC" % table).first()
+    # Only gathered here before the background refresh has run for the first time
+    if table_statistics.refreshed_time is None:
+        refresh_table_statistics()
 
-        if oldest_entry is not None:
-            oldest_entry = oldest_entry[0].strftime("%d-%m-%Y %H:%M")
-
-        table_stats.append(dict(name=table_stat_name, count=int(entry_count), oldest=oldest_entry,
-                                cutoff_entries=int(cutoff_entries)))
+    table_stats = []
+    for table_stat in table_statistics.get_statistics():
+        table_stat = dict(table_stat)
+        for time_key in ("oldest", "newest"):
+            if table_stat[time_key] is not None:
+                table_stat[time_key] = table_stat[time_key].strftime("%d-%m-%Y %H:%M")
+        table_stats.append(table_stat)
 
     return render_template('index.html', usage=psutil.cpu_percent(), site=os.environ.get('SITE'),
                            days_retained=db_cfg['days_retained'], cutoff_time=cutoff_time.strftime("%d-%m-%Y %H:%M"),
-                           table_stats=table_stats)
+                           table_stats=table_stats,
+                           stats_time=table_statistics.refreshed_time.strftime("%d-%m-%Y %H:%M"))
 
 
 if __name__ == '__main__':
     cfg = config.get_config_context()
+    # Forked before the forwarder and the background threads start, see 'start_archive_pool'.
+    start_archive_pool()
 
     if cfg['type']['central_facility']:
         is_central = 1
@@ -1080,7 +1303,40 @@ if __name__ == '__main__':
         cf_url = cfg['setup']['cf_url']
         cert_verify = cfg['setup']['cert_verify']
 
+        forwarding_cfg = cfg['forwarding']
+        forwarder_spool = Spool(forwarding_cfg['spool_path'], max_bytes=forwarding_cfg['spool_max_bytes'],
+                                drop_policy=forwarding_cfg['spool_drop_policy'])
+        forwarder = CentralForwarder(cfg['setup']['cf_batch_url'], forwarder_spool,
+                                     batch_size=forwarding_cfg['batch_size'],
+                                     buffer_size=forwarding_cfg['buffer_size'],
+                                     max_retry_interval=forwarding_cfg['max_retry_interval'],
+                                     cert_verify=cert_verify)
+        forwarder.start()
+
     initialize_database()
 
+    warmup_thread = threading.Thread(target=warm_up_redis, name="RedisWarmup")
+    warmup_thread.daemon = True
+    warmup_thread.start()
+
+    rollup_thread = threading.Thread(target=run_periodically,
+                                     args=(update_all_rollups, db_cfg['rollup_update_interval']), name="RollupUpdater")
+    rollup_thread.daemon = True
+    rollup_thread.start()
+
+    partition_thread = threading.Thread(target=run_periodically,
+                                        args=(create_future_partitions, db_cfg['partition_update_interval']),
+                                        name="PartitionCreator")
+    partition_thread.daemon = True
+    partition_thread.start()
+
+    statistics_thread = threading.Thread(target=run_periodically,
+                                         args=(refresh_table_statistics, db_cfg['table_statistics_interval']),
+                                         name="TableStatistics")
+    statistics_thread.daemon = True
+    statistics_thread.start()
+
     EM_LOGGER.info("Starting Event Manager")
-    app.run(host='0.0.0.0', port=cfg['setup']['event_manager_port'], debug=True)
+    # The reloader would run all of the above again in a second process, starting a second forwarder on the same spool
+    # and a second copy of every background thread.
+    app.run(host='0.0.0.0', port=cfg['setup']['event_manager_port'], debug=True, use_reloader=False)
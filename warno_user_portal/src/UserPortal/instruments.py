@@ -1,5 +1,8 @@
 import os
 import json
+import math
+import heapq
+import numbers
 import logging
 import ciso8601
 import base64
@@ -11,11 +14,15 @@ from flask_user import current_user
 from sqlalchemy.sql import func
 from sqlalchemy import asc
 
+from WarnoConfig import config
 from WarnoConfig import redis_interface
+from WarnoConfig import rollups
+from WarnoConfig import schema_cache
 from WarnoConfig.utility import status_code_to_text, is_number
 from WarnoConfig.models import db
 from WarnoConfig.models import Instrument, ProsensingPAF, PulseCapture, InstrumentLog, Site, InstrumentLink
 from WarnoConfig.models import InstrumentDataReference, EventCode, EventWithValue, ValidColumn
+from WarnoConfig.models import AttributeRollup, RollupProgress
 
 
 instruments = Blueprint('instruments', __name__, template_folder='templates')
@@ -30,6 +37,27 @@ up_handler = logging.FileHandler("%suser_portal_server.log" % log_path, mode="a"
 up_handler.setFormatter(logging.Formatter('%(levelname)s:%(asctime)s:%(module)s:%(lineno)d:  %(message)s'))
 up_logger.addHandler(up_handler)
 
+redis_cfg = config.get_config_context()['redis']
+
+
+def get_redis_interface():
+    """Returns a RedisInterface using this worker process's shared connection pool, configured by the 'redis' section
+    of *config.yml*, so that requests reuse connections rather than each opening a new one.
+
+    Returns
+    -------
+    redint: RedisInterface
+        Interface to the Redis server.
+
+    """
+    pool = redis_interface.get_process_connection_pool(host=redis_cfg['host'], port=redis_cfg['port'],
+                                                       max_connections=redis_cfg['max_connections'],
+                                                       timeout=redis_cfg['pool_timeout'],
+                                                       socket_timeout=redis_cfg['socket_timeout'],
+                                                       socket_connect_timeout=redis_cfg['socket_connect_timeout'],
+                                                       health_check_interval=redis_cfg['health_check_interval'])
+    return redis_interface.RedisInterface(storage=redis_cfg['storage'], connection_pool=pool)
+
 
 @instruments.route('/instruments')
 def list_instruments():
@@ -273,10 +301,56 @@ def db_delete_instrument(instrument_id):
     db.session.query(ProsensingPAF).filter(ProsensingPAF.instrument_id == instrument_id).delete()
     db.session.query(InstrumentLog).filter(InstrumentLog.instrument_id == instrument_id).delete()
     db.session.query(PulseCapture).filter(PulseCapture.instrument_id == instrument_id).delete()
+    db.session.query(AttributeRollup).filter(AttributeRollup.instrument_id == instrument_id).delete()
+    db.session.query(RollupProgress).filter(RollupProgress.instrument_id == instrument_id).delete()
     db.session.query(Instrument).filter(Instrument.id == instrument_id).delete()
     db.session.commit()
 
 
+def db_get_attribute_percentiles(instrument_id, table_name, attribute, percentiles):
+    """Gets percentiles of an instrument's values for an attribute, interpolating between the two nearest values with
+    Postgres's 'percentile_cont' (Postgres 9.4 and newer).  Every percentile is found by one aggregate in the database,
+    so the values are never all read into memory.
+
+    Parameters
+    ----------
+    instrument_id: integer
+        Database id of the instrument.
+
+    table_name: string
+        Name of the table the attribute's values are in, either 'events_with_value' or a special table.
+
+    attribute: string
+        The attribute's event code description for 'events_with_value', otherwise its column name.
+
+    percentiles: list of floats
+        Percentiles to get, each from 0 to 100.
+
+    Returns
+    -------
+    Dictionary mapping each percentile to the value at that percentile, or to None if there are no values.
+
+    """
+    if table_name == rollups.EVENTS_TABLE:
+        value_column = "value"
+        source = ("events_with_value WHERE event_code = (SELECT event_code FROM event_codes "
+                  "WHERE description = :attribute)")
+    else:
+        value_column = attribute
+        source = "%s WHERE TRUE" % (table_name,)
+
+    percentile_sql = ("SELECT percentile_cont(CAST(:fractions AS double precision[])) WITHIN GROUP (ORDER BY %s) "
+                      "FROM %s AND instrument_id = :id AND %s IS NOT NULL" % (value_column, source, value_column))
+    fractions = [percentile / 100.0 for percentile in percentiles]
+    values = db.session.execute(percentile_sql, dict(id=instrument_id, attribute=attribute,
+                                                     fractions=fractions)).scalar()
+
+    # With no values the aggregate is NULL
+    if values is None:
+        return dict((percentile, None) for percentile in percentiles)
+    return dict((percentile, float(value)) for percentile, value in zip(percentiles, values))
+
+
 @instruments.route('/instruments/<instrument_id>', methods=['GET', 'DELETE'])
 def instrument(instrument_id):
     """If method is "GET", get for the instrument specified by the instrument id
@@ -456,22 +530,25 @@ def recent_values():
     # First see if we gan get entries from Redis.  Any keys that couldn't get data from Redis will then hit the main DB
     # Hopefully will keep the majority of requests within memory.
     # TODO Fix any unit tests this breaks.  Might not break any if there is a way to cleanly fake connection to Redis
-    redint = redis_interface.RedisInterface()
+    redint = get_redis_interface()
 
+    # Every key is requested from Redis at once, costing one round trip however many keys there are.
+    redis_requests = []
+    redis_key_pairs = []
     for reference in references:
         for key_pair in key_pairs:
             # If the reference is not 'special', it counts as a non table-organized Redis entry.
             if reference.description == key_pair["key"]:
-                result = redint.get_most_recent_value_for_attribute(instrument_id, key_pair["key"])
-                if result and (len(result.keys()) > 0):
-                    key_pair["data"] = (dateutil.parser.parse(result["time"]), float(result["value"]))
+                redis_requests.append((instrument_id, key_pair["key"], None))
+                redis_key_pairs.append(key_pair)
             # If the reference is 'special', it counts as a table-organized Redis entry.
             elif reference.special is True:
-                result = redint.get_most_recent_value_for_attribute(instrument_id, key_pair["key"],
-                                                                    table_name=reference.description)
-                if result and (len(result.keys()) > 0):
-                    key_pair["data"] = (dateutil.parser.parse(result["time"]), float(result["value"]))
+                redis_requests.append((instrument_id, key_pair["key"], reference.description))
+                redis_key_pairs.append(key_pair)
 
+    for key_pair, result in zip(redis_key_pairs, redint.get_most_recent_values(redis_requests)):
+        if result and (len(result.keys()) > 0):
+            key_pair["data"] = (dateutil.parser.parse(result["time"]), float(result["value"]))
 
     for reference in references:
         for key_pair in key_pairs:
@@ -484,10 +561,7 @@ def recent_values():
                     sql_query = ('SELECT time, value FROM events_with_value WHERE instrument_id = :id '
                                  'AND event_code = %s ORDER BY time DESC LIMIT 1') % event_code[0]
                 elif reference.special is True:
-                    rows = db.session.execute("SELECT column_name FROM information_schema.columns WHERE table_name = :table",
-                                              dict(table=reference.description)).fetchall()
-
-                    columns = [row[0] for row in rows]
+                    columns = schema_cache.get_column_names(db.session, reference.description)
                     if key_pair["key"] in columns:
                         sql_query = 'SELECT time, %s FROM %s WHERE instrument_id = :id ORDER BY time DESC LIMIT 1' % (
                             key_pair["key"], reference.description)
@@ -543,6 +617,11 @@ def generate_instrument_graph():
     do_stats: integer
         Passed as an HTML query parameter, indicates whether to do aggregates stats for an attribute (1=true, 0=false).
 
+    max_points: integer, optional
+        Passed as an HTML query parameter, the most points to return.  If more points are in the time range, they are
+        reduced with 'downsample_min_max' before being returned.  The deviations and stats are still calculated from
+        every point.  If not given, every point is returned.
+
     Returns
     -------
     message: JSON object
@@ -561,6 +640,7 @@ def generate_instrument_graph():
     start = request.args.get("start")
     end = request.args.get("end")
     do_stats = request.args.get("do_stats")
+    max_points = request.args.get("max_points", type=int)
 
     keys = {index: dict(key=a_key, data=None) for index, a_key in enumerate(arg_keys)}
 
@@ -577,7 +657,7 @@ def generate_instrument_graph():
     # TODO Need to make sure that this redis functionality is either reflected or omitted in the (probably broken) tests
     # TODO Hit redis first, may need to run averages and std_deviation on the returned data.
 
-    redint = redis_interface.RedisInterface()
+    redint = get_redis_interface()
 
     for reference in references:
         for key, value in keys.iteritems():
@@ -616,29 +696,18 @@ def generate_instrument_graph():
                 if reference.description == value["key"]:
                     event_code = db.session.execute('SELECT event_code FROM event_codes WHERE description = :key',
                                                     dict(key=value["key"])).fetchone()
-                    aggregate_query = ('SELECT avg(value), stddev_pop(value) FROM events_with_value '
-                                       'WHERE instrument_id = :id AND event_code = :event_code AND '
-                                       'time >= :origin AND time <= :end')
-                    db_aggregates = db.session.execute(aggregate_query, dict(id=instrument_id, event_code=event_code[0],
-                                                                             origin=origin, end=end)).fetchall()[0]
-
-                    average = db_aggregates[0]
-                    std_deviation = db_aggregates[1]
+                    _, _, average, std_deviation, _ = rollups.get_attribute_aggregates(
+                        db.session, instrument_id, rollups.EVENTS_TABLE, value["key"],
+                        dateutil.parser.parse(origin), dateutil.parser.parse(end))
 
                     sql_query = ('SELECT time, value FROM events_with_value WHERE instrument_id = :id '
                                  'AND time >= :start AND time <= :end AND event_code = %s ORDER BY time DESC') % event_code[0]
                 elif reference.special is True:
-                    rows = db.session.execute("SELECT column_name FROM information_schema.columns WHERE table_name = :table",
-                                              dict(table=reference.description)).fetchall()
-
-                    columns = [row[0] for row in rows]
+                    columns = schema_cache.get_column_names(db.session, reference.description)
                     if value["key"] in columns:
-                        aggregate_query = 'SELECT avg(%s), stddev_pop(%s) FROM %s WHERE instrument_id = :id AND time >= :origin AND time <= :end' % (value['key'], value['key'], reference.description)
-                        db_aggregates = db.session.execute(aggregate_query,
-                                                           dict(id=instrument_id, origin=origin, end=end)).fetchall()[0]
-
-                        average = db_aggregates[0]
-                        std_deviation = db_aggregates[1]
+                        _, _, average, std_deviation, _ = rollups.get_attribute_aggregates(
+                            db.session, instrument_id, reference.description, value["key"],
+                            dateutil.parser.parse(origin), dateutil.parser.parse(end))
 
                         sql_query = 'SELECT time, %s FROM %s WHERE instrument_id = :id AND time >= :start AND time <= :end AND %s IS NOT NULL ORDER BY time DESC' % (
                             value["key"], reference.description, value["key"])
@@ -652,6 +721,8 @@ def generate_instrument_graph():
                         return json.dumps("[]")
 
     data = synchronize_sort(keys)
+    if max_points:
+        data = downsample_min_max(data, max_points)
     map(iso_first_element, data)
 
     lower_deviation = 0
@@ -677,9 +748,10 @@ def generate_instrument_graph():
 
 
 @instruments.route('/attribute_stats')
-def get_attribute_stats(attribute=None, instrument_id=None):
+def get_attribute_stats(attribute=None, instrument_id=None, percentiles=None):
     """Generates aggregate data on an attribute for an instrument (min, max, mean, standard deviation)
-    and returns it in a JSON dictionary.
+    and returns it in a JSON dictionary.  The min, max, mean and standard deviation are read from the attribute's hourly
+    and daily rollups, so only data saved since the rollups were last updated is read from the data tables.
 
     Parameters
     ----------
@@ -690,12 +762,17 @@ def get_attribute_stats(attribute=None, instrument_id=None):
         Can be passed as an HTML query parameter, the id of the instrument in the
             database, indicates which instrument's data to use.
 
+    percentiles: list of floats, optional
+        Can be passed as an HTML query parameter of comma separated numbers, such as "5,95", the percentiles of the
+        values to return, each from 0 to 100.  The median is always returned.
+
     Returns
     -------
     message: JSON object
         Returns a JSON object as a list of the attribute's aggregate data, of the form:
         {'min': (minimum of all values), 'max': (maximum of all values), 'average': (average of all values),
-        'std_deviation': (standard deviation for the data set)
+        'std_deviation': (standard deviation for the data set), 'median': (50th percentile of all values),
+        'percentiles': {(each requested percentile): (value at the percentile)}
         }
 
     """
@@ -705,12 +782,22 @@ def get_attribute_stats(attribute=None, instrument_id=None):
     arg_instrument_id = request.args.get("instrument_id")
     if arg_instrument_id:
         instrument_id = arg_instrument_id
+    arg_percentiles = request.args.get("percentiles")
+    if arg_percentiles:
+        try:
+            percentiles = [float(percentile) for percentile in arg_percentiles.split(",")]
+        except ValueError:
+            abort(400)
+    if percentiles is None:
+        percentiles = []
+    if [percentile for percentile in percentiles if not 0 <= percentile <= 100]:
+        abort(400)
 
     minimum = None
     maximum = None
-    median = None
     average = None
     std_deviation = None
+    percentile_values = {}
 
     if attribute not in valid_columns_for_instrument(instrument_id):
         up_logger.debug("key %s not in valid columns for instrument id %s", attribute, instrument_id)
@@ -721,49 +808,85 @@ def get_attribute_stats(attribute=None, instrument_id=None):
 
     for ref in references:
         if ref.description == attribute:
-            event_code = db.session.execute('SELECT event_code FROM event_codes WHERE description = :attribute',
-                                            dict(attribute=attribute)).fetchone()[0]
-            aggregate_sql = 'SELECT min(value), max(value), avg(value), stddev_pop(value) FROM events_with_value WHERE instrument_id = :id AND event_code = %s' % (event_code,)
-            db_aggregates = db.session.execute(aggregate_sql, dict(column=attribute, id=instrument_id)).fetchall()[0]
-
-            db_values = (db.session.query(EventWithValue.value)
-                         .filter(EventWithValue.instrument_id == instrument_id)
-                         .filter(EventWithValue.event_code_id == int(event_code))
-                         .filter(EventWithValue.value.isnot(None)).all())
-
-            values = [value[0] for value in db_values]
-            values = sorted(values)
-            median = values[len(values)/2]
+            db_aggregates = rollups.get_attribute_aggregates(db.session, instrument_id, rollups.EVENTS_TABLE, attribute)
+            percentile_values = db_get_attribute_percentiles(instrument_id, rollups.EVENTS_TABLE, attribute,
+                                                             [50.0] + percentiles)
 
         elif ref.special is True:
-            rows = db.session.execute("SELECT column_name FROM information_schema.columns WHERE table_name = :table",
-                                      dict(table=ref.description)).fetchall()
-            columns = [row[0] for row in rows]
+            columns = schema_cache.get_column_names(db.session, ref.description)
 
             if attribute in columns:
-                aggregate_parameters = (attribute, attribute, attribute, attribute, ref.description)
-                aggregate_sql = 'SELECT min(%s), max(%s), avg(%s), stddev_pop(%s) FROM %s WHERE instrument_id = :id' % aggregate_parameters
-                db_aggregates = db.session.execute(aggregate_sql, dict(id=instrument_id)).fetchall()[0]
-
-                values_sql = "SELECT %s FROM %s WHERE instrument_id = :id" % (attribute, ref.description,)
-                db_values = db.session.execute(values_sql, dict(id=instrument_id)).fetchall()
-                values = [value[0] for value in db_values]
-                values = sorted(values)
-                median = values[len(values)/2]
+                db_aggregates = rollups.get_attribute_aggregates(db.session, instrument_id, ref.description, attribute)
+                percentile_values = db_get_attribute_percentiles(instrument_id, ref.description, attribute,
+                                                                 [50.0] + percentiles)
                 break
 
-    if db_aggregates:
+    if db_aggregates and db_aggregates[4]:
         minimum = float(db_aggregates[0])
         maximum = float(db_aggregates[1])
         average = float(db_aggregates[2])
         std_deviation = float(db_aggregates[3])
 
-    payload = dict(min=minimum, max=maximum, median=median, average=average, std_deviation=std_deviation)
+    requested_percentiles = dict(("%g" % percentile, percentile_values.get(percentile)) for percentile in percentiles)
+    payload = dict(min=minimum, max=maximum, median=percentile_values.get(50.0), average=average,
+                   std_deviation=std_deviation, percentiles=requested_percentiles)
     message = json.dumps(payload)
 
     return message
 
 
+def downsample_min_max(rows, max_points):
+    """Reduces a list of time ordered rows to at most 'max_points' rows while keeping the shape of each series.  The
+    rows are split into equal buckets of consecutive rows, and from each bucket only the rows holding the minimum and
+    the maximum value of each series are kept, so peaks and dips stay visible when plotted, unlike when averaging or
+    keeping every Nth row.
+
+    Parameters
+    ----------
+    rows: list of lists
+        Rows of the form [time, value_1, value_2, ... value_N], as returned by 'synchronize_sort', ordered by time.  Any
+        value that is not a number, such as None or "NULL", is ignored when finding the minimum and maximum.
+
+    max_points: integer
+        Maximum number of rows to return.
+
+    Returns
+    -------
+    rows: list of lists
+        The kept rows, in their original order.  If there were no more than 'max_points' rows, the original list.
+
+    """
+    if max_points <= 0 or len(rows) <= max_points:
+        return rows
+
+    series_count = max(len(rows[0]) - 1, 1)
+    # Each bucket can keep up to two rows for each series, so this many buckets never returns more than 'max_points'.
+    # With fewer points than that, each bucket keeps a single row instead, alternating between the minimum and the
+    # maximum of the first series with a value, so peaks and dips still both show.
+    single_row = max_points < 2 * series_count
+    bucket_count = max_points if single_row else max_points // (2 * series_count)
+    bucket_size = int(math.ceil(len(rows) / float(bucket_count)))
+
+    downsampled_rows = []
+    for bucket_number, bucket_start in enumerate(xrange(0, len(rows), bucket_size)):
+        bucket = rows[bucket_start:bucket_start + bucket_size]
+        kept_indices = set()
+        for series in xrange(1, series_count + 1):
+            values = [(row[series], index) for index, row in enumerate(bucket)
+                      if isinstance(row[series], numbers.Number)]
+            if values and single_row:
+                kept_indices.add(min(values)[1] if bucket_number % 2 == 0 else max(values)[1])
+                break
+            if values:
+                kept_indices.add(min(values)[1])
+                kept_indices.add(max(values)[1])
+        if single_row and not kept_indices:
+            kept_indices.add(0)
+        downsampled_rows.extend(bucket[index] for index in sorted(kept_indices))
+
+    return downsampled_rows
+
+
 def iso_first_element(input_list):
     """Update first element of input list from a python datetime object into an ISO formatted time.
     (Used as map function).
@@ -858,10 +981,8 @@ def update_valid_columns_for_instrument(instrument_id):
                                     .all())
         special_valid_columns = [column.column_name for column in db_special_valid_columns]
 
-        db_table_columns = db.session.execute(
-                "SELECT column_name, data_type from information_schema.columns WHERE table_name = :table",
-                dict(table=ref.description))
-        table_columns = [row[0] for row in db_table_columns if row[1] in ["integer", "double precision"]]
+        table_columns = [column_name for column_name, data_type in schema_cache.get_columns(db.session, ref.description)
+                         if data_type in ["integer", "double precision"]]
 
         # These columns are viable columns that are not already in the Valid Columns table.
         # These are the columns that need to be checked to determine if they are now valid columns
@@ -892,12 +1013,38 @@ def update_valid_columns_for_instrument(instrument_id):
     return message
 
 
+def time_ordered_elements(set_number, data):
+    """Yields the elements of a data set for 'synchronize_sort' to merge, from earliest to latest time, as (time, set
+    number, position, value) tuples.  The merge compares them by time, then set number, and the position keeps repeated
+    times within a set in order without ever comparing the values.
+
+    Parameters
+    ----------
+    set_number: integer
+        Number of the data set in the dictionary passed to 'synchronize_sort'.
+
+    data: list of tuples
+        The data set's (time, value) pairs, sorted from latest to earliest time.
+
+    Yields
+    ------
+    element: tuple
+        (time, set_number, position, value) for each element of the data set.
+
+    """
+    for position, element in enumerate(reversed(data)):
+        yield element[0], set_number, position, element[1]
+
+
 def synchronize_sort(dataset_dict):
-    """Sorts a dictionary of data sets to be consistent in time.  Each iteration, it checks the earliest time of each
-    data set, gets the earliest time from among them, then sets that as the time for the next return element.  It then
-    checks the earliest element of each data set to see which data set elements match, removing matching elements and
-    placing their values in the set's place in the resulting element.  The process iterates until all data sets are
-    empty, and then returns the list of the merged time/value sets.
+    """Sorts a dictionary of data sets to be consistent in time.  The data sets are merged in time order, and every
+    element of the result holds one time, with each data set's value at that time in the set's place in the element, or
+    None if the set has no value at that time.  If a data set has more than one value at the same time, each of them
+    goes in its own result element for that time.
+
+    The data sets are merged with a heap holding the next element of each set, so sorting N data sets with a total of M
+    elements takes O(M log N) time.  Data sets that all have the same times, such as attributes from the same table,
+    are zipped together instead.
 
     Starts with data sets:
 
@@ -931,31 +1078,33 @@ def synchronize_sort(dataset_dict):
     results = []
     length = len(dataset_dict)
 
-    # This sums the lengths of the data sets being sorted.
-    while sum([len(value["data"]) for _, value in dataset_dict.iteritems()]) > 0:
-
-        # Gets a list of the times containing the first element of each data set (therefore, the most earliest time for
-        # the set), but only if the set is not empty.
-        first_elem_times = [value["data"][-1][0] for _, value in dataset_dict.iteritems() if len(value["data"]) > 0]
-        # Gets the earliest of the times of the data sets
-        min_time = min(first_elem_times)
-
-        # Creates an element to be pushed into the return list.  The first is the time for that particular element, the
-        # rest are initialized to none.  If the next value of a data set occurs at the time that this list is designated
-        # for, the value is put into the element according to the set's attribute number.  For example, if there are 3
-        # data sets and the first elements of each are (1:00, 15), (2:00, 30) and (1:00, 20), the result element would
-        # be [1:00, 15, None, 20].
-        values_at_time = [min_time] + [None] * length
-        for set_number, value in dataset_dict.iteritems():
-            # Any data sets that have elements and have a time equal to the time for this point puts that data
-            # in for that point and removes that element from its list.  Updates the index of the data point
-            # that corresponds to the list's dictionary value.  This assures that each element of the packet
-            # stays in the same order as the list.  If there is no valid value, stays None
-            if len(value["data"]) > 0 and value["data"][-1][0] == min_time:
-                # 'set_number + 1' is necessary because the first element [0] is for the time.
-                values_at_time[set_number + 1] = value["data"][-1][1]
-                del value["data"][-1]
-
-        # Add point in time to result list
-        results.append(values_at_time)
+    datasets = [dataset_dict[set_number]["data"] for set_number in sorted(dataset_dict)]
+    if datasets:
+        times = [element[0] for element in datasets[0]]
+        if all(len(data) == len(times) and [element[0] for element in data] == times for data in datasets[1:]):
+            return [[elements[0][0]] + [element[1] for element in elements] for elements in reversed(zip(*datasets))]
+
+    ordered_sets = [time_ordered_elements(set_number, value["data"]) for set_number, value in dataset_dict.iteritems()]
+
+    current_time = None
+    elements_at_time = []
+    set_counts_at_time = {}
+    for time, set_number, _, set_value in heapq.merge(*ordered_sets):
+        if not elements_at_time or time != current_time:
+            current_time = time
+            elements_at_time = []
+            set_counts_at_time = {}
+
+        # The first value of a set at this time goes in the first element for the time, a second value in a second
+        # element, and so on, adding a new element with every value initialized to None when there is not one yet.
+        occurrence = set_counts_at_time.get(set_number, 0)
+        set_counts_at_time[set_number] = occurrence + 1
+        if occurrence == len(elements_at_time):
+            values_at_time = [time] + [None] * length
+            elements_at_time.append(values_at_time)
+            results.append(values_at_time)
+
+        # 'set_number + 1' is necessary because the first element [0] is for the time.
+        elements_at_time[occurrence][set_number + 1] = set_value
+
     return results
@@ -142,8 +142,8 @@ def new_log():
     new_db_log.status = request.args.get('status')
     new_db_log.contents = request.args.get('contents')
 
-    cfg = config.get_config_context()
-    cert_verify = cfg['setup']['cert_verify']
+    # Either False or the path to a certificate, so it is read as is
+    cert_verify = config.get_value("setup.cert_verify")
 
     # If there is valid data entered with the get request, insert and redirect to the instrument
     # that the log was placed for
@@ -165,13 +165,13 @@ def new_log():
                 up_logger.error("Invalid Date/Time format for new log entry.  Value: %s", new_db_log.time)
             else:
                 # If it is not a central facility, pass the log to the central facility
-                if not cfg['type']['central_facility']:
+                if not config.get_bool("type.central_facility"):
                     packet = dict(event_code=5,
                                   data=dict(instrument_id=new_db_log.instrument_id, author_id=new_db_log.author_id,
                                             time=str(new_db_log.time), status=new_db_log.status,
                                             contents=new_db_log.contents, supporting_images=None))
                     payload = json.dumps(packet)
-                    requests.post(cfg['setup']['cf_url'], data=payload,
+                    requests.post(config.get_string("setup.cf_url"), data=payload,
                                   headers={'Content-Type': 'application/json'}, verify=cert_verify)
 
                 # If planning to create another, redirect back to this page.  Prevents previous log information
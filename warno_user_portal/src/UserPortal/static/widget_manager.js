@@ -3121,6 +3121,8 @@ InstrumentGraph.prototype.generateInstrumentGraph = function(){
         graphWidth = 750;
         graphHeight = 600;
     }
+    // The server only needs to send as many points as the graph can show, two per pixel for the minimum and maximum
+    this.maxPoints = 2 * graphWidth;
 
     // Enable copy button and change title to reflect functionality
     var copyButton = document.getElementById("inst-graph-copy-button-" + this.id);
@@ -3615,7 +3617,8 @@ InstrumentGraph.prototype.updateInstrumentGraph = function() {
               "&start=" + startUTC +
               "&end=" + endUTC +
               "&origin=" + originUTC +
-              "&do_stats=" + doStats;
+              "&do_stats=" + doStats +
+              "&max_points=" + this.maxPoints;
     xmlhttp.open("POST", url, true);
     //Send out the  request
     xmlhttp.send();
@@ -11,7 +11,7 @@ from UserPortal import views
 from WarnoConfig import config
 from WarnoConfig import redis_interface
 from WarnoConfig.models import db
-from WarnoConfig.models import Instrument, InstrumentLog, Site, InstrumentDataReference, ValidColumn
+from WarnoConfig.models import Instrument, InstrumentLog, Site, InstrumentDataReference, ValidColumn, EventWithValue
 
 
 @mock.patch("logging.Logger")
@@ -272,6 +272,19 @@ class TestInstruments(TestCase, FixturesMixin):
                          "Number of logs returned does not match given 'maximum_number' parameter.")
 
     # Helper Functions
+    def test_db_get_attribute_percentiles_interpolates_between_nearest_values_like_percentile_cont(self, logger):
+        """Tests that percentiles falling between two values are interpolated between them.  With the fixture's value
+        of 123 and added values of 1, 2 and 3, the ordered values are [1, 2, 3, 123]."""
+        for index, value in enumerate([1, 2, 3]):
+            db.session.add(EventWithValue(instrument_id=1, event_code_id=3, value=value,
+                                          time=datetime.datetime(2001, 1, 1, 2, index)))
+        db.session.commit()
+
+        result = instruments.db_get_attribute_percentiles(1, "events_with_value", "not_special", [0, 25, 50, 100])
+
+        self.assertDictEqual(result, {0: 1.0, 25: 1.75, 50: 2.5, 100: 123.0},
+                             "Percentiles were not interpolated between the nearest values.")
+
     def test_valid_columns_for_instrument_returns_expected_column_list_for_both_special_and_non_special_references(self, logger):
         """Calling the 'valid_columns_for_instrument' function returns a list of the columns available to graph for the
         instrument with the id matching 'instrument_id'.  This test checks that some expected columns from  the fixtures
@@ -333,6 +346,50 @@ class TestInstruments(TestCase, FixturesMixin):
         self.assertListEqual(returned_list, expected_return, "The expected result list of synchronize_sort and the "
                                                              "actual list returned do not match.")
 
+    def test_synchronize_sort_gives_each_repeated_time_its_own_element_whether_data_sets_share_times(self, logger):
+        """Tests that a time repeated within data sets gets one result element for each repeat, both when the data sets
+        have the same times and are zipped together, and when they have different times and are merged."""
+        early_time = datetime.datetime(2015, 5, 11, 1)
+        late_time = datetime.datetime(2015, 5, 11, 2)
+        shared_times = {0: dict(data=[(late_time, 3), (early_time, 2), (early_time, 1)]),
+                        1: dict(data=[(late_time, 13), (early_time, 12), (early_time, 11)])}
+        different_times = {0: dict(data=[(late_time, 3), (early_time, 2), (early_time, 1)]),
+                           1: dict(data=[(early_time, 11)])}
+
+        self.assertListEqual(instruments.synchronize_sort(shared_times),
+                             [[early_time, 1, 11], [early_time, 2, 12], [late_time, 3, 13]],
+                             "Data sets with the same times were not zipped together in time order.")
+        self.assertListEqual(instruments.synchronize_sort(different_times),
+                             [[early_time, 1, 11], [early_time, 2, None], [late_time, 3, None]],
+                             "Repeated times were not given their own elements when merging.")
+
+    def test_downsample_min_max_keeps_minimum_and_maximum_of_each_bucket_in_time_order(self, logger):
+        """Tests that 8 rows reduced to at most 4 points are split into two buckets of 4 rows, and that only the rows
+        holding each bucket's minimum and maximum value are kept, in their original order, ignoring "NULL" values."""
+        start_time = datetime.datetime(2015, 5, 11)
+        values = [5, 1, "NULL", 9, 4, 4, 0, 7]
+        input_rows = [[start_time + datetime.timedelta(minutes=index), value] for index, value in enumerate(values)]
+
+        returned_rows = instruments.downsample_min_max(input_rows, 4)
+
+        self.assertListEqual(returned_rows, [input_rows[1], input_rows[3], input_rows[6], input_rows[7]],
+                             "The minimum and maximum rows of each bucket were not kept in time order.")
+        self.assertIs(instruments.downsample_min_max(input_rows, 8), input_rows,
+                      "Rows were downsampled even though there were not more than 'max_points' of them.")
+
+    def test_downsample_min_max_keeps_one_row_per_bucket_when_there_are_too_few_points_for_every_series(self, logger):
+        """Tests that 6 rows of 3 series reduced to at most 3 points, fewer than the minimum and maximum of each series
+        need, return 3 rows, alternating between the minimum and maximum of the first series."""
+        start_time = datetime.datetime(2015, 5, 11)
+        values = [5, 1, 2, 9, 4, 0]
+        input_rows = [[start_time + datetime.timedelta(minutes=index), value, -value, None]
+                      for index, value in enumerate(values)]
+
+        returned_rows = instruments.downsample_min_max(input_rows, 3)
+
+        self.assertListEqual(returned_rows, [input_rows[1], input_rows[3], input_rows[5]],
+                             "One row per bucket, alternating minimum and maximum, was not kept.")
+
     def test_iso_first_elements_changes_the_datetime_object_first_element_of_a_list_to_iso_format_in_place(self, logger):
         """Tests that the first element of a list is properly converted from a python datetime object into an ISO 8601
         formatted string in place."""
@@ -0,0 +1,65 @@
+import os
+
+from flask.ext.testing import TestCase
+
+from UserPortal import views
+from WarnoConfig import config
+from WarnoConfig.models import db
+
+# The queries the User Portal runs most often against the data tables, with the table each one reads.  Each should be
+# answered through one of the table's indexes rather than by reading the whole table.
+HOT_QUERIES = [
+    ("events_with_value", "SELECT time, value FROM events_with_value WHERE instrument_id = :id AND time >= :start "
+                          "AND time <= :end AND event_code = 3 ORDER BY time DESC"),
+    ("events_with_value", "SELECT count(value), sum(value) FROM events_with_value WHERE event_code = 3 "
+                          "AND instrument_id = :id AND (time >= :start AND time < :end)"),
+    ("prosensing_paf", "SELECT time, antenna_temp FROM prosensing_paf WHERE instrument_id = :id AND time >= :start "
+                       "AND time <= :end AND antenna_temp IS NOT NULL ORDER BY time DESC"),
+    ("iris_bite", "SELECT time, azimuth FROM iris_bite WHERE instrument_id = :id AND time >= :start "
+                  "AND time <= :end AND azimuth IS NOT NULL ORDER BY time DESC"),
+    ("events_with_text", "SELECT time, text FROM events_with_text WHERE instrument_id = :id AND time >= :start "
+                         "AND time <= :end ORDER BY time DESC"),
+    ("instrument_logs", "SELECT * FROM instrument_logs WHERE instrument_id = :id ORDER BY time DESC LIMIT 5"),
+    ("pulse_captures", "SELECT time, data FROM pulse_captures WHERE instrument_id = :id AND time >= :start "
+                       "AND time <= :end ORDER BY time DESC"),
+]
+
+
+class TestQueryPlans(TestCase):
+    """Checks the query plans of the User Portal's most frequent data table queries."""
+    db_cfg = config.get_config_context()['database']
+    s_db_cfg = config.get_config_context()['s_database']
+    TESTING = True
+
+    def setUp(self):
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def create_app(self):
+        views.app.config['TESTING'] = True
+        views.app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql://%s:%s@%s:%s/%s' % (self.db_cfg['DB_USER'],
+                                                                                       self.s_db_cfg['DB_PASS'],
+                                                                                       self.db_cfg['DB_HOST'],
+                                                                                       self.db_cfg['DB_PORT'],
+                                                                                       self.db_cfg['TEST_DB_NAME'])
+        return views.app
+
+    def test_hot_queries_do_not_fall_back_to_sequential_scans(self):
+        """Tests that each hot query can be answered using an index.  The test tables are nearly empty, where reading
+        the whole table is cheapest, so sequential scans are disabled for the session: the planner still uses one if
+        there is no usable index, which is what fails the test."""
+        db.session.execute("SET enable_seqscan = off")
+
+        sequential_scans = []
+        for table, query in HOT_QUERIES:
+            rows = db.session.execute("EXPLAIN " + query, dict(id=1, start="2017-01-01T00:00:00",
+                                                               end="2017-01-02T00:00:00")).fetchall()
+            plan = "\n".join(row[0] for row in rows)
+            if "Seq Scan on %s" % (table,) in plan:
+                sequential_scans.append("%s\n%s" % (query, plan))
+
+        self.assertListEqual(sequential_scans, [], "Queries fell back to sequential scans:\n%s"
+                             % ("\n\n".join(sequential_scans),))